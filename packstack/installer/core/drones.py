@@ -1,84 +1,296 @@
 # -*- coding: utf-8 -*-
 
 import os
+import gzip
 import stat
+import hashlib
 import uuid
 import time
+import Queue
+import shutil
 import logging
 import tarfile
 import tempfile
+import threading
+import subprocess
+
+from cStringIO import StringIO
 
 from .. import utils
+from ..exceptions import DroneError, NetworkError, ScriptRuntimeError
+
+
+# gzip compression levels of transfer codecs, None means no compression
+TRANSFER_CODECS = {'none': None, 'fast': 1, 'best': 9}
+SSH_OPTS = ['-o', 'StrictHostKeyChecking=no',
+            '-o', 'UserKnownHostsFile=/dev/null']
+# directory in resource directory on node with hashes of extracted bundles
+BUNDLE_MARKER_DIR = '.bundles'
+
+
+def write_archive(fileobj, members, level, dereference=False):
+    """
+    Writes tar archive of given (path, arcname) members to fileobj,
+    compressed by given gzip level unless level is None. Symbolic links
+    are archived as files they point to if dereference is True.
+    """
+    stream = fileobj
+    if level is not None:
+        stream = gzip.GzipFile(fileobj=fileobj, mode='wb',
+                               compresslevel=level)
+    pack = tarfile.open(fileobj=stream, mode='w|', dereference=dereference)
+    try:
+        for path, arcname in members:
+            pack.add(path, arcname=arcname)
+        pack.close()
+    except (IOError, OSError):
+        # broken stream must not be flushed on garbage collection
+        pack.fileobj.closed = True
+        raise
+    if stream is not fileobj:
+        stream.close()
+
+
+def bundle_digest(members, dereference=False):
+    """
+    Returns hash of names, modes and content of all files of given
+    (path, arcname) members.
+    """
+    digest = hashlib.sha1()
+    stat_func = dereference and os.stat or os.lstat
+
+    def add(path, arcname):
+        info = stat_func(path)
+        digest.update('%s\0%o\0' % (arcname, stat.S_IMODE(info.st_mode)))
+        if stat.S_ISLNK(info.st_mode):
+            digest.update('link\0%s\0' % os.readlink(path))
+        elif stat.S_ISREG(info.st_mode):
+            digest.update('file\0%d\0' % info.st_size)
+            with open(path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), ''):
+                    digest.update(chunk)
+        elif stat.S_ISDIR(info.st_mode):
+            digest.update('dir\0')
+            for name in sorted(os.listdir(path)):
+                add(os.path.join(path, name), os.path.join(arcname, name))
+
+    for path, arcname in members:
+        add(path, arcname)
+    return digest.hexdigest()
+
+
+class ResourceBundle(object):
+    """
+    Tar archive of resources identified by hash of their content. Archive
+    is built once per compression level and reused by all drones
+    transferring it.
+    """
+    def __init__(self, members, directory, dereference=False):
+        self.members = members
+        self.directory = directory
+        self.dereference = dereference
+        self.digest = bundle_digest(members, dereference)
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def path(self, level):
+        """
+        Returns path of the archive compressed by given gzip level.
+        """
+        with self._lock:
+            if level not in self._paths:
+                suffix = level is None and 'tar' or 'tar.gz%d' % level
+                path = os.path.join(self.directory,
+                                    '%s.%s' % (self.digest, suffix))
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             stat.S_IRUSR | stat.S_IWUSR)
+                with os.fdopen(fd, 'wb') as pack:
+                    write_archive(pack, self.members, level,
+                                  self.dereference)
+                self._paths[level] = path
+            return self._paths[level]
+
+
+class BundleCache(object):
+    """
+    Resource bundles shared by drones, drones with the same resources get
+    the same bundle. Resources must not change while the cache is used.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._bundles = {}
+        self._lock = threading.Lock()
+
+    def get(self, members):
+        key = tuple(members)
+        with self._lock:
+            if key not in self._bundles:
+                if not self.directory:
+                    self.directory = tempfile.mkdtemp(prefix='bundles')
+                elif not os.path.isdir(self.directory):
+                    os.makedirs(self.directory, 0700)
+                self._bundles[key] = ResourceBundle(members, self.directory)
+            return self._bundles[key]
+
+    def cleanup(self):
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self._bundles = {}
 
 
 class SshTarballTransferMixin(object):
     """
-    Transfers resources and recipes by packing them to tar.gz and
-    copying it via ssh.
+    Transfers resources and recipes by streaming tar archive to tar
+    extracting it on node over single ssh connection. Archive is compressed
+    by codec given in transfer_codec, see TRANSFER_CODECS. Resources are
+    transferred as content hashed bundle taken from bundle_cache, which is
+    shared by all drones of DroneFleet, and are not transferred at all if
+    the node already has the bundle.
     """
-    def _transfer(self, pack_path, pack_dest, res_dir):
-        node = self.node
-        args = locals()
-        # copy and extract tarball
-        script = utils.ScriptRunner()
-        script.append("scp %(pack_path)s root@%(node)s:%(pack_dest)s"
-                      % args)
-        script.append("ssh -o StrictHostKeyChecking=no "
-                        "-o UserKnownHostsFile=/dev/null root@%(node)s "
-                        "tar -C %(res_dir)s -xpzf %(pack_dest)s" % args)
+    transfer_codec = 'fast'
+    bundle_cache = None
+
+    def _remote_command(self, script):
+        """
+        Returns command running given shell script on self.node.
+        """
+        return ['ssh'] + SSH_OPTS + ['root@%s' % self.node, script]
+
+    def _extract_command(self, res_dir, compressed, before=None,
+                         after=None):
+        """
+        Returns command extracting archive read from stdin to res_dir
+        on self.node and running given scripts before extraction and after
+        successful extraction.
+        """
+        flags = compressed and '-xpzf' or '-xpf'
+        script = 'mkdir -p %s' % res_dir
+        if before:
+            script = '%s && %s' % (script, before)
+        script = '%s && tar -C %s %s -' % (script, res_dir, flags)
+        if after:
+            script = '%s && %s' % (script, after)
+        return self._remote_command(script)
+
+    def _codec_level(self):
+        if self.transfer_codec not in TRANSFER_CODECS:
+            raise ValueError('Unknown transfer codec %s, use one of: %s'
+                             % (self.transfer_codec,
+                                ', '.join(sorted(TRANSFER_CODECS))))
+        return TRANSFER_CODECS[self.transfer_codec]
+
+    def _transfer(self, members, res_dir, archive=None, before=None,
+                  after=None):
+        """
+        Streams given (path, arcname) members to res_dir on self.node.
+        If archive path is given, the already built archive is streamed
+        instead, it has to be compressed by current codec.
+        """
+        level = self._codec_level()
+        cmd = self._extract_command(res_dir, level is not None,
+                                    before=before, after=after)
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                    stdout=devnull, stderr=subprocess.PIPE,
+                                    close_fds=True)
+        error = None
         try:
-            script.execute()
-        except ScriptRuntimeError as ex:
+            if archive:
+                with open(archive, 'rb') as pack:
+                    shutil.copyfileobj(pack, proc.stdin)
+            else:
+                write_archive(proc.stdin, members, level)
+        except (IOError, OSError), ex:
+            # extractor has exited, its stderr contains the reason
+            error = ex
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        err = proc.stderr.read()
+        proc.wait()
+        if proc.returncode or error:
             # TO-DO: change to appropriate exception
             raise RuntimeError('Failed to copy resources to node %s. '
-                               'Reason: %s' % (node, ex))
+                               'Reason: %s' % (self.node, err or error))
 
-    def _pack_resources(self):
-        randpart = uuid.uuid4().hex[:8]
-        pack_path = os.path.join(self.local_tmpdir,
-                                 'res-%s.tar.gz' % randpart)
-        pack = tarfile.open(pack_path, mode='w:gz')
-        os.chmod(pack_path, stat.S_IRUSR | stat.S_IWUSR)
+    def _has_bundle(self, digest):
+        """
+        Returns True if bundle of given hash was already extracted
+        to resource directory on self.node.
+        """
+        marker = os.path.join(self.resource_dir, BUNDLE_MARKER_DIR, digest)
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(self._remote_command('test -e %s'
+                                                         % marker),
+                                    stdin=devnull, stdout=devnull,
+                                    stderr=devnull, close_fds=True)
+        return proc.wait() == 0
+
+    def _resource_members(self):
+        members = []
         for path, dest in self._resources:
             if not dest:
                 dest = os.path.basename(path)
-            pack.add(path,
-                     arcname=os.path.join(dest, os.path.basename(path)))
-        pack.close()
-        return pack_path
+            members.append((path,
+                            os.path.join(dest, os.path.basename(path))))
+        return members
 
-    def _copy_resources(self):
-        pack_path = self._pack_resources()
-        pack_dest = os.path.join(self.remote_tmpdir,
-                                 os.path.basename(pack_path))
-        self._transfer(pack_path, pack_dest, self.resource_dir)
-
-    def _pack_recipes(self):
-        randpart = uuid.uuid4().hex[:8]
-        pack_path = os.path.join(self.local_tmpdir,
-                                 'rec-%s.tar.gz' % randpart)
-        pack = tarfile.open(pack_path, mode='w:gz')
-        os.chmod(pack_path, stat.S_IRUSR | stat.S_IWUSR)
+    def _recipe_members(self):
         if self.recipe_dir.startswith(self.resource_dir):
             dest = self.recipe_dir[len(self.resource_dir):].lstrip('/')
         else:
             dest = ''
+        members = []
         for marker, recipes in self._recipes.iteritems():
             for path in recipes:
-                _dest = os.path.join(dest, os.path.basename(path))
-                pack.add(path, arcname=_dest)
-        pack.close()
+                members.append((path,
+                                os.path.join(dest, os.path.basename(path))))
+        return members
+
+    def _pack(self, prefix, members):
+        randpart = uuid.uuid4().hex[:8]
+        pack_path = os.path.join(self.local_tmpdir,
+                                 '%s-%s.tar.gz' % (prefix, randpart))
+        fd = os.open(pack_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                     stat.S_IRUSR | stat.S_IWUSR)
+        with os.fdopen(fd, 'wb') as pack:
+            write_archive(pack, members, 9)
         return pack_path
 
+    def _pack_resources(self):
+        return self._pack('res', self._resource_members())
+
+    def _copy_resources(self):
+        if self.bundle_cache is None:
+            self.bundle_cache = BundleCache(os.path.join(self.local_tmpdir,
+                                                         'bundles'))
+        bundle = self.bundle_cache.get(self._resource_members())
+        if self._has_bundle(bundle.digest):
+            # TO-DO: complete logger name when logging will be setup
+            # correctly
+            logger = logging.getLogger()
+            logger.debug('Node %s already has resource bundle %s.'
+                         % (self.node, bundle.digest))
+            return
+        # the directory contains only content of the last bundle, so marker
+        # of previous bundle is removed before its files are overwritten
+        markers = os.path.join(self.resource_dir, BUNDLE_MARKER_DIR)
+        self._transfer(bundle.members, self.resource_dir,
+                       archive=bundle.path(self._codec_level()),
+                       before='rm -rf %s' % markers,
+                       after='mkdir -p %s && touch %s/%s'
+                             % (markers, markers, bundle.digest))
+
+    def _pack_recipes(self):
+        return self._pack('rec', self._recipe_members())
+
     def _copy_recipes(self):
-        pack_path = self._pack_recipes()
-        pack_dest = os.path.join(self.remote_tmpdir,
-                                 os.path.basename(pack_path))
         if self.recipe_dir.startswith(self.resource_dir):
             extr_dest = self.resource_dir
         else:
             extr_dest = self.recipe_dir
-        self._transfer(pack_path, pack_dest, extr_dest)
+        self._transfer(self._recipe_members(), extr_dest)
 
 
 class DroneObserver(object):
@@ -113,6 +325,10 @@ class Drone(object):
     """
     Base class used to apply installation recipes to nodes.
     """
+    # delays in seconds between checks of running recipes
+    wait_delay = 1
+    wait_max_delay = 16
+
     def __init__(self, node, resource_dir=None, recipe_dir=None,
                  local_tmpdir=None, remote_tmpdir=None):
         self._recipes = utils.SortedDict()
@@ -207,7 +423,7 @@ class Drone(object):
                      % (self.node, self.resources))
         self._copy_resources()
         logger.debug('Copying drone recipes to node %s: %s'
-                     % (self.node, [i[0] for i in self.recipes]))
+                     % (self.node, list(self.recipes)))
         self._copy_recipes()
 
     def _apply(self, recipe):
@@ -226,23 +442,40 @@ class Drone(object):
         # subclass must implement this method
         raise NotImplementedError()
 
+    def _finished_recipes(self, recipes):
+        """
+        Returns set of given recipes which are applied. Subclasses should
+        check all recipes by single query to self.node.
+        """
+        return set([i for i in recipes if self._finished(i)])
+
     def _wait(self):
         """
-        Waits until all started applications of recipes will be finished
+        Waits until all started applications of recipes will be finished.
+        Status of all running recipes is queried at once and the delay
+        between queries grows exponentially up to self.wait_max_delay
+        while nothing finishes.
         """
+        delay = self.wait_delay
         while self._running:
-            _run = list(self._running)
-            for recipe in _run:
-                if self._observer:
+            running = list(self._running)
+            if self._observer:
+                for recipe in running:
                     self._observer.checking(self, recipe)
-                if self._finished(recipe):
-                    self._applied.add(recipe)
-                    self._running.remove(recipe)
-                    if self._observer:
-                        self._observer.finished(self, recipe)
-                else:
-                    time.sleep(3)
+            finished = self._finished_recipes(running)
+            for recipe in running:
+                if recipe not in finished:
                     continue
+                self._applied.add(recipe)
+                self._running.remove(recipe)
+                if self._observer:
+                    self._observer.finished(self, recipe)
+            if not self._running:
+                break
+            if finished:
+                delay = self.wait_delay
+            time.sleep(delay)
+            delay = min(delay * 2, self.wait_max_delay)
 
     def set_observer(self, observer):
         """
@@ -317,10 +550,14 @@ class PackstackDrone(SshTarballTransferMixin, Drone):
     #      Controller and plugin system will be refactored and installer
     #      will support projects.
     def __init__(self, *args, **kwargs):
-        kwargs['resource_dir'] = ('/var/tmp/packstack/drone%s'
-                                  % uuid.uuid4().hex[:8])
-        kwargs['recipe_dir'] = '%s/manifests' % kwargs['resource_dir']
-        kwargs['remote_tmpdir'] = '%s/temp' % kwargs['resource_dir']
+        # resource directory can be given to reuse bundles transferred
+        # by previous runs
+        kwargs.setdefault('resource_dir', '/var/tmp/packstack/drone%s'
+                                          % uuid.uuid4().hex[:8])
+        kwargs.setdefault('recipe_dir',
+                          '%s/manifests' % kwargs['resource_dir'])
+        kwargs.setdefault('remote_tmpdir',
+                          '%s/temp' % kwargs['resource_dir'])
 
         super(PackstackDrone, self).__init__(*args, **kwargs)
 
@@ -346,23 +583,48 @@ class PackstackDrone(SshTarballTransferMixin, Drone):
         dest = '%ss' % resource_type
         super(PackstackDrone, self).add_resource(path, destination=dest)
 
-    def _finished(self, recipe):
-        recipe_base = os.path.basename(recipe)
-        log = os.path.join(self.recipe_dir,
-                           recipe_base.replace(".finished", ".log"))
-        local = utils.ScriptRunner()
-        local.append('scp -o StrictHostKeyChecking=no '
-                         '-o UserKnownHostsFile=/dev/null '
-                         'root@%s:%s %s' % (self.node, recipe, log))
+    def log_path(self, recipe):
+        """
+        Returns local path of log of given recipe fetched from node.
+        """
+        return os.path.join(self.local_tmpdir,
+                            '%s.log' % os.path.basename(recipe))
+
+    def _finished_recipes(self, recipes):
+        """
+        Checks all given recipes by single ssh call, which streams logs
+        of finished recipes back in one tar archive. Logs are saved to
+        paths returned by self.log_path.
+        """
+        names = dict([('%s.finished' % os.path.basename(i), i)
+                      for i in recipes])
+        server = utils.ScriptRunner(self.node)
+        server.append('cd %s' % self.recipe_dir)
+        server.append('ls -1 %s 2>/dev/null | tar -cf - -T -'
+                      % ' '.join(sorted(names)))
         try:
-            # once a remote puppet run has finished, we retrieve
-            # the log file and check it for errors
-            local.execute(log=False)
-            # if we got to this point the puppet apply has finished
-            return True
-        except utils.ScriptRuntimeError, e:
-            # the test raises an exception if the file doesn't exist yet
-            return False
+            rc, out = server.execute(log=False)
+            archive = tarfile.open(fileobj=StringIO(out), mode='r:')
+        except (ScriptRuntimeError, NetworkError, tarfile.TarError), ex:
+            # TO-DO: complete logger name when logging will be setup
+            # correctly
+            logger = logging.getLogger()
+            logger.debug('Failed to check recipes on node %s: %s'
+                         % (self.node, ex))
+            return set()
+
+        finished = set()
+        for member in archive:
+            recipe = names.get(member.name)
+            if recipe is None or not member.isfile():
+                continue
+            with open(self.log_path(recipe), 'wb') as log:
+                log.write(archive.extractfile(member).read())
+            finished.add(recipe)
+        return finished
+
+    def _finished(self, recipe):
+        return recipe in self._finished_recipes([recipe])
 
     def _apply(self, recipe):
         running = "%s.running" % recipe
@@ -387,7 +649,7 @@ class PackstackDrone(SshTarballTransferMixin, Drone):
         logger = logging.getLogger()
         loglevel = logger.level <= logging.DEBUG and '--debug' or ''
         rdir = self.resource_dir
-        mdir = self._module_dir
+        mdir = self.module_dir
         server.append(
             "( flock %(rdir)s/ps.lock "
                 "puppet apply %(loglevel)s --modulepath %(mdir)s "
@@ -395,3 +657,212 @@ class PackstackDrone(SshTarballTransferMixin, Drone):
             "mv %(running)s %(finished)s ) "
             "> /dev/null 2>&1 < /dev/null &" % locals())
         server.execute()
+
+
+class FleetObserver(object):
+    """
+    Forwards messages of drones running in separate threads to single
+    DroneObserver, one message at a time.
+    """
+    def __init__(self, observer):
+        self.observer = observer
+        self._lock = threading.Lock()
+
+    def _forward(self, method, drone, recipe):
+        with self._lock:
+            getattr(self.observer, method)(drone, recipe)
+
+    def applying(self, drone, recipe):
+        self._forward('applying', drone, recipe)
+
+    def checking(self, drone, recipe):
+        self._forward('checking', drone, recipe)
+
+    def finished(self, drone, recipe):
+        self._forward('finished', drone, recipe)
+
+
+class DroneFleet(object):
+    """
+    Drives multiple drones concurrently, so work on all nodes takes about
+    as long as work on the slowest node.
+    """
+    def __init__(self, drones=None, workers=None):
+        self._drones = utils.SortedDict()
+        self._observer = None
+        # resource bundles are built once for all drones
+        self.bundle_cache = BundleCache()
+        # maximal count of drones working at once, all drones by default
+        self.workers = workers
+        for drone in drones or []:
+            self.add_drone(drone)
+
+    @property
+    def drones(self):
+        return self._drones.values()
+
+    def add_drone(self, drone):
+        if drone.node in self._drones:
+            raise ValueError('Fleet already contains drone for node %s.'
+                             % drone.node)
+        self._drones[drone.node] = drone
+        if hasattr(drone, 'bundle_cache'):
+            drone.bundle_cache = self.bundle_cache
+        if self._observer:
+            drone.set_observer(self._observer)
+
+    def set_observer(self, observer):
+        """
+        Registers an observer for all drones of the fleet. Given object
+        should be subclass of class DroneObserver, it is called from one
+        thread at a time.
+        """
+        for attr in ('applying', 'checking',  'finished'):
+            if not hasattr(observer, attr):
+                raise ValueError('Observer object should be a subclass '
+                                 'of class DroneObserver.')
+        self._observer = FleetObserver(observer)
+        for drone in self._drones.itervalues():
+            drone.set_observer(self._observer)
+
+    def _limit(self, count):
+        return min(self.workers or count, count)
+
+    def _run(self, tasks, ready=None, done=None):
+        """
+        Runs given list of (drone, function, args) tasks concurrently
+        and raises DroneError if any of them fails. If ready is given,
+        tasks are started only when ready(task) returns True, done(task)
+        is called after successful finish of each task. No new task is
+        started after a failure.
+        """
+        # TO-DO: complete logger name when logging will be setup correctly
+        logger = logging.getLogger()
+        ready = ready or (lambda task: True)
+        pending = list(tasks)
+        results = Queue.Queue()
+        failures = {}
+        running = 0
+        limit = self._limit(len(pending))
+
+        def worker(task):
+            drone, func, args = task
+            try:
+                func(*args)
+                results.put((task, None))
+            except Exception, ex:
+                logger.debug('Drone for node %s failed' % drone.node,
+                             exc_info=True)
+                results.put((task, ex))
+
+        while pending or running:
+            if not failures:
+                for task in [i for i in pending if ready(i)]:
+                    if running >= limit:
+                        break
+                    pending.remove(task)
+                    thread = threading.Thread(target=worker, args=(task,))
+                    thread.daemon = True
+                    thread.start()
+                    running += 1
+            if not running:
+                break
+            task, error = results.get()
+            running -= 1
+            if error is not None:
+                failures[task[0].node] = error
+            elif done:
+                done(task)
+
+        if failures:
+            raise DroneError('Drones failed on nodes %s: %s' %
+                             (', '.join(sorted(failures)),
+                              '; '.join(['%s: %s' % (node, failures[node])
+                                         for node in sorted(failures)])),
+                             failures=failures)
+        if pending:
+            raise DroneError('Recipes on nodes %s could not be applied, '
+                             'their markers depend on each other.' %
+                             ', '.join(sorted(set([i[0].node
+                                                   for i in pending]))))
+
+    def init_nodes(self):
+        """
+        Initializes all nodes for manipulation concurrently.
+        """
+        self._run([(drone, drone.init_node, ())
+                   for drone in self._drones.itervalues()])
+
+    def prepare_nodes(self):
+        """
+        Copies resources and recipes of all drones to their nodes
+        concurrently.
+        """
+        self._run([(drone, drone.prepare_node, ())
+                   for drone in self._drones.itervalues()])
+
+    def _dependencies(self):
+        """
+        Returns dictionary of markers by marker which have to be finished
+        on all nodes before given marker can be applied on any node. Marker
+        depends on markers preceding it on any drone.
+        """
+        deps = {}
+        for drone in self._drones.itervalues():
+            previous = None
+            for mark in drone._recipes:
+                deps.setdefault(mark, set())
+                if previous is not None:
+                    deps[mark].add(previous)
+                previous = mark
+        return deps
+
+    def apply(self, marker=None, name=None, skip=None):
+        """
+        Applies recipes on all nodes concurrently. Recipes with the same
+        marker are applied on all nodes before any recipe following them
+        on any node, so markers are fleet wide stages. Each node proceeds
+        to its next marker as soon as everything the marker depends on is
+        finished, without waiting for unrelated nodes. Parameters have
+        the same meaning as parameters of Drone.apply.
+        """
+        tasks = []
+        for drone in self._drones.itervalues():
+            for mark in drone._recipes:
+                if marker and marker != mark:
+                    continue
+                tasks.append((drone, drone.apply, (mark, name, skip)))
+
+        deps = self._dependencies()
+        remaining = {}
+        for drone, func, args in tasks:
+            remaining[args[0]] = remaining.get(args[0], 0) + 1
+        # next marker to apply by each drone
+        position = dict([(node, 0) for node in self._drones])
+        queues = {}
+        for drone, func, args in tasks:
+            queues.setdefault(drone.node, []).append(args[0])
+
+        def ready(task):
+            drone, func, args = task
+            mark = args[0]
+            if queues[drone.node][position[drone.node]] != mark:
+                return False
+            return not [i for i in deps[mark] if remaining.get(i)]
+
+        def done(task):
+            drone, func, args = task
+            remaining[args[0]] -= 1
+            position[drone.node] += 1
+
+        self._run(tasks, ready=ready, done=done)
+
+    def cleanup(self, resource_dir=True, recipe_dir=True):
+        """
+        Removes all directories created by drones of the fleet.
+        """
+        try:
+            self._run([(drone, drone.cleanup, (resource_dir, recipe_dir))
+                       for drone in self._drones.itervalues()])
+        finally:
+            self.bundle_cache.cleanup()
@@ -4,30 +4,54 @@
 Container set for groups and parameters
 """
 
+from operator import attrgetter
+
 from ..utils.datastructures import SortedDict
 
 
-class Parameter(object):
-    allowed_keys = ('CONF_NAME', 'CMD_OPTION', 'USAGE', 'PROMPT',
-                    'PROCESSORS', 'VALIDATORS', 'LOOSE_VALIDATION',
-                    'DEFAULT_VALUE', 'USE_DEFAULT', 'OPTION_LIST',
-                    'MASK_INPUT', 'NEED_CONFIRM','CONDITION')
+class Attributes(object):
+    """
+    Base for objects with fixed set of attributes given by allowed_keys.
+    Attributes are stored in slots, so instances don't carry a dictionary
+    each and the schema is shared by all instances of the class.
+    """
+    __slots__ = ()
+    allowed_keys = ()
 
     def __init__(self, attributes=None):
         attributes = attributes or {}
-        defaults = {}.fromkeys(self.allowed_keys)
-        defaults.update(attributes)
-
-        for key, value in defaults.iteritems():
+        for key in attributes:
             if key not in self.allowed_keys:
                 raise KeyError('Given attribute %s is not allowed' % key)
-            self.__dict__[key] = value
+        for key in self.allowed_keys:
+            setattr(self, key, attributes.get(key))
+
+    def copy(self, **changes):
+        """
+        Returns shallow copy of this object with given attributes changed.
+        """
+        result = self.__class__.__new__(self.__class__)
+        for key in self.allowed_keys:
+            setattr(result, key, changes.pop(key, getattr(self, key)))
+        if changes:
+            raise KeyError('Given attributes %s are not allowed' %
+                           ', '.join(sorted(changes)))
+        return result
 
 
-class Group(Parameter):
+class Parameter(Attributes):
+    allowed_keys = ('CONF_NAME', 'CMD_OPTION', 'USAGE', 'PROMPT',
+                    'PROCESSORS', 'VALIDATORS', 'LOOSE_VALIDATION',
+                    'DEFAULT_VALUE', 'USE_DEFAULT', 'OPTION_LIST',
+                    'MASK_INPUT', 'NEED_CONFIRM','CONDITION')
+    __slots__ = allowed_keys
+
+
+class Group(Attributes):
     allowed_keys = ('GROUP_NAME', 'DESCRIPTION', 'PRE_CONDITION',
                     'PRE_CONDITION_MATCH', 'POST_CONDITION',
                     'POST_CONDITION_MATCH')
+    __slots__ = allowed_keys + ('parameters',)
 
     def __init__(self, attributes=None, parameters=None):
         super(Group, self).__init__(attributes)
@@ -35,13 +59,16 @@ class Group(Parameter):
         for param in parameters or []:
             self.parameters[param['CONF_NAME']] = Parameter(attributes=param)
 
+    def copy(self, **changes):
+        result = super(Group, self).copy(**changes)
+        result.parameters = self.parameters.copy()
+        return result
+
     def search(self, attr, value):
         """
         Returns list of parameters which have given attribute of given
         value.
         """
-        result = []
-        for param in self.parameters.itervalues():
-            if getattr(param, attr) == value:
-                result.append(param)
-        return result
+        getter = attrgetter(attr)
+        return [param for param in self.parameters.itervalues()
+                if getter(param) == value]
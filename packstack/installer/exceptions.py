@@ -72,6 +72,16 @@ class ExecuteRuntimeError(PackStackError):
     """Raised when utils.execute does not end successfully."""
 
 
+class DroneError(PackStackError):
+    """
+    Raised when drones of DroneFleet fail, failures attribute contains
+    exceptions by node.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DroneError, self).__init__(*args, **kwargs)
+        self.failures = kwargs.get('failures', {})
+
+
 class SequenceError(PackStackError):
     """Exception for errors during setup sequence run."""
     pass
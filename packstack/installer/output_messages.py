@@ -27,6 +27,13 @@ INFO_DONE="DONE"
 INFO_ERROR="ERROR"
 INFO_LOG_FILE_PATH="The installation log file is available at: %s"
 INFO_MANIFEST_PATH="The generated manifests are available at: %s"
+INFO_PLAN_PATH="The deployment plan is available at: %s"
+INFO_ARCHIVE_PATH="Manifests and logs of Puppet runs are archived in %s, to list them run: python -m packstack.modules.archive %s"
+INFO_PROFILE_PATH="The raw profile of the run is available at: %s"
+INFO_CACHED_CONF="Using parameters processed and validated by previous run of the same answer file, use --force-revalidate to process them again"
+INFO_TRANSFER_CODEC="Puppet modules and manifests were transferred to %d hosts using transfer codec %s at %s on average"
+INFO_MODULE_CACHE="Puppet modules were not transferred to %d hosts, because they were cached there by previous run"
+INFO_SKIPPED_MANIFESTS="%d Puppet manifests were not applied, because they did not change since the last run. Use --force-full to apply all manifests."
 INFO_ADDTIONAL_MSG="Additional information:"
 INFO_ADDTIONAL_MSG_BULLET=" * %s"
 INFO_CONF_PARAMS_PASSWD_CONFIRM_PROMPT="Confirm password"
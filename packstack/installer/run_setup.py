@@ -1,7 +1,9 @@
 import ConfigParser
 import copy
+import cProfile
 import datetime
 import getpass
+import glob
 import logging
 import os
 import re
@@ -20,7 +22,9 @@ import processors
 import output_messages
 from .exceptions import FlagValidationError, ParamValidationError
 
-from packstack.modules.ospluginutils import gethostlist
+from packstack.modules import confcache
+from packstack.modules.ospluginutils import (gethostlist,
+                                             checkTemplateKeys)
 from setup_controller import Controller
 
 controller = Controller()
@@ -29,6 +33,10 @@ commandLineValues = {}
 # List to hold all values to be masked in logging (i.e. passwords and sensitive data)
 #TODO: read default values from conf_param?
 masked_value_set = set()
+# Compiled masker of values from masked_value_set
+masker = utils.Masker()
+# Validations collected while loading answer file, see _runValidationBatch
+validation_batch = None
 
 
 def initLogging (debug):
@@ -53,8 +61,10 @@ def initLogging (debug):
         fmt = logging.Formatter(fmts, dfmt)
         hdlr.setFormatter(fmt)
 
+        # command outputs are masked, formatted and written to the log file
+        # in background
         logging.root.handlers = []
-        logging.root.addHandler(hdlr)
+        logging.root.addHandler(utils.QueueHandler(hdlr))
         logging.root.setLevel(level)
     except:
         logging.error(traceback.format_exc())
@@ -142,11 +152,11 @@ def input_param(param):
     # Do not validate if it was given from the command line
     if (param.NEED_CONFIRM and not commandLineValues.has_key(param.CONF_NAME)):
         #create a copy of the param so we can call it twice
-        confirmedParam = copy.deepcopy(param)
         confirmedParamName = param.CONF_NAME + "_CONFIRMED"
-        confirmedParam.CONF_NAME = confirmedParamName
-        confirmedParam.PROMPT = output_messages.INFO_CONF_PARAMS_PASSWD_CONFIRM_PROMPT
-        confirmedParam.VALIDATORS = [validators.validate_not_empty]
+        confirmedParam = param.copy(
+            CONF_NAME=confirmedParamName,
+            PROMPT=output_messages.INFO_CONF_PARAMS_PASSWD_CONFIRM_PROMPT,
+            VALIDATORS=[validators.validate_not_empty])
         # Now get both values from user (with existing validations
         while True:
             _getInputFromUser(param)
@@ -195,6 +205,7 @@ def _addDefaultsToMaskedValueSet():
             # Keep default password values masked, but ignore default empty values
             if ((param.MASK_INPUT == True) and param.DEFAULT_VALUE != ""):
                 masked_value_set.add(param.DEFAULT_VALUE)
+    _refreshMasker()
 
 def _updateMaskedValueSet():
     """
@@ -207,6 +218,17 @@ def _updateMaskedValueSet():
         # Add all needed values to masked_value_set
         if (controller.getParamKeyValue(confName, "MASK_INPUT") == True):
             masked_value_set.add(controller.CONF[confName])
+    _refreshMasker()
+
+def _refreshMasker():
+    """
+    Recompiles masker if masked_value_set has changed and sets it
+    for masking of executed commands and their output
+    """
+    global masker
+    if masker.mask_list != masked_value_set:
+        masker = utils.Masker(masked_value_set, utils.shell.repl_list)
+        utils.set_masker(masker)
 
 def mask(input):
     """
@@ -219,19 +241,18 @@ def mask(input):
     if type(input) == types.DictType:
         for key in input:
             if type(input[key]) == types.StringType:
-                output[key] = utils.mask_string(input[key],
-                                                masked_value_set)
+                output[key] = masker.mask(input[key])
     if type(input) == types.ListType:
         for item in input:
             org = item
             orgIndex = input.index(org)
             if type(item) == types.StringType:
-                item = utils.mask_string(item, masked_value_set)
+                item = masker.mask(item)
             if item != org:
                 output.remove(org)
                 output.insert(orgIndex, item)
     if type(input) == types.StringType:
-            output = utils.mask_string(input, masked_value_set)
+            output = masker.mask(input)
 
     return output
 
@@ -252,8 +273,15 @@ def removeMaskString(maskedString):
             found = True
     if found:
         masked_value_set.remove(maskedString)
+        _refreshMasker()
 
 def validate_param_value(param, value):
+    if validation_batch is not None:
+        # validation is postponed until all parameters are loaded
+        validation_batch.add(param.CONF_NAME, param.VALIDATORS, value,
+                             param.OPTION_LIST)
+        return
+
     cname = param.CONF_NAME
     logging.debug("Validating parameter %s." % cname)
 
@@ -339,6 +367,8 @@ def _handleAnswerFileParams(answerFile):
     params from answer file
     supports reading single or group params
     """
+    global validation_batch
+    validation_batch = validators.ValidationBatch()
     try:
         logging.debug("Starting to handle config file")
 
@@ -378,9 +408,57 @@ def _handleAnswerFileParams(answerFile):
             else:
                 logging.debug("skipping params group %s since value of group validation is %s" % (group.GROUP_NAME, preConditionValue))
 
+        _runValidationBatch()
+
     except Exception as e:
         logging.error(traceback.format_exc())
         raise Exception(output_messages.ERR_EXP_HANDLE_ANSWER_FILE%(e))
+    finally:
+        validation_batch = None
+
+def _handleCachedAnswerFileParams(answerFile):
+    """
+    Loads parameters processed and validated by previous run of the same
+    answer file with the same plugins, the answer file is handled as usual
+    if there are no such cached values or revalidation is forced
+    """
+    modules = controller.getAllPlugins() + [processors, validators]
+    key = confcache.cache_key(answerFile, modules)
+    cached = None
+    if not controller.CONF.get('FORCE_REVALIDATE'):
+        cached = confcache.load_conf(key)
+    if cached is not None:
+        logging.debug("Using parameters cached from previous run of %s" %
+                      answerFile)
+        print output_messages.INFO_CACHED_CONF
+        controller.CONF.update(cached)
+        return
+
+    _handleAnswerFileParams(answerFile)
+
+    conf = {}
+    for group in controller.getAllGroups():
+        for param in group.parameters.itervalues():
+            if param.CONF_NAME in controller.CONF:
+                conf[param.CONF_NAME] = controller.CONF[param.CONF_NAME]
+    try:
+        confcache.save_conf(key, conf)
+    except (IOError, OSError, TypeError), ex:
+        logging.warning("Unable to cache processed parameters: %s" % ex)
+
+def _runValidationBatch():
+    """
+    Runs validations collected while loading parameters, all failures
+    are reported at once
+    """
+    failures = validation_batch.run()
+    messages = []
+    for names, error in failures:
+        msg = 'Parameter %s failed validation: %s' % (', '.join(names), error)
+        print msg
+        messages.append(msg)
+    if messages:
+        raise ParamValidationError('\n'.join(messages))
 
 
 def _getanswerfilepath():
@@ -462,7 +540,7 @@ def _handleInteractiveParams():
 def _handleParams(configFile):
     _addDefaultsToMaskedValueSet()
     if configFile:
-        _handleAnswerFileParams(configFile)
+        _handleCachedAnswerFileParams(configFile)
     else:
         _handleInteractiveParams()
 
@@ -534,8 +612,10 @@ def _addFinalInfoMsg():
     successfull install of rhemv
     """
     controller.MESSAGES.append(output_messages.INFO_LOG_FILE_PATH%(logFile))
-    controller.MESSAGES.append(
-        output_messages.INFO_MANIFEST_PATH%(basedefs.PUPPET_MANIFEST_DIR))
+    # manifests of successful runs are moved to archive, see puppet_950
+    if glob.glob(os.path.join(basedefs.PUPPET_MANIFEST_DIR, '*.pp')):
+        controller.MESSAGES.append(
+            output_messages.INFO_MANIFEST_PATH%(basedefs.PUPPET_MANIFEST_DIR))
 
 
 def _summaryParamsToLog():
@@ -569,6 +649,9 @@ def _main(configFile=None):
     # Initialize Sequences
     initPluginsSequences()
 
+    # Fail on templates using unknown keys before any remote action
+    checkTemplateKeys(controller)
+
     # Run main setup logic
     runSequences()
 
@@ -712,6 +795,23 @@ def initCmdLineParser():
     parser.add_option("-o", "--options", action="store_true", dest="options", help="Print details on options available in answer file(rst format)")
     parser.add_option("-d", "--debug", action="store_true", default=False, help="Enable debug in logging")
     parser.add_option("-y", "--dry-run", action="store_true", default=False, help="Don't execute, just generate manifests")
+    parser.add_option("--profile", action="store_true", default=False, help="Profile the run, the raw profile is saved to the log directory "
+                                          "and a breakdown by sequences, plugins and activities is printed")
+    parser.add_option("--plan", action="store_true", default=False, help="Don't execute, generate manifests and print the deployment plan "
+                                          "with transfer sizes and duration estimated from previous runs")
+    parser.add_option("--force-full", action="store_true", default=False, help="Apply all Puppet manifests, even those which did not change "
+                                          "since the last successful run")
+    parser.add_option("--force-revalidate", action="store_true", default=False, help="Process and validate answer file parameters, even "
+                                          "if the same answer file was already processed by previous run")
+    parser.add_option("--coalesce-manifests", action="store_true", default=False, help="Merge manifests applied on the same host in the same "
+                                          "stage into single Puppet run, errors are still reported per manifest")
+    parser.add_option("--pull-modules", action="store_true", default=False, help="Serve Puppet modules by HTTP server started locally "
+                                          "and let hosts fetch them in parallel, manifests are still pushed over SSH")
+    parser.add_option("--relay-fanout", type="int", default=0, help="Fetch Puppet modules from the deploy host only on this many hosts, "
+                                          "each host then serves them to this many other hosts (implies --pull-modules)")
+    parser.add_option("--transfer-codec", type="choice", choices=["auto", "none", "fast", "best"], default="auto",
+                                          help="Compression of Puppet modules and manifests sent to hosts, 'auto' chooses "
+                                          "the fastest one for each host by measured throughput [default: %default]")
 
     # For each group, create a group option
     for group in controller.getAllGroups():
@@ -799,7 +899,10 @@ def countCmdLineFlags(options, flag):
     counter = 0
     # make sure only flag was supplied
     for key, value  in options.__dict__.items():
-        if key in (flag, 'debug', 'timeout', 'dry_run'):
+        if key in (flag, 'debug', 'timeout', 'dry_run', 'plan', 'profile',
+                   'force_full', 'force_revalidate',
+                   'coalesce_manifests', 'pull_modules', 'relay_fanout',
+                   'transfer_codec'):
             next
         # If anything but flag was called, increment
         elif value:
@@ -827,12 +930,23 @@ def initPluginsSequences():
 def _set_command_line_values(options):
     for key, value in options.__dict__.items():
         # Replace the _ with - in the string since optparse replace _ with -
-        for group in controller.getAllGroups():
-            param = group.search("CMD_OPTION", key.replace("_","-"))
-            if len(param) > 0 and value:
-                commandLineValues[param[0].CONF_NAME] = value
+        param = controller.getParamByOption(key.replace("_","-"))
+        if param is not None and value:
+            commandLineValues[param.CONF_NAME] = value
+
+def _printProfile(profiler):
+    """
+    Saves raw profile to the log directory and prints its summary
+    """
+    profiler.disable()
+    path = os.path.join(basedefs.VAR_DIR, 'packstack.prof')
+    profiler.dump_stats(path)
+    report = utils.ProfileReport(path, controller.getAllSequences())
+    print "\n%s" % report.render()
+    print output_messages.INFO_PROFILE_PATH % path
 
 def main():
+    profiler = None
     try:
         # Load Plugins
         loadPlugins()
@@ -851,12 +965,24 @@ def main():
         # Initialize logging
         initLogging (options.debug)
 
+        if options.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
         # Parse parameters
         runConfiguration = True
         confFile = None
 
         controller.CONF['DEFAULT_EXEC_TIMEOUT'] = options.timeout
         controller.CONF['DRY_RUN'] = options.dry_run
+        controller.CONF['PLAN'] = options.plan
+        controller.CONF['FORCE_FULL'] = options.force_full
+        controller.CONF['FORCE_REVALIDATE'] = options.force_revalidate
+        controller.CONF['COALESCE_MANIFESTS'] = options.coalesce_manifests
+        controller.CONF['PULL_MODULES'] = (options.pull_modules or
+                                           options.relay_fanout > 0)
+        controller.CONF['RELAY_FANOUT'] = options.relay_fanout
+        controller.CONF['TRANSFER_CODEC'] = options.transfer_codec
 
         # If --gen-answer-file was supplied, do not run main
         if options.gen_answer_file:
@@ -869,9 +995,14 @@ def main():
                 msg = ('Please use either --allinone or --answer-file, '
                        'but not both.')
                 raise FlagValidationError(msg)
+            # generated answer files differ by each run, so results
+            # of previous runs are found by installation type
+            controller.CONF['DEPLOYMENT'] = 'allinone'
             single_step_aio_install(options)
         # Are we installing in a single step
         elif options.install_hosts:
+            controller.CONF['DEPLOYMENT'] = ('install-hosts:%s' %
+                                             options.install_hosts)
             single_step_install(options)
         # Otherwise, run main()
         else:
@@ -881,6 +1012,7 @@ def main():
                 confFile = os.path.expanduser(options.answer_file)
                 if not os.path.exists(confFile):
                     raise Exception(output_messages.ERR_NO_ANSWER_FILE % confFile)
+                controller.CONF['DEPLOYMENT'] = os.path.abspath(confFile)
             else:
                 _set_command_line_values(options)
             _main(confFile)
@@ -901,6 +1033,9 @@ def main():
         _printAdditionalMessages()
         _summaryParamsToLog()
 
+        if profiler:
+            _printProfile(profiler)
+
 
 if __name__ == "__main__":
     main()
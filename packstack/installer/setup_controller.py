@@ -21,6 +21,13 @@ class Controller(object):
     MESSAGES=[]
     CONF={}
 
+    # indexes for lookups, they are updated on every insert
+    __GROUPS_BY_NAME={}
+    __SEQUENCES_BY_NAME={}
+    __PLUGINS_BY_NAME={}
+    __PARAMS_BY_NAME={}
+    __PARAMS_BY_OPTION={}
+
     __single = None # the one, true Singleton ... for god's sake why ??? :)
 
     def __new__(self, *args, **kwargs):
@@ -54,27 +61,30 @@ class Controller(object):
     # PLugins
     def addPlugin(self, plugObj):
         self.__PLUGINS.append(plugObj)
+        self.__PLUGINS_BY_NAME.setdefault(plugObj.__name__, plugObj)
 
     def getPluginByName(self, pluginName):
-        for plugin in self.__PLUGINS:
-            if plugin.__name__ == pluginName:
-                return plugin
-        return None
+        return self.__PLUGINS_BY_NAME.get(pluginName)
 
     def getAllPlugins(self):
         return self.__PLUGINS
 
     # Sequences and steps
+    def __insertSequence(self, index, desc, cond, cond_match, steps):
+        sequence = Sequence(desc, steps_new_format(steps), condition=cond,
+                            cond_match=cond_match)
+        self.__SEQUENCES.insert(index, sequence)
+        # lookups return the first sequence of given name
+        current = self.__SEQUENCES_BY_NAME.get(desc)
+        if current is None or index <= self.__SEQUENCES.index(current):
+            self.__SEQUENCES_BY_NAME[desc] = sequence
+
     def addSequence(self, desc, cond, cond_match, steps):
-        self.__SEQUENCES.append(Sequence(desc, steps_new_format(steps),
-                                         condition=cond,
-                                         cond_match=cond_match))
+        self.__insertSequence(len(self.__SEQUENCES), desc, cond, cond_match,
+                              steps)
 
     def insertSequence(self, desc, cond, cond_match, steps, index=0):
-        self.__SEQUENCES.insert(index, Sequence(desc,
-                                                steps_new_format(steps),
-                                                condition=cond,
-                                                cond_match=cond_match))
+        self.__insertSequence(index, desc, cond, cond_match, steps)
 
     def getAllSequences(self):
         return self.__SEQUENCES
@@ -84,16 +94,13 @@ class Controller(object):
             sequence.run(self.CONF)
 
     def getSequenceByDesc(self, desc):
-        for sequence in self.getAllSequences():
-            if sequence.name == desc:
-                return sequence
-        return None
+        return self.__SEQUENCES_BY_NAME.get(desc)
 
     def __getSequenceIndexByDesc(self, desc):
-        for sequence in self.getAllSequences():
-            if sequence.name == desc:
-                return self.__SEQUENCES.index(sequence)
-        return None
+        sequence = self.getSequenceByDesc(desc)
+        if sequence is None:
+            return None
+        return self.__SEQUENCES.index(sequence)
 
     def insertSequenceBeforeSequence(self, sequenceName, desc, cond, cond_match, steps):
         """
@@ -104,29 +111,42 @@ class Controller(object):
         index = self.__getSequenceIndexByDesc(sequenceName)
         if index == None:
             index = len(self.getAllSequences())
-        self.__SEQUENCES.insert(index, Sequence(desc,
-                                                steps_new_format(steps),
-                                                condition=cond,
-                                                cond_match=cond_match))
+        self.__insertSequence(index, desc, cond, cond_match, steps)
 
     # Groups and params
+    def __insertGroup(self, index, group, params):
+        group = Group(group, params)
+        self.__GROUPS.insert(index, group)
+        # lookups return the first group of given name and parameter from
+        # the first group containing it
+        current = self.__GROUPS_BY_NAME.get(group.GROUP_NAME)
+        if current is None or index <= self.__GROUPS.index(current):
+            self.__GROUPS_BY_NAME[group.GROUP_NAME] = group
+        for param in group.parameters.itervalues():
+            for index_dict, key in ((self.__PARAMS_BY_NAME, param.CONF_NAME),
+                                    (self.__PARAMS_BY_OPTION,
+                                     param.CMD_OPTION)):
+                if key is None:
+                    continue
+                current = index_dict.get(key)
+                if (current is None or
+                        index <= self.__GROUPS.index(current[0])):
+                    index_dict[key] = (group, param)
+
     def addGroup(self, group, params):
-        self.__GROUPS.append(Group(group, params))
+        self.__insertGroup(len(self.__GROUPS), group, params)
 
     def getGroupByName(self, groupName):
-        for group in self.getAllGroups():
-            if group.GROUP_NAME == groupName:
-                return group
-        return None
+        return self.__GROUPS_BY_NAME.get(groupName)
 
     def getAllGroups(self):
         return self.__GROUPS
 
     def __getGroupIndexByDesc(self, name):
-        for group in self.getAllGroups():
-            if group.GROUP_NAME == name:
-                return self.__GROUPS.index(group)
-        return None
+        group = self.getGroupByName(name)
+        if group is None:
+            return None
+        return self.__GROUPS.index(group)
 
     def insertGroupBeforeGroup(self, groupName, group, params):
         """
@@ -137,13 +157,18 @@ class Controller(object):
         index = self.__getGroupIndexByDesc(groupName)
         if index == None:
             index = len(self.getAllGroups())
-        self.__GROUPS.insert(index, Group(group, params))
+        self.__insertGroup(index, group, params)
 
     def getParamByName(self, paramName):
-        for group in self.getAllGroups():
-            if paramName in group.parameters:
-                return group.parameters[paramName]
-        return None
+        item = self.__PARAMS_BY_NAME.get(paramName)
+        return item and item[1] or None
+
+    def getParamByOption(self, option):
+        """
+        Returns parameter with given CMD_OPTION or None.
+        """
+        item = self.__PARAMS_BY_OPTION.get(option)
+        return item and item[1] or None
 
     def getParamKeyValue(self, paramName, keyName):
         param = self.getParamByName(paramName)
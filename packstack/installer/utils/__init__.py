@@ -2,18 +2,24 @@
 
 from .datastructures import SortedDict
 from .decorators import retry
+from .logqueue import QueueHandler
 from .network import get_localhost_ip, host2ip, force_ip, device_from_ip
-from .shell import ScriptRunner, execute
+from .profiling import ProfileReport
+from .shell import (MaskedMessage, ScriptRunner, execute, get_masker,
+                    set_masker)
 from .shortcuts import (host_iter, hosts, get_current_user,
                         get_current_username, split_hosts)
-from .strings import (COLORS, color_text, mask_string, state_format,
-                      state_message)
+from .strings import (COLORS, Masker, color_text, mask_string,
+                      state_format, state_message)
 
 
 __all__ = ('SortedDict',
            'retry',
+           'QueueHandler',
            'get_localhost_ip', 'host2ip', 'force_ip', 'device_from_ip',
-           'ScriptRunner', 'execute',
+           'ProfileReport',
+           'MaskedMessage', 'ScriptRunner', 'execute', 'get_masker',
+           'set_masker',
            'host_iter', 'hosts', 'get_current_user', 'get_current_username',
-           'split_hosts', 'COLORS', 'color_text', 'mask_string',
+           'split_hosts', 'COLORS', 'Masker', 'color_text', 'mask_string',
            'state_format', 'state_message')
@@ -1,37 +1,74 @@
 # -*- coding: utf-8 -*-
 
 import copy
-from types import GeneratorType
 
 
-# taken from Django.utils.datastructures
+# links of the key order list
+PREV, NEXT, KEY = 0, 1, 2
+
+
+# API taken from Django.utils.datastructures, key order is kept the same
+# way as collections.OrderedDict keeps it
 class SortedDict(dict):
     """
     A dictionary that keeps its keys in the order in which they're inserted.
+    The order is kept in a doubly linked list of [prev, next, key] links
+    indexed by key, so adding, removing and moving a key is O(1).
     """
     def __new__(cls, *args, **kwargs):
         instance = super(SortedDict, cls).__new__(cls, *args, **kwargs)
-        instance.keyOrder = []
+        instance._reset()
         return instance
 
     def __init__(self, data=None):
+        super(SortedDict, self).__init__()
         if data is None:
-            data = {}
-        elif isinstance(data, GeneratorType):
-            # Unfortunately we need to be able to read a generator twice.  Once
-            # to get the data into self with our super().__init__ call and a
-            # second time to setup keyOrder correctly
-            data = list(data)
-        super(SortedDict, self).__init__(data)
+            return
         if isinstance(data, dict):
-            self.keyOrder = data.keys()
+            data = data.iteritems()
+        for key, value in data:
+            self[key] = value
+
+    def _reset(self):
+        self._root = root = []
+        root[:] = [root, root, None]
+        self._links = {}
+
+    def _link_before(self, successor, key):
+        link = [successor[PREV], successor, key]
+        successor[PREV][NEXT] = link
+        successor[PREV] = link
+        self._links[key] = link
+
+    def _unlink(self, key):
+        link = self._links.pop(key)
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _link_at(self, index):
+        """
+        Returns link of the key at given index or the root link if index
+        is past the last key. Walks from the nearer end of the list.
+        """
+        size = len(self)
+        if index < 0:
+            index = max(index + size, 0)
+        if index >= size:
+            return self._root
+        if index < size // 2:
+            link = self._root[NEXT]
+            for i in xrange(index):
+                link = link[NEXT]
         else:
-            self.keyOrder = []
-            seen = set()
-            for key, value in data:
-                if key not in seen:
-                    self.keyOrder.append(key)
-                    seen.add(key)
+            link = self._root[PREV]
+            for i in xrange(size - index - 1):
+                link = link[PREV]
+        return link
+
+    def _position(self, key):
+        for index, item in enumerate(self):
+            if item == key:
+                return index
 
     def __deepcopy__(self, memo):
         return self.__class__([(key, copy.deepcopy(value, memo))
@@ -39,48 +76,58 @@ class SortedDict(dict):
 
     def __setitem__(self, key, value):
         if key not in self:
-            self.keyOrder.append(key)
+            self._link_before(self._root, key)
         super(SortedDict, self).__setitem__(key, value)
 
     def __delitem__(self, key):
         super(SortedDict, self).__delitem__(key)
-        self.keyOrder.remove(key)
+        self._unlink(key)
 
     def __iter__(self):
-        return iter(self.keyOrder)
+        root = self._root
+        link = root[NEXT]
+        while link is not root:
+            yield link[KEY]
+            link = link[NEXT]
+
+    def __reversed__(self):
+        root = self._root
+        link = root[PREV]
+        while link is not root:
+            yield link[KEY]
+            link = link[PREV]
 
     def pop(self, k, *args):
         result = super(SortedDict, self).pop(k, *args)
-        try:
-            self.keyOrder.remove(k)
-        except ValueError:
-            # Key wasn't in the dictionary in the first place. No problem.
-            pass
+        if k in self._links:
+            self._unlink(k)
         return result
 
     def popitem(self):
-        result = super(SortedDict, self).popitem()
-        self.keyOrder.remove(result[0])
-        return result
+        """Removes and returns the last inserted (key, value) pair."""
+        if not self:
+            raise KeyError('dictionary is empty')
+        key = self._root[PREV][KEY]
+        return key, self.pop(key)
 
     def items(self):
-        return zip(self.keyOrder, self.values())
+        return list(self.iteritems())
 
     def iteritems(self):
-        for key in self.keyOrder:
+        for key in self:
             yield key, self[key]
 
     def keys(self):
-        return self.keyOrder[:]
+        return list(self)
 
     def iterkeys(self):
-        return iter(self.keyOrder)
+        return iter(self)
 
     def values(self):
-        return map(self.__getitem__, self.keyOrder)
+        return list(self.itervalues())
 
     def itervalues(self):
-        for key in self.keyOrder:
+        for key in self:
             yield self[key]
 
     def update(self, dict_):
@@ -89,29 +136,42 @@ class SortedDict(dict):
 
     def setdefault(self, key, default):
         if key not in self:
-            self.keyOrder.append(key)
-        return super(SortedDict, self).setdefault(key, default)
+            self[key] = default
+        return self[key]
 
     def value_for_index(self, index):
         """Returns the value of the item at the given zero-based index."""
-        return self[self.keyOrder[index]]
+        if not -len(self) <= index < len(self):
+            raise IndexError('index out of range')
+        return self[self._link_at(index)[KEY]]
 
     def insert(self, index, key, value):
         """Inserts the key, value pair before the item with the given index."""
-        if key in self.keyOrder:
-            n = self.keyOrder.index(key)
-            del self.keyOrder[n]
-            if n < index:
-                index -= 1
-        self.keyOrder.insert(index, key)
+        if index < 0:
+            # negative index counts from the end of the order without key
+            index = max(index + len(self) - (key in self), 0)
+            if key in self and self._position(key) < index:
+                index += 1
+        successor = self._link_at(index)
+        if successor is self._links.get(key):
+            super(SortedDict, self).__setitem__(key, value)
+            return
+        if key in self._links:
+            self._unlink(key)
+        self._link_before(successor, key)
         super(SortedDict, self).__setitem__(key, value)
 
+    def move_to_end(self, key, last=True):
+        """Moves existing key to either end of the order."""
+        self._unlink(key)
+        successor = last and self._root or self._root[NEXT]
+        self._link_before(successor, key)
+
     def copy(self):
         """Returns a copy of this object."""
         # This way of initializing the copy means it works for subclasses, too.
-        obj = self.__class__(self)
-        obj.keyOrder = self.keyOrder[:]
-        return obj
+        return self.__class__(self)
+    __copy__ = copy
 
     def __repr__(self):
         """
@@ -122,4 +182,4 @@ class SortedDict(dict):
 
     def clear(self):
         super(SortedDict, self).clear()
-        self.keyOrder = []
+        self._reset()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import logging
+import threading
+
+
+class QueueHandler(logging.Handler):
+    """
+    Logging handler which passes records to a background thread. The thread
+    formats records (messages marked as deferred, eg. masked command output,
+    are rendered there too) and emits them through target handler in
+    batches.
+    """
+    batch_size = 256
+
+    def __init__(self, target):
+        logging.Handler.__init__(self, level=target.level)
+        self.target = target
+        self.queue = Queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._write,
+                                        name='packstack-log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, record):
+        """
+        Renders everything which could change before the record is written
+        in background, deferred messages are left for the writer thread.
+        """
+        if not getattr(record.msg, 'deferred', False):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            self.target.acquire()
+            try:
+                for record in batch:
+                    if record is None:
+                        running = False
+                        continue
+                    self.target.emit(record)
+                self.target.flush()
+            finally:
+                self.target.release()
+                for record in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        """
+        Waits until all queued records are written.
+        """
+        if not self._closed:
+            self.queue.join()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.queue.put(None)
+            self._thread.join()
+            self.target.close()
+        logging.Handler.close(self)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import pstats
+
+
+# builtin functions which are blocking while waiting for executed commands
+# (and so remote hosts)
+re_waiting = re.compile(r'sleep|select|poll|waitpid|posix\.read')
+
+# functions whose cumulative time is reported as separate activity
+ACTIVITIES = (
+    ('masking output', 'strings.py', 'mask_string'),
+    ('template rendering', 'ospluginutils.py', 'getManifestTemplate'),
+    ('template rendering', 'shell.py', 'template'),
+    ('logging', os.path.join('logging', '__init__.py'), '_log'),
+)
+
+
+def _function_key(function):
+    code = function.func_code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class ProfileReport(object):
+    """
+    Summarizes profile of Packstack run by sequences, by plugins and by
+    activities (waiting for commands vs. Python code overhead).
+    """
+    def __init__(self, stats, sequences=None):
+        if not isinstance(stats, pstats.Stats):
+            stats = pstats.Stats(stats)
+        self.stats = stats
+        self.sequences = sequences or []
+
+    def _cumtime(self, key):
+        try:
+            return self.stats.stats[key][3]
+        except KeyError:
+            return 0.0
+
+    @property
+    def total(self):
+        return self.stats.total_tt
+
+    def by_sequence(self):
+        """
+        Returns list of (sequence name, time) tuples.
+        """
+        result = []
+        for sequence in self.sequences:
+            duration = 0.0
+            for step in sequence.steps.itervalues():
+                if step.function:
+                    duration += self._cumtime(_function_key(step.function))
+            result.append((sequence.name, duration))
+        return result
+
+    def by_plugin(self):
+        """
+        Returns list of (plugin module name, time) tuples sorted by time.
+        """
+        result = {}
+        for sequence in self.sequences:
+            for step in sequence.steps.itervalues():
+                if not step.function:
+                    continue
+                plugin = step.function.__module__
+                duration = self._cumtime(_function_key(step.function))
+                result[plugin] = result.get(plugin, 0.0) + duration
+        return sorted(result.items(), key=lambda x: x[1], reverse=True)
+
+    def by_activity(self):
+        """
+        Returns list of (activity, time) tuples. Time which is not spent
+        waiting or in any specific activity is reported as other Python
+        code.
+        """
+        result = {}
+        waiting = 0.0
+        for key, value in self.stats.stats.iteritems():
+            filename, lineno, name = key
+            if filename == '~' and re_waiting.search(name):
+                waiting += value[2]
+                continue
+            for activity, path, function in ACTIVITIES:
+                if filename.endswith(path) and name == function:
+                    result[activity] = result.get(activity, 0.0) + value[3]
+        other = self.total - waiting - sum(result.values())
+        output = [('waiting for commands', waiting)]
+        output.extend(sorted(result.items()))
+        output.append(('other Python code', max(other, 0.0)))
+        return output
+
+    def render(self):
+        lines = ['Total profiled time: %.2fs' % self.total]
+        for title, data in (('Time by sequence:', self.by_sequence()),
+                            ('Time by plugin:', self.by_plugin()),
+                            ('Time by activity:', self.by_activity())):
+            lines.append(title)
+            for name, duration in data:
+                lines.append('    %s%8.2fs' % (name.ljust(50), duration))
+        return '\n'.join(lines)
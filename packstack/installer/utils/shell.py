@@ -7,11 +7,65 @@ import subprocess
 
 from ..exceptions import (ExecuteRuntimeError, ScriptRuntimeError,
                           NetworkError)
-from .strings import mask_string
+from .strings import Masker
 
 
 block_fmt = ("\n============= %(title)s ==========\n%(content)s\n"
              "======== END OF %(title)s ========")
+repl_list = [("'", "'\\''")]
+
+# masks values which should never appear in logged commands and their
+# output, run_setup replaces it whenever the set of masked values changes
+_masker = Masker()
+# maskers extending _masker by additional mask lists of calls
+_maskers = {}
+MASKER_CACHE_SIZE = 32
+
+
+def get_masker():
+    return _masker
+
+
+def set_masker(masker):
+    global _masker
+    _masker = masker
+    _maskers.clear()
+
+
+def _get_masker(mask_list):
+    """
+    Returns masker for given additional mask_list. Maskers are cached,
+    because the same mask_list is usually passed by repeated calls.
+    """
+    if not mask_list:
+        return _masker
+    key = frozenset(mask_list)
+    masker = _maskers.get(key)
+    if masker is None:
+        if len(_maskers) >= MASKER_CACHE_SIZE:
+            _maskers.clear()
+        masker = Masker(_masker.mask_list.union(key), repl_list)
+        _maskers[key] = masker
+    return masker
+
+
+class MaskedMessage(object):
+    """
+    Log message which is masked and formatted only when the record is
+    written, so no work is done for records dropped because of logging
+    level and the work is done by log writer thread if QueueHandler is used.
+    """
+    deferred = True
+
+    def __init__(self, fmt, params, masker=None):
+        self.fmt = fmt
+        self.params = params
+        self.masker = masker or Masker()
+
+    def __str__(self):
+        params = dict([(key, self.masker.mask(value))
+                       for key, value in self.params.iteritems()])
+        return self.fmt % params
 
 
 def execute(cmd, workdir=None, can_fail=True, mask_list=None,
@@ -21,35 +75,33 @@ def execute(cmd, workdir=None, can_fail=True, mask_list=None,
     ExecuteRuntimeError is raised if command returned non-zero return
     code. Otherwise
     """
-    mask_list = mask_list or []
-    repl_list = [("'", "'\\''")]
+    masker = _get_masker(mask_list)
 
     if not isinstance(cmd, types.StringType):
         import pipes
-        masked = ' '.join((pipes.quote(i) for i in cmd))
+        command = ' '.join((pipes.quote(i) for i in cmd))
     else:
-        masked = cmd
-    masked = mask_string(masked, mask_list, repl_list)
+        command = cmd
     if log:
-        logging.info("Executing command:\n%s" % masked)
+        logging.info(MaskedMessage("Executing command:\n%(command)s",
+                                   {'command': command}, masker))
 
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE, cwd=workdir,
                             shell=use_shell, close_fds=True)
     out, err = proc.communicate()
-    masked_out = mask_string(out, mask_list, repl_list)
-    masked_err = mask_string(err, mask_list, repl_list)
     if log:
-        logging.debug(block_fmt % {'title': 'STDOUT', 'content': masked_out})
+        logging.debug(MaskedMessage(block_fmt, {'title': 'STDOUT',
+                                                'content': out}, masker))
 
     if proc.returncode:
         if log:
-            logging.debug(block_fmt % {'title': 'STDERR',
-                                       'content': masked_err})
+            logging.debug(MaskedMessage(block_fmt, {'title': 'STDERR',
+                                                    'content': err}, masker))
         if can_fail:
             msg = ('Failed to execute command, '
                    'stdout: %s\nstderr: %s' %
-                   (masked_out, masked_err))
+                   (masker.mask(out), masker.mask(err)))
             raise ExecuteRuntimeError(msg, stdout=out, stderr=err)
     return proc.returncode, out
 
@@ -68,14 +120,13 @@ class ScriptRunner(object):
         self.script = []
 
     def execute(self, can_fail=True, mask_list=None, log=True):
-        mask_list = mask_list or []
-        repl_list = [("'", "'\\''")]
+        masker = _get_masker(mask_list)
         script = "\n".join(self.script)
 
-        masked = mask_string(script, mask_list, repl_list)
         if log:
-            logging.info("[%s] Executing script:\n%s" %
-                         (self.ip or 'localhost', masked))
+            fmt = "[%s] Executing script:\n%%(script)s" % (self.ip or
+                                                           'localhost')
+            logging.info(MaskedMessage(fmt, {'script': script}, masker))
 
         _PIPE = subprocess.PIPE  # pylint: disable=E1101
         if self.ip:
@@ -89,17 +140,19 @@ class ScriptRunner(object):
 
         script = "function t(){ exit $? ; } \n trap t ERR \n" + script
         out, err = obj.communicate(script)
-        masked_out = mask_string(out, mask_list, repl_list)
-        masked_err = mask_string(err, mask_list, repl_list)
         if log:
-            logging.debug(block_fmt % {'title': 'STDOUT',
-                                       'content': masked_out})
+            logging.debug(MaskedMessage(block_fmt, {'title': 'STDOUT',
+                                                    'content': out},
+                                        masker))
 
         if obj.returncode:
             if log:
-                logging.debug(block_fmt % {'title': 'STDERR',
-                                           'content': masked_err})
+                logging.debug(MaskedMessage(block_fmt, {'title': 'STDERR',
+                                                        'content': err},
+                                            masker))
             if can_fail:
+                masked_out = masker.mask(out)
+                masked_err = masker.mask(err)
                 pattern = (r'^ssh\:')
                 if re.search(pattern, err):
                     raise NetworkError(masked_err, stdout=out, stderr=err)
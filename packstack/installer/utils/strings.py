@@ -17,6 +17,38 @@ def color_text(text, color):
     return '%s%s%s' % (COLORS[color], text, COLORS['nocolor'])
 
 
+class Masker(object):
+    """
+    Replaces all words from mask_list with MASK in given string. If words
+    are needed to be transformed before masking, transformation could be
+    describe in replace list, both original and transformed words are
+    masked then. Words are transformed only once, when Masker is created,
+    so it should be created only once for given mask_list.
+    """
+    def __init__(self, mask_list=None, replace_list=None):
+        self.mask_list = frozenset(mask_list or [])
+        self.replace_list = replace_list or []
+
+        words = set()
+        for word in self.mask_list:
+            if not word or not isinstance(word, basestring):
+                continue
+            words.add(word)
+            for before, after in self.replace_list:
+                word = word.replace(before, after)
+            words.add(word)
+        # longer words have to be replaced first, because they can contain
+        # shorter ones
+        self._words = sorted(words, key=len, reverse=True)
+
+    def mask(self, unmasked):
+        if not unmasked:
+            return unmasked
+        for word in self._words:
+            unmasked = unmasked.replace(word, STR_MASK)
+        return unmasked
+
+
 def mask_string(unmasked, mask_list=None, replace_list=None):
     """
     Replaces words from mask_list with MASK in unmasked string.
@@ -24,17 +56,7 @@ def mask_string(unmasked, mask_list=None, replace_list=None):
     could be describe in replace list. For example [("'","'\\''")]
     replaces all ' characters with '\\''.
     """
-    mask_list = mask_list or []
-    replace_list = replace_list or []
-
-    masked = unmasked
-    for word in sorted(mask_list, lambda x, y: len(y) - len(x)):
-        if not word:
-            continue
-        for before, after in replace_list:
-            word = word.replace(before, after)
-        masked = masked.replace(word, STR_MASK)
-    return masked
+    return Masker(mask_list, replace_list).mask(unmasked)
 
 
 def state_format(msg, state, color):
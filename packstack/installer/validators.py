@@ -6,9 +6,12 @@ Contains all core validation functions.
 
 import os
 import re
+import Queue
+import sys
 import socket
 import logging
 import tempfile
+import threading
 import traceback
 
 import basedefs
@@ -23,7 +26,7 @@ __all__ = ('ParamValidationError', 'validate_integer', 'validate_float',
            'validate_options', 'validate_multi_options', 'validate_ip',
            'validate_multi_ip', 'validate_file', 'validate_ping',
            'validate_multi_ping', 'validate_ssh', 'validate_multi_ssh',
-           'validate_sshkey')
+           'validate_sshkey', 'ValidationBatch')
 
 
 def validate_integer(param, options=None):
@@ -263,3 +266,108 @@ def validate_sshkey(param, options=None):
         msg = 'Public SSH key is required. You passed private key.'
     if msg:
         raise ParamValidationError(msg)
+
+
+# validators which wait for remote hosts, they are run concurrently
+# by ValidationBatch
+NETWORK_VALIDATORS = (validate_ping, validate_ssh)
+# count of threads running network validators
+BATCH_WORKERS = 16
+
+
+def _split_checks(func, value):
+    """
+    Returns list of (validator, value) checks equivalent to given
+    validator, validators of comma separated hosts are split to checks
+    of single hosts, so the same host is checked only once.
+    """
+    if func is validate_multi_ssh:
+        return [(validate_ssh, i.strip()) for i in value.split(',')]
+    if func is validate_multi_ping and value:
+        return [(validate_ping, i.strip()) for i in value.split(',')]
+    return [(func, value)]
+
+
+class ValidationBatch(object):
+    """
+    Collects validations of parameter values and runs them at once.
+    Identical checks are run only once and checks waiting for network
+    are run concurrently. All failures are reported together.
+    """
+    def __init__(self, workers=BATCH_WORKERS):
+        self.workers = workers
+        # check key -> list of parameter names
+        self.checks = {}
+        self.order = []
+
+    def add(self, name, validators, value, options=None):
+        options = options or []
+        for func in validators or []:
+            for check, checked in _split_checks(func, value):
+                key = (check, checked, tuple(options))
+                if key not in self.checks:
+                    self.checks[key] = []
+                    self.order.append(key)
+                if name not in self.checks[key]:
+                    self.checks[key].append(name)
+
+    def _check(self, key):
+        func, value, options = key
+        try:
+            func(value, list(options))
+        except ParamValidationError, ex:
+            return str(ex)
+        return None
+
+    def _run_network(self, keys, results):
+        queue = Queue.Queue()
+        for key in keys:
+            queue.put(key)
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    key = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[key] = self._check(key)
+                except Exception:
+                    # unexpected errors are raised in the main thread
+                    errors.append(sys.exc_info())
+
+        threads = []
+        for i in range(min(self.workers, len(keys))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    def run(self):
+        """
+        Runs all collected checks and returns list of (parameter names,
+        error message) tuples of failed checks in the order the checks
+        were added.
+        """
+        results = {}
+        network = []
+        for key in self.order:
+            if key[0] in NETWORK_VALIDATORS:
+                network.append(key)
+            else:
+                results[key] = self._check(key)
+        logging.debug('Running %d network validations concurrently.' %
+                      len(network))
+        self._run_network(network, results)
+
+        failures = []
+        for key in self.order:
+            if results.get(key) is not None:
+                failures.append((self.checks[key], results[key]))
+        self.checks, self.order = {}, []
+        return failures
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compressed archive of Puppet manifests and logs of Packstack runs. Logs of
+each run are stored in single pack file of separately compressed members
+with JSON index of their byte offsets, so any log can be extracted without
+unpacking the whole run. Manifests are stored by their content hash, so
+manifests identical across runs are stored only once:
+
+    python -m packstack.modules.archive <run> [<name>]
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+
+from cStringIO import StringIO
+
+from packstack.installer import basedefs
+
+
+# TODO: Fill logger name when logging system will be refactored
+logger = logging.getLogger()
+
+ARCHIVE_DIR = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'archive')
+# archives and run directories older than this count of days are pruned
+RETENTION_DAYS = 30
+
+# names of run directories created in basedefs.PACKSTACK_VAR_DIR
+re_rundir = re.compile(r'^\d{8}-\d{6}-')
+# size of file parts read at once
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(fileobj):
+    """
+    Returns hash of content of given file object read by chunks.
+    """
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), ''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compress_stream(src, dst):
+    """
+    Writes content of file object src compressed to file object dst as
+    single gzip member. Content is copied by chunks, so files of any size
+    can be compressed. dst is left open.
+    """
+    # zero mtime and empty name make members of identical content identical
+    gz = gzip.GzipFile(filename='', fileobj=dst, mode='wb', mtime=0)
+    try:
+        shutil.copyfileobj(src, gz, CHUNK_SIZE)
+    finally:
+        gz.close()
+
+
+def decompress(data):
+    return gzip.GzipFile(fileobj=StringIO(data), mode='rb').read()
+
+
+class RunArchive(object):
+    """
+    Archive of manifests and logs of single Packstack run.
+    """
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = directory or ARCHIVE_DIR
+        self.objects_dir = os.path.join(self.directory, 'objects')
+        self.pack_path = os.path.join(self.directory, '%s.pack' % name)
+        self.index_path = os.path.join(self.directory, '%s.index' % name)
+        self.index = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index:
+                self.index = json.load(index)
+
+    def _makedirs(self):
+        if not os.path.isdir(self.objects_dir):
+            os.makedirs(self.objects_dir, 0700)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, '%s.gz' % digest)
+
+    def add_manifest(self, host, name, path, status):
+        """
+        Stores given manifest file unless the same content is already
+        stored by any run.
+        """
+        self._makedirs()
+        with open(path, 'rb') as manifest:
+            digest = file_content_hash(manifest)
+            size = manifest.tell()
+            objpath = self._object_path(digest)
+            if not os.path.exists(objpath):
+                manifest.seek(0)
+                with open(objpath, 'wb') as obj:
+                    compress_stream(manifest, obj)
+        self.index.append({'host': host, 'name': name, 'kind': 'manifest',
+                           'status': status, 'hash': digest,
+                           'size': size})
+
+    def add_log(self, host, name, path, status):
+        """
+        Appends compressed log file to pack file of this run.
+        """
+        self._makedirs()
+        fd = os.open(self.pack_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                     0600)
+        with os.fdopen(fd, 'ab') as pack:
+            pack.seek(0, os.SEEK_END)
+            offset = pack.tell()
+            with open(path, 'rb') as log:
+                compress_stream(log, pack)
+            length = pack.tell() - offset
+        self.index.append({'host': host, 'name': name, 'kind': 'log',
+                           'status': status, 'offset': offset,
+                           'length': length})
+
+    def save(self):
+        self._makedirs()
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                     0600)
+        with os.fdopen(fd, 'w') as index:
+            json.dump(self.index, index, indent=1)
+
+    def entries(self, host=None, kind=None):
+        return [i for i in self.index
+                if (host is None or i['host'] == host) and
+                   (kind is None or i['kind'] == kind)]
+
+    def read(self, name):
+        """
+        Returns content of given manifest or log file.
+        """
+        for entry in self.index:
+            if entry['name'] == name:
+                break
+        else:
+            raise KeyError('File %s is not archived in run %s' %
+                           (name, self.name))
+        if entry['kind'] == 'manifest':
+            with open(self._object_path(entry['hash']), 'rb') as obj:
+                return decompress(obj.read())
+        with open(self.pack_path, 'rb') as pack:
+            pack.seek(entry['offset'])
+            return decompress(pack.read(entry['length']))
+
+
+def list_runs(directory=None):
+    directory = directory or ARCHIVE_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted([i[:-len('.index')] for i in os.listdir(directory)
+                   if i.endswith('.index')])
+
+
+def _older_than(path, cutoff):
+    try:
+        return os.path.getmtime(path) < cutoff
+    except OSError:
+        return False
+
+
+def prune_archives(days=RETENTION_DAYS, directory=None):
+    """
+    Removes archives of runs older than given count of days and manifests
+    which are not referenced by any remaining run.
+    """
+    directory = directory or ARCHIVE_DIR
+    cutoff = time.time() - days * 24 * 3600
+    referenced = set()
+    for run in list_runs(directory):
+        archive = RunArchive(run, directory)
+        if _older_than(archive.index_path, cutoff):
+            logger.debug('Pruning archive of run %s' % run)
+            for path in (archive.index_path, archive.pack_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            continue
+        for entry in archive.entries(kind='manifest'):
+            referenced.add('%s.gz' % entry['hash'])
+
+    objects_dir = os.path.join(directory, 'objects')
+    if not os.path.isdir(objects_dir):
+        return
+    for fname in os.listdir(objects_dir):
+        if fname not in referenced:
+            os.remove(os.path.join(objects_dir, fname))
+
+
+def prune_rundirs(days=RETENTION_DAYS, directory=None, keep=()):
+    """
+    Removes run directories older than given count of days from
+    basedefs.PACKSTACK_VAR_DIR. Directories given in keep are never removed.
+    """
+    directory = directory or basedefs.PACKSTACK_VAR_DIR
+    cutoff = time.time() - days * 24 * 3600
+    keep = set([os.path.abspath(i) for i in keep])
+    for fname in os.listdir(directory):
+        path = os.path.join(directory, fname)
+        if (not re_rundir.match(fname) or not os.path.isdir(path) or
+                os.path.abspath(path) in keep):
+            continue
+        if _older_than(path, cutoff):
+            logger.debug('Pruning run directory %s' % path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def main(argv):
+    """
+    Lists files archived in given run or prints content of given file.
+    """
+    if len(argv) not in (2, 3):
+        sys.stderr.write('Usage: %s <run> [<name>]\nArchived runs: %s\n' %
+                         (argv[0], ', '.join(list_runs())))
+        return 1
+    archive = RunArchive(argv[1])
+    if len(argv) == 3:
+        sys.stdout.write(archive.read(argv[2]))
+        return 0
+    for entry in archive.index:
+        print '%(host)s\t%(kind)s\t%(status)s\t%(name)s' % entry
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
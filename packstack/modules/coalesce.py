@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+Merging of manifests applied on the same host in the same stage into
+single catalog, so Puppet compiles catalog, resolves facts and prefetches
+providers once instead of once per manifest. Errors of the merged run are
+attributed back to the manifests (fragments) they come from.
+"""
+
+import re
+
+
+# resource and class declarations: type { 'title':
+re_declaration = re.compile(r'^\s*([\w:]+)\s*\{\s*["\']([^"\']+)["\']\s*:',
+                            re.M)
+# classes included by manifest: include name
+re_include = re.compile(r'^\s*(?:include|require|contain)\s+["\']?([\w:]+)',
+                        re.M)
+# resource paths in Puppet messages: /Stage[main]/Class::Name/Type[title]
+re_resource_path = re.compile(r'/Stage\[[^\]]*\]/(?P<class>[\w:]*)'
+                              r'(?:/(?P<type>[\w:]+)\[(?P<title>[^\]]*)\])?')
+
+
+def declarations(text):
+    """
+    Returns set of (type, title) tuples of resources and classes declared
+    by given manifest content, types are lower case.
+    """
+    return set([(rtype.lower(), title)
+                for rtype, title in re_declaration.findall(text)])
+
+
+def coalesce_groups(fragments):
+    """
+    Splits given list of (name, content) fragments to list of groups
+    of fragment names, fragments of each group don't declare the same
+    resource or class, so they can be merged.
+    """
+    groups = []
+    for name, text in fragments:
+        declared = declarations(text)
+        for group in groups:
+            if not group[1] & declared:
+                group[0].append(name)
+                group[1].update(declared)
+                break
+        else:
+            groups.append(([name], set(declared)))
+    return [names for names, declared in groups]
+
+
+class CombinedManifest(object):
+    """
+    Manifest merged from fragments with line ranges of each fragment,
+    which are used to attribute Puppet errors to fragments.
+    """
+    def __init__(self, name, header=''):
+        self.name = name
+        self.fragments = []
+        self.declared = {}
+        self.classes = {}
+        self._parts = [header]
+        self._lines = header.count('\n')
+        # (first line, last line, fragment name)
+        self._ranges = []
+
+    def add(self, name, text):
+        if not text.endswith('\n'):
+            text += '\n'
+        first = self._lines + 1
+        self._lines += text.count('\n')
+        self._ranges.append((first, self._lines, name))
+        self._parts.append(text)
+        self.fragments.append(name)
+        for rtype, title in declarations(text):
+            self.declared[(rtype, title.lower())] = name
+            if rtype == 'class':
+                self.classes.setdefault(title.lower().lstrip(':'), name)
+        for title in re_include.findall(text):
+            self.classes.setdefault(title.lower().lstrip(':'), name)
+
+    @property
+    def content(self):
+        return ''.join(self._parts)
+
+    def fragment_at(self, line):
+        for first, last, name in self._ranges:
+            if first <= line <= last:
+                return name
+        return None
+
+    def attribute(self, error):
+        """
+        Returns list of fragments given Puppet error message belongs to.
+        Only errors of resources are attributed to single fragment by
+        resource path mentioned in them. Other errors (eg. parse errors or
+        duplicate declarations) fail compilation of the whole catalog, so
+        nothing of any fragment is applied and they belong to all fragments.
+        """
+        for match in re_resource_path.finditer(error):
+            if match.group('type'):
+                key = (match.group('type').lower(),
+                       match.group('title').lower())
+                if key in self.declared:
+                    return [self.declared[key]]
+            # classes are declared by fragments or included by classes
+            # declared in them, so the closest declared parent is used
+            parts = match.group('class').lower().split('::')
+            while parts:
+                name = self.classes.get('::'.join(parts))
+                if name:
+                    return [name]
+                parts.pop()
+        return list(self.fragments)
+
+    def split_errors(self, errors, finished=True):
+        """
+        Returns dictionary of lists of given errors by fragment name. If the
+        catalog run did not finish, all errors belong to all fragments and
+        fragments fail even if there is no error.
+        """
+        result = dict([(name, []) for name in self.fragments])
+        if not finished:
+            errors = errors or ['Puppet run of %s did not finish' % self.name]
+            for name in self.fragments:
+                result[name].extend(errors)
+            return result
+        for error in errors:
+            for name in self.attribute(error):
+                result[name].append(error)
+        return result
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+
+from packstack.installer import basedefs
+
+
+# TODO: Fill logger name when logging system will be refactored
+logger = logging.getLogger()
+
+# processed and validated parameter values of the last answer file
+CONF_CACHE_FILE = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'conf_cache.json')
+
+
+def _source_path(module):
+    path = getattr(module, '__file__', None)
+    return path and '%s.py' % os.path.splitext(path)[0]
+
+
+def cache_key(answerfile, modules):
+    """
+    Returns hash of given answer file content and sources of given
+    modules (plugins, processors and validators), so the cache is used
+    only for the same answer file processed by the same code.
+    """
+    digest = hashlib.sha1()
+    with open(answerfile, 'rb') as fp:
+        digest.update(fp.read())
+    for module in sorted(modules, key=lambda x: x.__name__):
+        digest.update('\0%s\0' % module.__name__)
+        path = _source_path(module)
+        try:
+            with open(path, 'rb') as fp:
+                digest.update(fp.read())
+        except (IOError, TypeError):
+            # source is not available, version can't be determined
+            return None
+    return digest.hexdigest()
+
+
+def load_conf(key, path=None):
+    """
+    Returns parameter values cached for given key or None if there are no
+    values cached for the key.
+    """
+    path = path or CONF_CACHE_FILE
+    if key is None:
+        return None
+    try:
+        with open(path) as cachefile:
+            cache = json.load(cachefile)
+    except (IOError, ValueError):
+        logger.debug('Unable to load processed configuration from %s' % path)
+        return None
+    if not isinstance(cache, dict) or cache.get('key') != key:
+        return None
+    # processors create some files (eg. SSH key), values referring to
+    # them are valid only while the files exist
+    for fname in cache.get('files', []):
+        if not os.path.exists(fname):
+            logger.debug('Cached configuration refers to missing file %s'
+                         % fname)
+            return None
+    # plugins expect str values, json loads unicode ones
+    conf = {}
+    for name, value in cache.get('conf', {}).iteritems():
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        conf[name.encode('utf-8')] = value
+    return conf
+
+
+def save_conf(key, conf, path=None):
+    path = path or CONF_CACHE_FILE
+    if key is None:
+        return
+    files = [i for i in conf.itervalues()
+             if isinstance(i, basestring) and os.path.isabs(i) and
+             os.path.exists(i)]
+    # cached values contain passwords
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'w') as cachefile:
+        json.dump({'key': key, 'conf': conf, 'files': sorted(files)},
+                  cachefile)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pull based distribution of Puppet modules. Bundles are served by HTTP
+server started on the deploy host and hosts fetch them in parallel, so
+the deploy host does not compress and encrypt the same content once per
+host.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import uuid
+import zlib
+
+from packstack.installer.core.drones import (SSH_OPTS, TRANSFER_CODECS,
+                                             write_archive)
+
+
+# TODO: Fill logger name when logging system will be refactored
+logger = logging.getLogger()
+
+# directory in host temporary directory with bundles relayed to other hosts
+RELAY_DIR = 'relay'
+# serves current directory on random port, which is printed first
+RELAY_SERVER = ("python -c 'import sys, SimpleHTTPServer, SocketServer; "
+                "server = SocketServer.ThreadingTCPServer((\"\", 0), "
+                "SimpleHTTPServer.SimpleHTTPRequestHandler); "
+                "sys.stdout.write(\"%d\\n\" % server.server_address[1]); "
+                "sys.stdout.flush(); server.serve_forever()'")
+
+
+def local_address(hostname):
+    """
+    Returns address of the deploy host on the route to given host.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # no packet is sent, connect only selects the route
+        sock.connect((hostname, 9))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+# bytes of uncompressed bundle compressed to estimate speed of codecs
+SAMPLE_SIZE = 4 * 1024 * 1024
+# bytes sent to host to estimate throughput of the link
+PROBE_SIZE = 2 * 1024 * 1024
+# codec used when throughput of the link can't be measured
+DEFAULT_CODEC = 'fast'
+
+
+class _SampleFull(IOError):
+    pass
+
+
+class _SampleBuffer(object):
+    """
+    File object keeping first size bytes written to it, writing further
+    raises _SampleFull.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.chunks = []
+        self.length = 0
+
+    def write(self, data):
+        data = data[:self.size - self.length]
+        self.chunks.append(data)
+        self.length += len(data)
+        if self.length >= self.size:
+            raise _SampleFull('sample is complete')
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+def archive_sample(members, dereference=False, sample_size=SAMPLE_SIZE):
+    """
+    Returns first sample_size bytes of uncompressed tar archive of given
+    (path, arcname) members. Archive is streamed and only the sample is
+    built.
+    """
+    sample = _SampleBuffer(sample_size)
+    try:
+        write_archive(sample, members, None, dereference)
+    except _SampleFull:
+        pass
+    return sample.getvalue()
+
+
+def compression_profile(members, dereference=False,
+                        sample_size=SAMPLE_SIZE):
+    """
+    Returns dictionary of (compression ratio, bytes compressed per second)
+    tuples by codec name (see drones.TRANSFER_CODECS) estimated from
+    the beginning of uncompressed tar archive of given (path, arcname)
+    members.
+    """
+    sample = archive_sample(members, dereference, sample_size)
+    profile = {}
+    for codec, level in TRANSFER_CODECS.iteritems():
+        if level is None or not sample:
+            profile[codec] = (1.0, None)
+            continue
+        start = time.time()
+        compressed = zlib.compress(sample, level)
+        elapsed = time.time() - start
+        profile[codec] = (float(len(compressed)) / len(sample),
+                          elapsed > 0 and len(sample) / elapsed or None)
+    return profile
+
+
+def remote_command(hostname, script):
+    """
+    Returns command running given shell script on given host.
+    """
+    return ['ssh'] + SSH_OPTS + ['root@%s' % hostname, script]
+
+
+def measure_throughput(hostname, size=PROBE_SIZE):
+    """
+    Returns bytes per second sent to given host over SSH or None if the
+    throughput can't be measured. Time of an empty session is subtracted,
+    so connection setup does not count.
+    """
+    payload = os.urandom(size)
+    timings = []
+    for script, data in (('true', ''), ('cat > /dev/null', payload)):
+        start = time.time()
+        try:
+            with open(os.devnull, 'w') as devnull:
+                proc = subprocess.Popen(remote_command(hostname, script),
+                                        stdin=subprocess.PIPE,
+                                        stdout=devnull, stderr=devnull,
+                                        close_fds=True)
+            proc.communicate(data)
+        except (IOError, OSError), ex:
+            logger.debug('Unable to measure throughput to %s: %s' %
+                         (hostname, ex))
+            return None
+        if proc.returncode:
+            logger.debug('Unable to measure throughput to %s' % hostname)
+            return None
+        timings.append(time.time() - start)
+    elapsed = timings[1] - timings[0]
+    if elapsed <= 0:
+        return None
+    return len(payload) / elapsed
+
+
+def choose_codec(profile, throughput):
+    """
+    Returns name of the codec which transfers data fastest over link
+    with given throughput (bytes per second). Compression and transfer
+    are pipelined, so the slower of them determines the speed.
+    """
+    if not throughput:
+        return DEFAULT_CODEC
+
+    def cost(codec):
+        ratio, speed = profile[codec]
+        return max(speed and 1.0 / speed or 0, ratio / throughput)
+
+    # less compression wins ties, it costs less CPU on both ends
+    codecs = sorted(profile, key=lambda x: TRANSFER_CODECS[x] or 0)
+    return min(codecs, key=cost)
+
+
+def relay_tree(hosts, fanout):
+    """
+    Returns list of waves of (host, parent) tuples. The first wave contains
+    fanout hosts without parent, which are served by the deploy host, and
+    each host is parent of up to fanout hosts of the next wave.
+    """
+    waves = []
+    depths = []
+    for index, host in enumerate(hosts):
+        parent = index // fanout - 1
+        if parent < 0:
+            depth, parent_host = 0, None
+        else:
+            depth, parent_host = depths[parent] + 1, hosts[parent]
+        depths.append(depth)
+        if depth == len(waves):
+            waves.append([])
+        waves[depth].append((host, parent_host))
+    return waves
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _BundleHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.server.bundles.get(self.path)
+        if path is None:
+            self.send_error(404)
+            return
+        try:
+            bundle = open(path, 'rb')
+        except IOError:
+            self.send_error(404)
+            return
+        with bundle:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length',
+                             str(os.fstat(bundle.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(bundle, self.wfile)
+
+    def log_message(self, fmt, *args):
+        logger.debug('Bundle server: %s - %s' %
+                     (self.address_string(), fmt % args))
+
+
+class BundleServer(object):
+    """
+    HTTP server serving only added bundle files. It listens only on given
+    local addresses and every bundle is published under random path.
+    """
+    def __init__(self, addresses, port=0):
+        self.addresses = addresses
+        self.port = port
+        self.ports = {}
+        self.bundles = {}
+        self._servers = []
+
+    def add(self, path):
+        """
+        Publishes given file and returns its path on the server.
+        """
+        url_path = '/%s/%s' % (uuid.uuid4().hex, os.path.basename(path))
+        self.bundles[url_path] = path
+        return url_path
+
+    def url(self, address, url_path):
+        return 'http://%s:%d%s' % (address, self.ports[address], url_path)
+
+    def start(self):
+        for address in self.addresses:
+            server = _ThreadingHTTPServer((address, self.port),
+                                          _BundleHandler)
+            server.bundles = self.bundles
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self._servers.append((server, thread))
+            self.ports[address] = server.server_address[1]
+            logger.debug('Bundle server listening on %s:%d' %
+                         (address, self.ports[address]))
+
+    def stop(self):
+        for server, thread in self._servers:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self._servers = []
@@ -1,4 +1,6 @@
 
+import ast
+import glob
 import logging
 import os
 import re
@@ -12,6 +14,217 @@ controller = Controller()
 PUPPET_DIR = os.path.join(basedefs.DIR_PROJECT_DIR, "puppet")
 PUPPET_TEMPLATE_DIR = os.path.join(PUPPET_DIR, "templates")
 
+re_template_key = re.compile(r'%\((\w+)\)')
+
+
+def template_keys(template):
+    """
+    Returns set of CONF keys used by given template content, escaped
+    %%(...) sequences are not keys.
+    """
+    return set(re_template_key.findall(template.replace('%%', '')))
+
+
+class TemplateIndex(object):
+    """
+    Index of manifest templates mapping each template to CONF keys used
+    by it and each key to templates using it. Templates are read only once,
+    rendered templates are cached by values of their keys, so rendering
+    the same template with unchanged values does not repeat the work.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or PUPPET_TEMPLATE_DIR
+        self.templates = None
+        self.keys = {}
+        self.users = {}
+        self.rendered = {}
+
+    def _build(self):
+        self.templates = {}
+        self.keys = {}
+        self.users = {}
+        for path in glob.glob(os.path.join(self.directory, '*')):
+            if not os.path.isfile(path):
+                continue
+            name = os.path.basename(path)
+            with open(path) as fp:
+                self.templates[name] = fp.read()
+            self.keys[name] = template_keys(self.templates[name])
+            for key in self.keys[name]:
+                self.users.setdefault(key, set()).add(name)
+
+    def _ensure(self):
+        if self.templates is None:
+            self._build()
+
+    def getTemplate(self, name):
+        self._ensure()
+        if name not in self.templates:
+            # template outside of the indexed directory, eg. added later
+            with open(os.path.join(self.directory, name)) as fp:
+                self.templates[name] = fp.read()
+            self.keys[name] = template_keys(self.templates[name])
+        return self.templates[name]
+
+    def getKeys(self, name):
+        """
+        Returns set of CONF keys used by given template.
+        """
+        self.getTemplate(name)
+        return self.keys[name]
+
+    def getUsers(self, key):
+        """
+        Returns set of templates using given CONF key.
+        """
+        self._ensure()
+        return self.users.get(key, set())
+
+    def missingKeys(self, known, inactive=()):
+        """
+        Returns dictionary of templates by CONF keys which are used by any
+        template and are not in given known keys. Templates using any
+        of given inactive keys are not checked.
+        """
+        self._ensure()
+        inactive = set(inactive)
+        missing = {}
+        for name, keys in self.keys.iteritems():
+            if keys & inactive:
+                continue
+            for key in keys - set(known):
+                missing.setdefault(key, set()).add(name)
+        return missing
+
+    def render(self, name, conf):
+        template = self.getTemplate(name)
+        keys = sorted(self.keys[name])
+        try:
+            cache_key = (name, tuple([conf[i] for i in keys]))
+            hash(cache_key)
+        except (KeyError, TypeError):
+            # let missing keys fail on rendering, unhashable values
+            # are just not cached
+            return template % conf
+        if cache_key not in self.rendered:
+            self.rendered[cache_key] = template % conf
+        return self.rendered[cache_key]
+
+
+template_index = TemplateIndex()
+
+
+def _is_conf(node):
+    """
+    Returns True if given expression is config or controller.CONF.
+    """
+    return ((isinstance(node, ast.Name) and node.id == 'config') or
+            (isinstance(node, ast.Attribute) and node.attr == 'CONF'))
+
+
+def _literal_names(scope):
+    """
+    Returns dictionary of string literals by names of variables they are
+    assigned to or iterated by in given function or module, eg. key for
+    key = 'CONFIG_X' and for key, value in [('CONFIG_X', 1)].
+    """
+    names = {}
+
+    def bind(target, value):
+        if isinstance(target, ast.Name) and isinstance(value, ast.Str):
+            names.setdefault(target.id, set()).add(value.s)
+        elif (isinstance(target, ast.Tuple) and
+              isinstance(value, (ast.Tuple, ast.List))):
+            for item, element in zip(target.elts, value.elts):
+                bind(item, element)
+
+    for node in ast.walk(scope):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                bind(target, node.value)
+        elif (isinstance(node, ast.For) and
+              isinstance(node.iter, (ast.Tuple, ast.List))):
+            for element in node.iter.elts:
+                bind(node.target, element)
+    return names
+
+
+def assigned_conf_keys(source):
+    """
+    Returns set of CONF keys assigned by given plugin source, ie. keys
+    of config[...] and controller.CONF[...] assignment targets given by
+    string literal or by variable bound to string literals in the same
+    function.
+    """
+    tree = ast.parse(source)
+    keys = set()
+    scopes = [tree] + [i for i in ast.walk(tree)
+                       if isinstance(i, ast.FunctionDef)]
+    for scope in scopes:
+        names = _literal_names(scope)
+        targets = []
+        for node in ast.walk(scope):
+            if isinstance(node, ast.Assign):
+                targets.extend(node.targets)
+            elif isinstance(node, ast.AugAssign):
+                targets.append(node.target)
+        while targets:
+            target = targets.pop()
+            if isinstance(target, (ast.Tuple, ast.List)):
+                targets.extend(target.elts)
+                continue
+            if (not isinstance(target, ast.Subscript) or
+                    not _is_conf(target.value) or
+                    not isinstance(target.slice, ast.Index)):
+                continue
+            index = target.slice.value
+            if isinstance(index, ast.Str):
+                keys.add(index.s)
+            elif isinstance(index, ast.Name):
+                keys.update(names.get(index.id, ()))
+    return keys
+
+
+def runtime_conf_keys(controller):
+    """
+    Returns set of CONF keys which loaded plugins assign at runtime.
+    """
+    keys = set()
+    for plugin in controller.getAllPlugins():
+        path = getattr(plugin, '__file__', None)
+        if not path:
+            continue
+        path = '%s.py' % os.path.splitext(path)[0]
+        try:
+            with open(path) as source:
+                keys.update(assigned_conf_keys(source.read()))
+        except (IOError, SyntaxError):
+            logging.debug('Unable to scan source of plugin %s' % path)
+    return keys
+
+
+def checkTemplateKeys(controller):
+    """
+    Raises PackStackError if any template uses CONF key which is neither
+    in CONF nor assigned by plugin at runtime. Templates using parameters
+    of inactive groups are not rendered in this run, so they are skipped.
+    This is called before any remote action is done, so typos in templates
+    don't fail the installation halfway.
+    """
+    known = set(controller.CONF) | runtime_conf_keys(controller)
+    inactive = set()
+    for group in controller.getAllGroups():
+        for param in group.parameters.itervalues():
+            if param.CONF_NAME not in known:
+                inactive.add(param.CONF_NAME)
+    missing = template_index.missingKeys(known, inactive)
+    if not missing:
+        return
+    msg = ', '.join(['%s (used by %s)' % (key, ', '.join(sorted(names)))
+                     for key, names in sorted(missing.items())])
+    raise PackStackError('Manifest templates use unknown configuration '
+                         'keys: %s' % msg)
+
 
 class NovaConfig(object):
     """
@@ -40,11 +253,25 @@ class ManifestFiles(object):
         self.filelist = []
         self.data = {}
         self.global_data = None
+        # CONF keys used by templates of each manifest
+        self.keys = {}
+        self.global_keys = set()
+        # keys of templates rendered since the last addFile call
+        self.pending_keys = set()
+
+    def useKeys(self, keys):
+        """
+        Records CONF keys used by rendered template, they are assigned
+        to the manifest which is added next.
+        """
+        self.pending_keys.update(keys)
 
     # continuous manifest file that have the same marker can be
     # installed in parallel, if on different servers
     def addFile(self, filename, marker, data=''):
         self.data[filename] = self.data.get(filename, '') + '\n' + data
+        self.keys.setdefault(filename, set()).update(self.pending_keys)
+        self.pending_keys = set()
         for f, p in self.filelist:
             if f == filename:
                 return
@@ -54,14 +281,21 @@ class ManifestFiles(object):
     def getFiles(self):
         return [f for f in self.filelist]
 
+    def getKeys(self, filename):
+        """
+        Returns set of CONF keys used by given manifest.
+        """
+        return self.keys.get(filename, set()) | self.global_keys
+
     def writeManifests(self):
         """
         Write out the manifest data to disk, this should only be called once
         write before the puppet manifests are copied to the various servers
         """
         if not self.global_data:
-            with open(os.path.join(PUPPET_TEMPLATE_DIR, "global.pp")) as gfp:
-                self.global_data = gfp.read() % controller.CONF
+            self.global_keys = template_index.getKeys("global.pp")
+            self.global_data = template_index.render("global.pp",
+                                                     controller.CONF)
         os.mkdir(basedefs.PUPPET_MANIFEST_DIR, 0700)
         for fname, data in self.data.items():
             path = os.path.join(basedefs.PUPPET_MANIFEST_DIR, fname)
@@ -72,8 +306,8 @@ manifestfiles = ManifestFiles()
 
 
 def getManifestTemplate(template_name):
-    with open(os.path.join(PUPPET_TEMPLATE_DIR, template_name)) as fp:
-        return fp.read() % controller.CONF
+    manifestfiles.useKeys(template_index.getKeys(template_name))
+    return template_index.render(template_name, controller.CONF)
 
 
 def appendManifestFile(manifest_name, data, marker=''):
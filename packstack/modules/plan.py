@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import logging
+import os
+
+from packstack.installer import basedefs
+
+
+# TODO: Fill logger name when logging system will be refactored
+logger = logging.getLogger()
+
+TIMINGS_FILE = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'timings.json')
+# number of previous runs of each manifest used for duration estimation
+TIMINGS_KEEP = 5
+
+
+def manifest_key(hostname, manifest):
+    """
+    Returns host independent name of given manifest, eg. nova_compute.pp
+    for manifest 192.168.1.1_nova_compute.pp.
+    """
+    prefix = '%s_' % hostname
+    if manifest.startswith(prefix):
+        return manifest[len(prefix):]
+    return manifest
+
+
+def load_timings(path=None):
+    """
+    Returns dictionary of manifest durations (in seconds) recorded
+    during previous Packstack runs.
+    """
+    path = path or TIMINGS_FILE
+    try:
+        with open(path) as timefile:
+            return json.load(timefile)
+    except (IOError, ValueError):
+        logger.debug('Unable to load Puppet timings from %s' % path)
+        return {}
+
+
+def save_timings(timings, path=None):
+    path = path or TIMINGS_FILE
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'w') as timefile:
+        json.dump(timings, timefile)
+
+
+def record_timing(timings, key, seconds):
+    """
+    Stores duration of single manifest run, only last TIMINGS_KEEP
+    durations are kept for every manifest.
+    """
+    history = timings.setdefault(key, [])
+    history.append(seconds)
+    del history[:-TIMINGS_KEEP]
+
+
+def estimate_duration(timings, key):
+    """
+    Returns expected duration of given manifest or None if there is no
+    recorded history for it.
+    """
+    history = timings.get(key)
+    if not history:
+        return None
+    return sum(history) / len(history)
+
+
+def path_size(path):
+    """
+    Returns size of given file or directory tree in bytes. Symbolic links
+    are followed, because they are dereferenced during transfer too.
+    """
+    if not os.path.exists(path):
+        return 0
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, dirs, files in os.walk(path, followlinks=True):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            if os.path.exists(fpath):
+                size += os.path.getsize(fpath)
+    return size
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GB' % size
+
+
+def format_duration(seconds):
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+def group_stages(files):
+    """
+    Splits list of (manifest, marker) tuples to stages. Manifests in one
+    stage are applied in parallel, each stage is started only after all
+    manifests of the previous stage are finished.
+    """
+    stages = []
+    lastmarker = None
+    for manifest, marker in files:
+        if not stages or lastmarker != marker:
+            stages.append((marker, []))
+        stages[-1][1].append(manifest)
+        lastmarker = marker
+    return stages
+
+
+class DeploymentPlan(object):
+    """
+    Execution plan of Puppet manifests. Plan consists of stages of manifests
+    applied in parallel, amount of data transferred to each host and
+    expected count of SSH sessions and duration.
+    """
+    # SSH sessions used for each host: dependency installation, manifests
+    # transfer, modules transfer and kernel check during finalization
+    HOST_SESSIONS = 4
+    # SSH sessions used for each manifest: starting puppet apply and
+    # retrieving the log file (status polling can add more)
+    MANIFEST_SESSIONS = 2
+
+    def __init__(self, hosts, files, timings=None):
+        self.hosts = sorted(hosts)
+        self.stages = group_stages(files)
+        self.timings = timings or {}
+        self.transfer = dict([(host, 0) for host in self.hosts])
+        self.resources = dict([(host, 0) for host in self.hosts])
+
+    def add_transfer(self, host, size, resource=False):
+        self.transfer[host] = self.transfer.get(host, 0) + size
+        if resource:
+            self.resources[host] = self.resources.get(host, 0) + 1
+
+    def host_manifests(self, host, manifests):
+        return [i for i in manifests if i.startswith('%s_' % host)]
+
+    def manifest_count(self, host):
+        count = 0
+        for marker, manifests in self.stages:
+            count += len(self.host_manifests(host, manifests))
+        return count
+
+    def ssh_sessions(self, host):
+        return (self.HOST_SESSIONS + self.resources.get(host, 0) +
+                self.MANIFEST_SESSIONS * self.manifest_count(host))
+
+    def stage_duration(self, manifests):
+        """
+        Returns tuple (duration, unknown) where duration is expected
+        duration of given stage and unknown is count of manifests without
+        timing history. Manifests on the same host are serialized.
+        """
+        duration, unknown = 0, 0
+        for host in self.hosts:
+            host_duration = 0
+            for manifest in self.host_manifests(host, manifests):
+                key = manifest_key(host, manifest)
+                estimate = estimate_duration(self.timings, key)
+                if estimate is None:
+                    unknown += 1
+                    continue
+                host_duration += estimate
+            duration = max(duration, host_duration)
+        return duration, unknown
+
+    def duration(self):
+        total, unknown = 0, 0
+        for marker, manifests in self.stages:
+            stage_total, stage_unknown = self.stage_duration(manifests)
+            total += stage_total
+            unknown += stage_unknown
+        return total, unknown
+
+    def render(self):
+        lines = ['Deployment plan', '=' * len('Deployment plan')]
+        for index, (marker, manifests) in enumerate(self.stages):
+            duration, unknown = self.stage_duration(manifests)
+            lines.append('Stage %d (marker: %s, estimated duration: %s)' %
+                         (index + 1, marker or '-',
+                          format_duration(duration)))
+            for host in self.hosts:
+                hostman = self.host_manifests(host, manifests)
+                if not hostman:
+                    continue
+                lines.append('    %s: %s' % (host, ', '.join(hostman)))
+
+        lines.append('')
+        lines.append('Hosts')
+        for host in self.hosts:
+            lines.append('    %s: %d manifests, %s to transfer, '
+                         '%d SSH sessions at least' %
+                         (host, self.manifest_count(host),
+                          format_size(self.transfer.get(host, 0)),
+                          self.ssh_sessions(host)))
+
+        duration, unknown = self.duration()
+        lines.append('')
+        summary = 'Estimated duration: %s' % format_duration(duration)
+        if unknown:
+            summary += (' (%d manifest runs without timing history are '
+                        'not included)' % unknown)
+        lines.append(summary)
+        return '\n'.join(lines)
@@ -1,51 +1,123 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import os
-import re
 
+from packstack.installer import basedefs
 from packstack.installer.exceptions import PuppetError
+from packstack.modules.puppetlog import (re_color, re_notice, re_runtime,
+                                         re_warning, re_resource,
+                                         split_branches, literal_core,
+                                         prefilter, CHUNK_SIZE, RuleSet,
+                                         LogSummary, load_rules, rules,
+                                         apply_surrogates,
+                                         iter_interesting_lines,
+                                         analyze_line, analyze)
 
 
 # TODO: Fill logger name when logging system will be refactored
 logger = logging.getLogger()
 
-re_color = re.compile('\x1b.*?\d\dm')
-re_error = re.compile(
-    'err:|Syntax error at|^Duplicate definition:|^Invalid tag|'
-    '^No matching value for selector param|^Parameter name failed:|Error:|'
-    '^Invalid parameter|^Duplicate declaration:|^Could not find resource|'
-    '^Could not parse for|^/usr/bin/puppet:\d+: .+|.+\(LoadError\)|'
-    '^\/usr\/bin\/env\: jruby\: No such file or directory'
-)
-re_ignore = re.compile(
-    # Puppet preloads a provider using the mysql command before it is installed
-    'Command mysql is missing|'
-    # Puppet preloads a database_grant provider which fails if /root/.my.cnf
-    # is missing, this is ok because it will be retried later if needed
-    'Could not prefetch database_grant provider.*?\\.my\\.cnf|'
-    # Swift Puppet module tries to install swift-plugin-s3, there is no such
-    # package on RHEL, fixed in the upstream puppet module
-    'yum.*?install swift-plugin-s3'
-)
-re_notice = re.compile(r"notice: .*Notify\[packstack_info\]"
-                         "\/message: defined \'message\' as "
-                         "\'(?P<message>.*)\'")
-
-surrogates = [
-    # Value in /etc/sysctl.conf cannot be changed
-    ('Sysctl::Value\[.*\]\/Sysctl\[(?P<arg1>.*)\].*Field \'val\' is required',
-        'Cannot change value of %(arg1)s in /etc/sysctl.conf'),
-    # Package is not found in yum repos
-    ('Package\[.*\]\/ensure.*yum.*install (?P<arg1>.*)\'.*Nothing to do',
-        'Package %(arg1)s has not been found in enabled Yum repos.'),
-    ('Execution of \'.*yum.*install (?P<arg1>.*)\'.*Nothing to do',
-        'Package %(arg1)s has not been found in enabled Yum repos.'),
-    # Packstack does not cooperate with jruby
-    ('jruby', 'Your Puppet installation uses jruby instead of ruby. Package '
-              'jruby does not cooperate with Packstack well. You will have to '
-              'fix this manually.'),
-]
+RULE_STATS_FILE = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'rule_stats.json')
+
+
+def add_rule(rule_id, category, pattern, message=None, description=None):
+    """
+    Adds rule for Puppet log analysis, plugins use this to ignore errors
+    known to be harmless for their manifests (category 'ignore') or to
+    replace errors with more descriptive messages (category 'surrogate').
+    """
+    rules.add(rule_id, category, pattern, message=message,
+              description=description)
+
+
+def load_rule_stats(path=None):
+    """
+    Returns dictionary of rule hit counters recorded during previous
+    Packstack runs.
+    """
+    path = path or RULE_STATS_FILE
+    try:
+        with open(path) as statsfile:
+            return json.load(statsfile)
+    except (IOError, ValueError):
+        logger.debug('Unable to load Puppet rule statistics from %s' % path)
+        return {}
+
+
+def save_rule_stats(stats, path=None):
+    path = path or RULE_STATS_FILE
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'w') as statsfile:
+        json.dump(stats, statsfile)
+
+
+def record_hits(stats, hits):
+    """
+    Adds rule hits of single Puppet run to statistics. For each rule count
+    of matched lines and count of Puppet runs with any match are kept.
+    """
+    for rule_id, count in hits.iteritems():
+        counters = stats.setdefault(rule_id, {'hits': 0, 'runs': 0})
+        counters['hits'] += count
+        counters['runs'] += 1
+
+
+def frequent_rules(stats, category='ignore', limit=5, ruleset=None):
+    """
+    Returns list of (rule id, hits, runs) tuples of rules of given category
+    which fired most often, eg. ignore rules hiding noisy errors.
+    """
+    ruleset = ruleset or rules
+    ids = set([i['id'] for i in ruleset.rules if i['category'] == category])
+    result = [(rule_id, counters['hits'], counters['runs'])
+              for rule_id, counters in stats.iteritems() if rule_id in ids]
+    result.sort(key=lambda x: (x[1], x[2]), reverse=True)
+    return result[:limit]
+
+
+class PuppetLogResult(LogSummary):
+    """
+    Structured result of Puppet log file analysis.
+    """
+    def validate(self):
+        """
+        Raises PuppetError if there was any error during Puppet run.
+        """
+        if not self.errors:
+            return
+        message = ('Error appeared during Puppet run: %s\n%s\n'
+                   'You will find full trace in log %s' %
+                   (self.manifest, self.errors[0], self.logpath))
+        raise PuppetError(message)
+
+
+def analyze_logfile(logpath):
+    """
+    Reads given Puppet log file once and returns PuppetLogResult with
+    errors, warnings, packstack_info notices, changed resources counts
+    and duration of the run.
+    """
+    return analyze(PuppetLogResult(logpath))
+
+
+def load_summary(summarypath, logpath):
+    """
+    Returns PuppetLogResult of given log file loaded from JSON summary
+    created by puppetlog module on the host where Puppet was run. Returns
+    None if the summary is not usable (eg. analysis failed on the host).
+    """
+    result = PuppetLogResult(logpath)
+    try:
+        with open(summarypath) as summary:
+            data = json.load(summary)
+    except (IOError, ValueError):
+        logger.debug('Unable to load Puppet log summary %s' % summarypath)
+        return None
+    if not isinstance(data, dict) or not result.update(data):
+        return None
+    return result
 
 
 def validate_logfile(logpath):
@@ -53,41 +125,7 @@ def validate_logfile(logpath):
     Check given Puppet log file for errors and raise PuppetError if there is
     any error
     """
-    manifestpath = os.path.splitext(logpath)[0]
-    manifestfile = os.path.basename(manifestpath)
-    with open(logpath) as logfile:
-        for line in logfile:
-            line = line.strip()
-
-            if re_error.search(line) is None:
-                continue
-
-            error = re_color.sub('', line)  # remove colors
-            if re_ignore.search(line):
-                msg = ('Ignoring expected error during Puppet run %s: %s' %
-                       (manifestfile, error))
-                logger.debug(msg)
-                continue
-
-            for regex, surrogate in surrogates:
-                match = re.search(regex, error)
-                if match is None:
-                    continue
-
-                args = {}
-                num = 1
-                while True:
-                    try:
-                        args['arg%d' % num] = match.group(num)
-                        num += 1
-                    except IndexError:
-                        break
-                error = surrogate % args
-
-            message = ('Error appeared during Puppet run: %s\n%s\n'
-                       'You will find full trace in log %s' %
-                       (manifestfile, error, logpath))
-            raise PuppetError(message)
+    analyze_logfile(logpath).validate()
 
 
 def scan_logfile(logpath):
@@ -95,10 +133,12 @@ def scan_logfile(logpath):
     Returns list of packstack_info/packstack_warn notices parsed from
     given puppet log file.
     """
-    output = []
-    with open(logpath) as logfile:
-        for line in logfile:
-            match = re_notice.search(line)
-            if match:
-                output.append(match.group('message'))
-    return output
+    return analyze_logfile(logpath).notices
+
+
+def scan_runtime(logpath):
+    """
+    Returns duration of the catalog run in seconds parsed from given puppet
+    log file or None if the run did not finish.
+    """
+    return analyze_logfile(logpath).runtime
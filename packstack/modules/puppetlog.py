@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+
+"""
+Puppet log analyzer. This module depends on standard library only, because
+it is copied to hosts together with manifests and executed there after
+each Puppet run, so only compact JSON summary of the log has to be
+transferred back during installation:
+
+    python puppetlog.py <puppet log file> [<rules file>] > <summary file>
+
+Errors are recognized by rules loaded from JSON rules file (puppet_rules.json
+in this directory by default). Every rule has unique id, category (error,
+ignore or surrogate) and regular expression pattern, surrogate rules
+contain message replacing matched error too.
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+
+
+# TODO: Fill logger name when logging system will be refactored
+logger = logging.getLogger()
+
+re_color = re.compile('\x1b.*?\d\dm')
+re_notice = re.compile(r"notice: .*Notify\[packstack_info\]"
+                         "\/message: defined \'message\' as "
+                         "\'(?P<message>.*)\'")
+re_runtime = re.compile(r'Finished catalog run in (?P<seconds>\d+(\.\d+)?) '
+                        'seconds')
+re_warning = re.compile(r'^[Ww]arning: (?P<message>.*)')
+re_resource = re.compile(r'^[Nn]otice: /Stage\[[^\]]*\]/(.*/)?'
+                         r'(?P<type>[A-Z][\w:]*)\[[^\]]*\]/\w+: ')
+
+
+def split_branches(pattern):
+    """
+    Splits regular expression pattern to its top level branches.
+    """
+    branches, current, depth, escaped = [], [], 0, False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == '|' and not depth:
+            branches.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    branches.append(''.join(current))
+    return branches
+
+
+def literal_core(branch):
+    """
+    Returns the first literal string which has to be contained in every
+    string matched by given branch or None if there is no such literal.
+    Anchors, wildcards and character classes preceding the literal are
+    skipped.
+    """
+    re_skip = re.compile(r'^(\^|\.[+*?]?|\[[^\]]*\][+*?]?)')
+    match = re_skip.match(branch)
+    while match and match.end():
+        branch = branch[match.end():]
+        match = re_skip.match(branch)
+
+    literal, index = [], 0
+    while index < len(branch):
+        char = branch[index]
+        if char == '\\' and index + 1 < len(branch):
+            if branch[index + 1].isalnum():
+                break
+            char = branch[index + 1]
+            index += 1
+        elif char in '.^$*+?{}[]()|':
+            if char in '*?{' and literal:
+                # quantifier makes previous character optional
+                literal.pop()
+            break
+        literal.append(char)
+        index += 1
+    return literal and ''.join(literal) or None
+
+
+def prefilter(pattern):
+    """
+    Returns fast expression usable for searching whole log file. It matches
+    superset of lines matched by given pattern: each branch is replaced
+    by its literal core, because anchors and leading wildcards or character
+    classes make the search try every branch on every position.
+    """
+    branches = []
+    for branch in split_branches(pattern):
+        literal = literal_core(branch)
+        branches.append(literal is None and branch or re.escape(literal))
+    return '|'.join(branches)
+
+
+def strip_names(pattern):
+    """
+    Changes named groups of given pattern to unnamed ones, so patterns of
+    several rules can be joined to single expression.
+    """
+    return re.sub(r'\(\?P<\w+>', '(', pattern)
+
+
+RULE_CATEGORIES = ('error', 'ignore', 'surrogate')
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'puppet_rules.json')
+
+
+class RuleSet(object):
+    """
+    Rules classifying Puppet log lines. Rules of each category are compiled
+    to single prefilter expression, so lines not matching any rule are
+    rejected by one search regardless of the count of rules. Only lines
+    passing the prefilter are checked by rules of the category one by one.
+    """
+    def __init__(self, rules=None):
+        self.rules = []
+        self._compiled = None
+        for rule in rules or []:
+            self.add(rule['id'], rule['category'], rule['pattern'],
+                     message=rule.get('message'),
+                     description=rule.get('description'))
+
+    def add(self, rule_id, category, pattern, message=None,
+            description=None):
+        """
+        Adds rule to the set, rule with the same id is replaced.
+        """
+        if category not in RULE_CATEGORIES:
+            raise ValueError('Unknown category %s of rule %s' %
+                             (category, rule_id))
+        if category == 'surrogate' and message is None:
+            raise ValueError('Surrogate rule %s has no message' % rule_id)
+        rule = {'id': rule_id, 'category': category, 'pattern': pattern}
+        if message is not None:
+            rule['message'] = message
+        if description is not None:
+            rule['description'] = description
+        self.rules = [i for i in self.rules if i['id'] != rule_id]
+        self.rules.append(rule)
+        self._compiled = None
+
+    def _compile(self):
+        if self._compiled is not None:
+            return self._compiled
+        compiled = {}
+        for category in RULE_CATEGORIES:
+            rules = [i for i in self.rules if i['category'] == category]
+            gate = '|'.join([strip_names(prefilter(i['pattern']))
+                             for i in rules])
+            checks = [(i['id'], re.compile(i['pattern']), i.get('message'))
+                      for i in rules]
+            compiled[category] = (gate and re.compile(gate) or None, checks)
+        interesting = '|'.join([i for i in (compiled['error'][0] and
+                                            compiled['error'][0].pattern,
+                                            '[Nn]otice: ', '[Ww]arning: ')
+                                if i])
+        # lines which are not matched by this expression are skipped
+        # by analyzer, notices, resource changes and catalog run duration
+        # are logged as notices; whole log file is searched at once, so
+        # anchors kept by prefilter have to match at every line
+        compiled['interesting'] = re.compile(prefilter(interesting),
+                                             re.MULTILINE)
+        self._compiled = compiled
+        return compiled
+
+    @property
+    def interesting(self):
+        return self._compile()['interesting']
+
+    def candidates(self, category, line):
+        """
+        Returns list of (rule id, compiled pattern, message) of rules
+        of given category which can match given line.
+        """
+        gate, checks = self._compile()[category]
+        if gate is None or not gate.search(line):
+            return []
+        return checks
+
+    def search(self, category, line):
+        """
+        Yields (rule id, match, message) for every rule of given category
+        matching given line.
+        """
+        for rule_id, regex, message in self.candidates(category, line):
+            match = regex.search(line)
+            if match:
+                yield rule_id, match, message
+
+    def first(self, category, line):
+        """
+        Returns id of the first rule of given category matching given line
+        or None.
+        """
+        for rule_id, match, message in self.search(category, line):
+            return rule_id
+        return None
+
+    def save(self, path):
+        with open(path, 'w') as rulesfile:
+            json.dump(self.rules, rulesfile, indent=4)
+
+
+def load_rules(path=None):
+    """
+    Returns RuleSet loaded from given JSON file, the default rules file
+    is used if no file is given. Missing file is an error, because empty
+    rules would report every Puppet run as successful.
+    """
+    path = path or DEFAULT_RULES_FILE
+    with open(path) as rulesfile:
+        return RuleSet(json.load(rulesfile))
+
+
+# rules used when no other RuleSet is given to analyzer, the analyzer
+# executed on hosts loads rules file given in arguments instead (see main)
+if __name__ == '__main__':
+    rules = None
+else:
+    rules = load_rules()
+
+# size of log file part searched at once
+CHUNK_SIZE = 16 * 1024 * 1024
+# attributes of LogSummary transferred in JSON summary
+SUMMARY_KEYS = ('manifest', 'errors', 'ignored', 'warnings', 'notices',
+                'resources', 'runtime', 'hits')
+
+
+class LogSummary(object):
+    """
+    Structured result of Puppet log file analysis.
+    """
+    def __init__(self, logpath):
+        self.logpath = logpath
+        manifestpath = os.path.splitext(logpath)[0]
+        self.manifest = os.path.basename(manifestpath)
+        # error messages with applied surrogates
+        self.errors = []
+        # expected errors which are ignored
+        self.ignored = []
+        self.warnings = []
+        # packstack_info notices
+        self.notices = []
+        # count of changed resources by resource type
+        self.resources = {}
+        # duration of the catalog run in seconds
+        self.runtime = None
+        # count of matched lines by rule id
+        self.hits = {}
+
+    def hit(self, rule_id):
+        self.hits[rule_id] = self.hits.get(rule_id, 0) + 1
+
+    def to_dict(self):
+        data = {'status': self.errors and 'failed' or 'ok'}
+        for key in SUMMARY_KEYS:
+            data[key] = getattr(self, key)
+        return data
+
+    def update(self, data):
+        """
+        Loads results from dictionary created by to_dict. Returns False if
+        given dictionary does not contain results of finished analysis.
+        """
+        if data.get('status') not in ('ok', 'failed'):
+            return False
+        for key in SUMMARY_KEYS:
+            if key in data:
+                setattr(self, key, data[key])
+        return True
+
+
+def apply_surrogates(error, ruleset=None, result=None):
+    """
+    Replaces known Puppet errors with more descriptive messages. Hits of
+    surrogate rules are counted in given LogSummary.
+    """
+    ruleset = ruleset or rules
+    for rule_id, regex, surrogate in ruleset.candidates('surrogate', error):
+        match = regex.search(error)
+        if match is None:
+            continue
+        if result is not None:
+            result.hit(rule_id)
+
+        args = {}
+        for num, value in enumerate(match.groups()):
+            args['arg%d' % (num + 1)] = value
+        error = surrogate % args
+    return error
+
+
+def iter_interesting_lines(logpath, chunk_size=CHUNK_SIZE, ruleset=None):
+    """
+    Yields lines of given log file which may be interesting for rules of
+    given RuleSet (default rules are used if not given). Log file is
+    memory-mapped and searched by chunks, so only matching lines are ever
+    copied out of the file and memory usage is bounded even for huge logs
+    of debug runs.
+    """
+    interesting = (ruleset or rules).interesting
+    with open(logpath, 'rb') as logfile:
+        size = os.fstat(logfile.fileno()).st_size
+        if not size:
+            return
+        buf = mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            while pos < size:
+                # chunks always end at the end of line
+                end = buf.find('\n', min(pos + chunk_size, size) - 1)
+                end = end < 0 and size or end + 1
+                line_end = pos
+                for match in interesting.finditer(buf, pos, end):
+                    if match.start() < line_end:
+                        # line has been already processed
+                        continue
+                    line_start = buf.rfind('\n', pos, match.start()) + 1
+                    line_end = buf.find('\n', match.end(), end)
+                    line_end = line_end < 0 and end or line_end + 1
+                    yield buf[max(line_start, pos):line_end]
+                pos = end
+        finally:
+            buf.close()
+
+
+def analyze_line(result, line, ruleset=None):
+    """
+    Updates given LogSummary with information from given log line.
+    """
+    ruleset = ruleset or rules
+    rule_id = ruleset.first('error', line)
+    if rule_id is not None:
+        result.hit(rule_id)
+        error = re_color.sub('', line)  # remove colors
+        rule_id = ruleset.first('ignore', line)
+        if rule_id is not None:
+            result.hit(rule_id)
+            msg = ('Ignoring expected error during Puppet run %s: %s' %
+                   (result.manifest, error))
+            logger.debug(msg)
+            result.ignored.append(error)
+        else:
+            result.errors.append(apply_surrogates(error, ruleset, result))
+        return
+
+    match = re_notice.search(line)
+    if match:
+        result.notices.append(match.group('message'))
+        return
+
+    match = re_resource.search(line)
+    if match:
+        rtype = match.group('type')
+        result.resources[rtype] = result.resources.get(rtype, 0) + 1
+        return
+
+    match = re_warning.search(line)
+    if match:
+        result.warnings.append(re_color.sub('', match.group('message')))
+        return
+
+    match = re_runtime.search(line)
+    if match:
+        result.runtime = float(match.group('seconds'))
+
+
+def analyze(result, ruleset=None):
+    """
+    Reads log file of given LogSummary once and fills it with errors,
+    warnings, packstack_info notices, changed resources counts, rule hits
+    and duration of the run.
+    """
+    ruleset = ruleset or rules
+    for line in iter_interesting_lines(result.logpath, ruleset=ruleset):
+        analyze_line(result, line.strip(), ruleset)
+    return result
+
+
+def main(argv):
+    """
+    Prints JSON summary of Puppet log file given as the first argument,
+    rules are loaded from file given as the second argument.
+    """
+    if len(argv) not in (2, 3):
+        sys.stderr.write('Usage: %s <puppet log file> [<rules file>]\n' %
+                         argv[0])
+        return 1
+    ruleset = load_rules(argv[2:] and argv[2] or None)
+    json.dump(analyze(LogSummary(argv[1]), ruleset).to_dict(), sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+
+from packstack.installer import basedefs
+
+
+# TODO: Fill logger name when logging system will be refactored
+logger = logging.getLogger()
+
+# configuration and applied manifests of the last run
+SNAPSHOT_FILE = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'snapshot.json')
+
+
+def _load_file(path):
+    try:
+        with open(path) as snapfile:
+            data = json.load(snapfile)
+    except (IOError, ValueError):
+        logger.debug('Unable to load snapshot of previous run from %s' % path)
+        data = {}
+    if not isinstance(data.get('deployments'), dict):
+        # snapshots of older versions were not split by deployment
+        data = {'deployments': {}}
+    return data
+
+
+def load_snapshot(path=None, deployment=None):
+    """
+    Returns snapshot saved by previous Packstack run of given deployment
+    (path of answer file), the snapshot contains processed parameter values
+    ('conf') and hashes, used CONF keys, hash of Puppet modules and host
+    identity of successfully applied manifests ('manifests').
+    """
+    path = path or SNAPSHOT_FILE
+    data = _load_file(path)
+    snapshot = data['deployments'].get(deployment or '', {})
+    snapshot.setdefault('conf', {})
+    snapshot.setdefault('manifests', {})
+    return snapshot
+
+
+def save_snapshot(snapshot, path=None, deployment=None):
+    """
+    Saves snapshot of given deployment, snapshots of other deployments
+    are kept.
+    """
+    path = path or SNAPSHOT_FILE
+    data = _load_file(path)
+    data['deployments'][deployment or ''] = snapshot
+    # snapshot contains passwords
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'w') as snapfile:
+        json.dump(data, snapfile)
+
+
+def file_hash(path):
+    with open(path, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def diff_conf(old, new):
+    """
+    Returns set of keys which were added, removed or changed between given
+    configuration dictionaries.
+    """
+    changed = set()
+    for key in set(old) | set(new):
+        if key not in old or key not in new or old[key] != new[key]:
+            changed.add(key)
+    return changed
+
+
+def affected_manifests(snapshot, conf, manifests, modules=None, hosts=None):
+    """
+    Returns dictionary of manifests which have to be applied with reasons.
+    Given manifests is dictionary of (hash, keys) tuples by manifest name,
+    where keys are CONF keys used by the manifest. Manifest has to be
+    applied when it was not applied successfully by any previous run, when
+    it was applied to other host (given hosts is dictionary of host
+    identities by manifest name), when it was applied with Puppet modules
+    of other hash than given modules, when any CONF key used by it changed
+    since the last run or when its content differs, eg. because of values
+    computed from changed keys.
+    """
+    hosts = hosts or {}
+    changed = diff_conf(snapshot['conf'], conf)
+    result = {}
+    for name, (digest, keys) in manifests.iteritems():
+        previous = snapshot['manifests'].get(name)
+        if previous is None:
+            result[name] = 'not applied yet'
+            continue
+        if previous.get('host') != hosts.get(name):
+            result[name] = 'host changed'
+            continue
+        if previous.get('modules') != modules:
+            result[name] = 'Puppet modules changed'
+            continue
+        used = changed & set(keys)
+        if used:
+            result[name] = 'changed %s' % ', '.join(sorted(used))
+        elif previous['hash'] != digest:
+            result[name] = 'content changed'
+    return result
+
+
+def update_snapshot(snapshot, conf, manifests, statuses, modules=None,
+                    hosts=None):
+    """
+    Records results of current run to snapshot. Manifests applied
+    successfully are stored together with given hash of Puppet modules
+    and host identity, failed ones are forgotten so they are applied
+    by next run again. Configuration is stored only if all manifests were
+    applied successfully or skipped.
+    """
+    hosts = hosts or {}
+    complete = True
+    for name, (digest, keys) in manifests.iteritems():
+        status = statuses.get(name)
+        if status == 'ok':
+            snapshot['manifests'][name] = {'hash': digest,
+                                           'keys': sorted(keys),
+                                           'modules': modules,
+                                           'host': hosts.get(name)}
+            continue
+        if status == 'failed':
+            snapshot['manifests'].pop(name, None)
+        if status != 'skipped':
+            complete = False
+    if complete:
+        snapshot['conf'] = conf
+    return snapshot
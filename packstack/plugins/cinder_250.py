@@ -236,6 +236,8 @@ def initSequences(controller):
     controller.addSequence("Installing OpenStack Cinder", [], [], cinder_steps)
 
 def install_cinder_deps(config):
+    if config.get("PLAN"):
+        return
     server = utils.ScriptRunner(config['CONFIG_CINDER_HOST'])
     pkgs = []
     if config['CONFIG_CINDER_BACKEND'] == 'lvm':
@@ -245,6 +247,8 @@ def install_cinder_deps(config):
     server.execute()
 
 def check_cinder_vg(config):
+    if config.get("PLAN"):
+        return
     cinders_volume = 'cinder-volumes'
 
     # Do we have a cinder-volumes vg?
@@ -465,12 +465,13 @@ def createcomputemanifest(config):
             if host not in network_hosts:
                 nova_config_options.addOption("DEFAULT/flat_interface",
                                         config['CONFIG_NOVA_COMPUTE_PRIVIF'])
-            check_ifcfg(host, config['CONFIG_NOVA_COMPUTE_PRIVIF'])
-            try:
-                bring_up_ifcfg(host, config['CONFIG_NOVA_COMPUTE_PRIVIF'])
-            except ScriptRuntimeError as ex:
-                # just warn user to do it by himself
-                controller.MESSAGES.append(str(ex))
+            if not config.get("PLAN"):
+                check_ifcfg(host, config['CONFIG_NOVA_COMPUTE_PRIVIF'])
+                try:
+                    bring_up_ifcfg(host, config['CONFIG_NOVA_COMPUTE_PRIVIF'])
+                except ScriptRuntimeError as ex:
+                    # just warn user to do it by himself
+                    controller.MESSAGES.append(str(ex))
 
         if config['CONFIG_CEILOMETER_INSTALL'] == 'y':
             manifestdata += getManifestTemplate("nova_ceilometer.pp")
@@ -506,6 +507,8 @@ def createnetworkmanifest(config):
     config['CONFIG_NOVA_NETWORK_MULTIHOST'] = multihost and 'true' or 'false'
     for host in network_hosts:
         for i in ('CONFIG_NOVA_NETWORK_PRIVIF', 'CONFIG_NOVA_NETWORK_PUBIF'):
+            if config.get("PLAN"):
+                continue
             check_ifcfg(host, config[i])
             try:
                 bring_up_ifcfg(host, config[i])
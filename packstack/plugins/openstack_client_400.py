@@ -63,10 +63,14 @@ def createmanifest(config):
     client_host = config['CONFIG_OSCLIENT_HOST'].strip()
     manifestfile = "%s_osclient.pp" % client_host
 
-    server = utils.ScriptRunner(client_host)
-    server.append('echo $HOME')
-    rc, root_home = server.execute()
-    root_home = root_home.strip()
+    if config.get("PLAN"):
+        # manifests are applied as root
+        root_home = '/root'
+    else:
+        server = utils.ScriptRunner(client_host)
+        server.append('echo $HOME')
+        rc, root_home = server.execute()
+        root_home = root_home.strip()
 
     homedir = os.path.expanduser('~')
     config['HOME_DIR'] = homedir
@@ -320,6 +320,8 @@ def initSequences(controller):
 
 
 def install_keys(config):
+    if config.get("PLAN"):
+        return
     with open(config["CONFIG_SSH_KEY"]) as fp:
         sshkeydata = fp.read().strip()
     for hostname in filtered_hosts(config):
@@ -368,6 +370,20 @@ def discover(config):
             details[host]['os'] = opsys
             details[host]['release'] = match.group('release')
 
+        # identity of host installation, host keys are regenerated
+        # by reinstallation on hosts without machine-id
+        server.clear()
+        server.append('cat /etc/machine-id 2>/dev/null || '
+                      'cat /var/lib/dbus/machine-id 2>/dev/null || '
+                      'sha1sum /etc/ssh/ssh_host_rsa_key.pub | cut -d" " -f1')
+        try:
+            rc, out = server.execute()
+            details[host]['machine_id'] = out.strip() or None
+        except exceptions.ScriptRuntimeError:
+            details[host]['machine_id'] = None
+
+        if config.get("PLAN"):
+            continue
         # Create the packstack tmp directory
         server.clear()
         server.append("mkdir -p %s" % basedefs.PACKSTACK_VAR_DIR)
@@ -7,15 +7,39 @@ import sys
 import logging
 import os
 import platform
+import shutil
+import socket
+import threading
 import time
 
 from packstack.installer import utils
 from packstack.installer import basedefs, output_messages
-from packstack.installer.exceptions import ScriptRuntimeError, PuppetError
+from packstack.installer.exceptions import (ScriptRuntimeError, PuppetError,
+                                            NetworkError)
+from packstack.installer.core.drones import (ResourceBundle, TRANSFER_CODECS,
+                                             bundle_digest)
 
+from packstack.modules.archive import (RunArchive, prune_archives,
+                                       prune_rundirs)
+from packstack.modules.coalesce import CombinedManifest, coalesce_groups
 from packstack.modules.common import filtered_hosts
+from packstack.modules.distribution import (BundleServer, local_address,
+                                            relay_tree, RELAY_DIR,
+                                            RELAY_SERVER, DEFAULT_CODEC,
+                                            choose_codec,
+                                            compression_profile,
+                                            measure_throughput)
 from packstack.modules.ospluginutils import manifestfiles
-from packstack.modules.puppet import scan_logfile, validate_logfile
+from packstack.modules.snapshot import (load_snapshot, save_snapshot,
+                                        file_hash, affected_manifests,
+                                        update_snapshot)
+from packstack.modules.plan import (DeploymentPlan, load_timings,
+                                    manifest_key, path_size, record_timing,
+                                    save_timings, format_size)
+from packstack.modules import puppetlog
+from packstack.modules.puppet import (analyze_logfile, load_summary, rules,
+                                      load_rule_stats, save_rule_stats,
+                                      record_hits, frequent_rules)
 
 # Controller object will be initialized from main flow
 controller = None
@@ -28,6 +52,47 @@ logging.debug("plugin %s loaded", __name__)
 
 PUPPET_DIR = os.environ.get('PACKSTACK_PUPPETDIR', '/usr/share/openstack-puppet/')
 MODULE_DIR = os.path.join(PUPPET_DIR, 'modules')
+PUPPET_MODULES = ('apache', 'ceilometer', 'certmonger', 'cinder', 'concat',
+                  'firewall', 'glance', 'heat', 'horizon', 'inifile',
+                  'keystone', 'memcached', 'mongodb', 'mysql', 'neutron',
+                  'nova', 'nssdb', 'openstack', 'packstack', 'qpid', 'rsync',
+                  'ssh', 'stdlib', 'swift', 'sysctl', 'tempest', 'vcsrepo',
+                  'vlan', 'vswitch', 'xinetd')
+
+# log analyzer executed on hosts after each Puppet run
+LOG_ANALYZER = '%s.py' % os.path.splitext(puppetlog.__file__)[0]
+# Puppet modules cached on hosts across runs by hash, only MODULE_CACHE_KEEP
+# most recently used modules unused for less than MODULE_CACHE_DAYS are kept
+MODULE_CACHE_DIR = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'module_cache')
+MODULE_CACHE_KEEP = 3
+MODULE_CACHE_DAYS = 30
+# rules used by log analyzer, written to manifest directory
+RULES_FILE = 'puppet_rules.json'
+
+SSH_OPTS = '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
+# delimiter of manifests sent to hosts in here-documents
+MANIFEST_EOF = 'PACKSTACK_MANIFEST_EOF'
+
+# durations of manifest runs loaded from and saved to plan.TIMINGS_FILE
+timings = {}
+# results of manifest runs ('ok' or 'failed') by manifest name
+statuses = {}
+# hit counters of log analysis rules loaded from and saved to
+# puppet.RULE_STATS_FILE
+rule_stats = {}
+# (hash, used CONF keys) of generated manifests by manifest name
+manifest_info = {}
+# manifests which will be applied with reasons, see selectManifests
+selected = {}
+# (codec, bytes, seconds) of module and manifest transfers by host
+transfers = {}
+# hosts which had Puppet modules of this run cached already
+module_cache_hits = set()
+# hash of Puppet modules of this run, see modulesDigest
+modules_digest = {}
+# manifests merged from manifests of the same host and stage by name,
+# see coalesceStage
+combined = {}
 
 
 def initConfig(controllerObject):
@@ -73,52 +138,515 @@ def runCleanup(config):
 
 
 def installdeps(config):
+    if config.get("PLAN"):
+        return
     for hostname in filtered_hosts(config):
         server = utils.ScriptRunner(hostname)
-        for package in ("puppet", "openssh-clients", "tar", "nc"):
+        packages = ["puppet", "openssh-clients", "tar", "nc"]
+        if config.get("PULL_MODULES"):
+            packages.append("curl")
+        for package in packages:
             server.append("rpm -q --whatprovides %s || yum install -y %s" % (package, package))
         server.execute()
 
 
 def copyPuppetModules(config):
-    os_modules = ' '.join(('apache', 'ceilometer', 'certmonger', 'cinder',
-                           'concat', 'firewall', 'glance', 'heat', 'horizon',
-                           'inifile', 'keystone', 'memcached', 'mongodb',
-                           'mysql', 'neutron', 'nova', 'nssdb', 'openstack',
-                           'packstack', 'qpid', 'rsync', 'ssh', 'stdlib',
-                           'swift', 'sysctl', 'tempest', 'vcsrepo', 'vlan',
-                           'vswitch', 'xinetd'))
-
-        # write puppet manifest to disk
+    os_modules = ' '.join(PUPPET_MODULES)
+
+    # write puppet manifest to disk
     manifestfiles.writeManifests()
+    if config.get("PLAN"):
+        return
+    # rules including those added by plugins are used by analyzer on hosts
+    rules.save(os.path.join(basedefs.PUPPET_MANIFEST_DIR, RULES_FILE))
+    transfers.clear()
+    module_cache_hits.clear()
+    try:
+        if config.get("PULL_MODULES"):
+            pullPuppetModules(config)
+            return
 
-    server = utils.ScriptRunner()
-    for hostname in filtered_hosts(config):
-        host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
-        # copy Packstack manifests
-        server.append("cd %s/puppet" % basedefs.DIR_PROJECT_DIR)
-        server.append("cd %s" % basedefs.PUPPET_MANIFEST_DIR)
-        server.append("tar --dereference -cpzf - ../manifests | "
-                      "ssh -o StrictHostKeyChecking=no "
-                          "-o UserKnownHostsFile=/dev/null "
-                          "root@%s tar -C %s -xpzf -" % (hostname, host_dir))
-
-        # copy resources
-        for path, localname in controller.resources.get(hostname, []):
-            server.append("scp -o StrictHostKeyChecking=no "
-                "-o UserKnownHostsFile=/dev/null %s root@%s:%s/resources/%s" %
-                (path, hostname, host_dir, localname))
-
-        # copy Puppet modules required by Packstack
-        server.append("cd %s" % MODULE_DIR)
-        server.append("tar --dereference -cpzf - %s | "
-                      "ssh -o StrictHostKeyChecking=no "
-                          "-o UserKnownHostsFile=/dev/null "
-                          "root@%s tar -C %s -xpzf -" %
-                      (os_modules, hostname, os.path.join(host_dir, 'modules')))
+        hosts = filtered_hosts(config)
+        try:
+            modules = modulesBundle()
+        except (IOError, OSError), ex:
+            logging.debug('Unable to hash Puppet modules, module cache is '
+                          'not used: %s' % ex)
+            modules = None
+        digest = modules and modules.digest
+        cached_hosts = digest and checkModuleCaches(hosts, digest) or set()
+        codecs = chooseCodecs(config, hosts, modules, cached_hosts)
+        size = (path_size(basedefs.PUPPET_MANIFEST_DIR) +
+                path_size(LOG_ANALYZER))
+        for hostname in hosts:
+            host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
+            cached = hostname in cached_hosts
+            staging = digest and moduleStaging(host_dir, digest)
+            level = TRANSFER_CODECS[codecs[hostname]]
+            compress = level is not None and '| gzip -%d ' % level or ''
+            extract = level is not None and '-xpzf' or '-xpf'
+            server = utils.ScriptRunner()
+            _pushManifests(server, hostname, host_dir, level)
+
+            # copy Puppet modules required by Packstack, modules are
+            # transferred to module cache on the host unless they are
+            # already cached there
+            modules_dir = staging or os.path.join(host_dir, 'modules')
+            if not cached:
+                server.append("cd %s" % MODULE_DIR)
+                server.append("tar --dereference -cpf - %s %s| "
+                              "ssh -o StrictHostKeyChecking=no "
+                                  "-o UserKnownHostsFile=/dev/null "
+                                  "root@%s 'mkdir -p %s && tar -C %s %s -'" %
+                              (os_modules, compress, hostname, modules_dir,
+                               modules_dir, extract))
+            start = time.time()
+            server.execute()
+            if digest:
+                _linkCachedModules(hostname, host_dir, digest,
+                                   not cached and staging or None)
+            transfers[hostname] = (codecs[hostname],
+                                   size + (not cached and modulesSize() or 0),
+                                   time.time() - start)
+
+            # copy resources
+            _pushResources(config, hostname)
+    finally:
+        reportTransfers()
+        # bundles are not needed after distribution
+        shutil.rmtree(os.path.join(basedefs.VAR_DIR, 'bundles'),
+                      ignore_errors=True)
+
+
+def modulesBundle():
+    """
+    Returns bundle of Puppet modules required by Packstack.
+    """
+    bundle_dir = os.path.join(basedefs.VAR_DIR, 'bundles')
+    if not os.path.isdir(bundle_dir):
+        os.makedirs(bundle_dir, 0700)
+    bundle = ResourceBundle(modulesMembers(), bundle_dir, dereference=True)
+    modules_digest['digest'] = bundle.digest
+    return bundle
+
+
+def modulesMembers():
+    return [(os.path.join(MODULE_DIR, i), i) for i in PUPPET_MODULES]
+
+
+def modulesDigest():
+    """
+    Returns hash of Puppet modules required by Packstack or None if they
+    can't be read. Hash of modules bundle built by this run is reused.
+    """
+    if 'digest' not in modules_digest:
+        try:
+            modules_digest['digest'] = bundle_digest(modulesMembers(),
+                                                     dereference=True)
+        except (IOError, OSError), ex:
+            logging.debug('Unable to hash Puppet modules: %s' % ex)
+            return None
+    return modules_digest['digest']
+
+
+def moduleStaging(host_dir, digest):
+    """
+    Returns directory on host where modules of given hash are transferred
+    before they are moved to module cache.
+    """
+    return '%s.tmp-%s' % (os.path.join(MODULE_CACHE_DIR, digest),
+                          os.path.basename(host_dir))
+
+
+def checkModuleCaches(hosts, digest):
+    """
+    Returns set of given hosts which have modules of given hash cached.
+    """
+    def check(hostname):
+        server = utils.ScriptRunner(hostname)
+        server.append("test -d %s && echo cached || true" %
+                      os.path.join(MODULE_CACHE_DIR, digest))
+        try:
+            rc, out = server.execute()
+        except (ScriptRuntimeError, NetworkError), ex:
+            logging.debug('Unable to check module cache on %s: %s' %
+                          (hostname, ex))
+            return
+        if out.strip() == 'cached':
+            logging.debug('Puppet modules %s are cached on %s' %
+                          (digest, hostname))
+            module_cache_hits.add(hostname)
+
+    threads = []
+    for hostname in hosts:
+        thread = threading.Thread(target=check, args=(hostname,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return set(module_cache_hits) & set(hosts)
+
+
+def _linkCachedModules(hostname, host_dir, digest, staging=None):
+    """
+    Populates modules directory of given host by hard links to modules
+    cached under given hash. Modules transferred to given staging directory
+    are moved to the cache first. Cache entries beyond MODULE_CACHE_KEEP
+    most recently used ones and entries unused for MODULE_CACHE_DAYS days
+    are removed.
+    """
+    cache_path = os.path.join(MODULE_CACHE_DIR, digest)
+    server = utils.ScriptRunner(hostname)
+    if staging:
+        # another run might have cached the same modules meanwhile
+        server.append("[ -d %s ] || mv %s %s" %
+                      (cache_path, staging, cache_path))
+        server.append("rm -rf %s" % staging)
+    server.append("cp -al %s/. %s/" %
+                  (cache_path, os.path.join(host_dir, 'modules')))
+    server.append("touch %s" % cache_path)
+    server.append("cd %s" % MODULE_CACHE_DIR)
+    server.append("ls -1t | grep -v '\.tmp-' | tail -n +%d | xargs -r rm -rf"
+                  % (MODULE_CACHE_KEEP + 1))
+    server.append("find . -mindepth 1 -maxdepth 1 -mtime +%d "
+                  "-exec rm -rf {} +" % MODULE_CACHE_DAYS)
     server.execute()
 
 
+def modulesSize():
+    return sum([path_size(os.path.join(MODULE_DIR, i))
+                for i in PUPPET_MODULES])
+
+
+def chooseCodecs(config, hosts, bundle, cached=()):
+    """
+    Returns dictionary of transfer codecs by host. Codec given by
+    TRANSFER_CODEC is used for all hosts, unless it is 'auto'. Then codec
+    of each host is chosen by throughput measured to the host and by
+    compression speed of given modules bundle. Only manifests are sent
+    to given hosts with cached modules, so they get DEFAULT_CODEC.
+    """
+    codec = config.get('TRANSFER_CODEC') or 'auto'
+    if codec == 'auto' and bundle is None:
+        codec = DEFAULT_CODEC
+    if codec != 'auto':
+        return dict([(i, codec) for i in hosts])
+    codecs = dict([(i, DEFAULT_CODEC) for i in cached])
+    hosts = [i for i in hosts if i not in codecs]
+    if not hosts:
+        return codecs
+    try:
+        profile = compression_profile(bundle.members, bundle.dereference)
+    except (IOError, OSError), ex:
+        logging.debug('Unable to estimate compression of Puppet modules, '
+                      'using transfer codec %s: %s' % (DEFAULT_CODEC, ex))
+        codecs.update([(i, DEFAULT_CODEC) for i in hosts])
+        return codecs
+    for name, (ratio, speed) in sorted(profile.items()):
+        logging.debug('Transfer codec %s compresses Puppet modules to %d%% '
+                      '%s' % (name, ratio * 100,
+                              speed and 'at %s/s' % format_size(speed) or ''))
+
+    def probe(hostname):
+        throughput = measure_throughput(hostname)
+        codecs[hostname] = choose_codec(profile, throughput)
+        logging.debug('Throughput to %s is %s, using transfer codec %s' %
+                      (hostname, throughput and
+                       '%s/s' % format_size(throughput) or 'unknown',
+                       codecs[hostname]))
+
+    threads = []
+    for hostname in hosts:
+        thread = threading.Thread(target=probe, args=(hostname,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return codecs
+
+
+def reportTransfers():
+    """
+    Adds codecs and effective throughput of module transfers to messages
+    shown at the end of the run.
+    """
+    by_codec = {}
+    for hostname, (codec, size, seconds) in sorted(transfers.items()):
+        logging.debug('Puppet modules and manifests were transferred to %s '
+                      'using codec %s in %.1f seconds' %
+                      (hostname, codec, seconds))
+        totals = by_codec.setdefault(codec, [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += size
+        totals[2] += seconds
+    for codec, (count, size, seconds) in sorted(by_codec.items()):
+        rate = seconds > 0 and '%s/s' % format_size(size / seconds) or 'n/a'
+        controller.MESSAGES.append(output_messages.INFO_TRANSFER_CODEC %
+                                   (count, codec, rate))
+    if module_cache_hits:
+        controller.MESSAGES.append(output_messages.INFO_MODULE_CACHE %
+                                   len(module_cache_hits))
+
+
+def _pushManifests(server, hostname, host_dir, level):
+    """
+    Appends commands streaming Packstack manifests, log analyzer and its
+    rules compressed by given gzip level to given host over SSH to given
+    local ScriptRunner.
+    """
+    compress = level is not None and '| gzip -%d ' % level or ''
+    extract = level is not None and '-xpzf' or '-xpf'
+    server.append("cd %s/puppet" % basedefs.DIR_PROJECT_DIR)
+    server.append("cd %s" % basedefs.PUPPET_MANIFEST_DIR)
+    server.append("tar --dereference -cpf - ../manifests -C %s %s %s| "
+                  "ssh -o StrictHostKeyChecking=no "
+                      "-o UserKnownHostsFile=/dev/null "
+                      "root@%s tar -C %s %s -" %
+                  (os.path.dirname(LOG_ANALYZER),
+                   os.path.basename(LOG_ANALYZER), compress,
+                   hostname, host_dir, extract))
+
+
+def _fetchBundles(config, hostname, bundles):
+    """
+    Fetches given (url, sha1 hash, directory, keep) bundles on given host,
+    verifies them and extracts them to the directories. Bundles are moved
+    to keep directory afterwards unless it is None.
+    """
+    host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
+    server = utils.ScriptRunner(hostname)
+    for url, digest, directory, keep in bundles:
+        bundle = os.path.join(host_dir, os.path.basename(url))
+        server.append("curl -sSf --retry 3 -o %s %s" % (bundle, url))
+        server.append("echo '%s  %s' | sha1sum -c --quiet -" %
+                      (digest, bundle))
+        # bundles of codec 'none' are not compressed, see ResourceBundle
+        extract = bundle.endswith('.tar') and '-xpf' or '-xpzf'
+        server.append("mkdir -p %s" % directory)
+        server.append("tar -C %s %s %s" % (directory, extract, bundle))
+        if keep:
+            server.append("mkdir -p %s" % keep)
+            server.append("mv %s %s" % (bundle, keep))
+        else:
+            server.append("rm -f %s" % bundle)
+    # URLs of bundles served by the deploy host are not public
+    server.execute(mask_list=[i[0] for i in bundles])
+
+
+def _pushResources(config, hostname):
+    host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
+    local_server = utils.ScriptRunner()
+    for path, localname in controller.resources.get(hostname, []):
+        local_server.append("scp %s %s root@%s:%s/resources/%s" %
+                            (SSH_OPTS, path, hostname, host_dir, localname))
+    if local_server.script:
+        local_server.execute()
+
+
+def _startRelay(hostname, relay_dir):
+    """
+    Starts HTTP server serving given directory on given host and returns
+    its port.
+    """
+    server = utils.ScriptRunner(hostname)
+    server.append("cd %s" % relay_dir)
+    server.append("nohup %s > .port 2> /dev/null < /dev/null &" %
+                  RELAY_SERVER)
+    server.append("echo $! > .pid")
+    server.append("for i in $(seq 50); do [ -s .port ] && break; "
+                  "sleep 0.1; done")
+    server.append("cat .port")
+    rc, out = server.execute()
+    return int(out.strip())
+
+
+def _stopRelay(hostname, relay_dir):
+    server = utils.ScriptRunner(hostname)
+    server.append("if [ -f %s/.pid ]; then kill $(cat %s/.pid) || true; fi"
+                  % (relay_dir, relay_dir))
+    server.append("rm -rf %s" % relay_dir)
+    server.execute(can_fail=False)
+
+
+def pullPuppetModules(config):
+    """
+    Serves bundle of Puppet modules by HTTP server started locally, hosts
+    fetch it in parallel and verify its checksum. Manifests contain
+    passwords, so they are pushed to each host over SSH. Bundles are
+    compressed by codec chosen for each host. With RELAY_FANOUT set, only
+    that many hosts fetch modules from the deploy host and each host
+    serves them to that many other hosts, see relay_tree. Hosts which
+    can't fetch modules from their relay fetch them from the deploy host.
+    """
+    # same modules are sent to all hosts, so their bundle is built once
+    # for each codec
+    modules = modulesBundle()
+    hosts = filtered_hosts(config)
+    cached_hosts = checkModuleCaches(hosts, modules.digest)
+    codecs = chooseCodecs(config, hosts, modules, cached_hosts)
+    # server listens only on addresses routed to the hosts
+    addresses = {}
+    for hostname in hosts:
+        try:
+            addresses[hostname] = local_address(hostname)
+        except socket.error, ex:
+            raise NetworkError('Unable to find route to host %s: %s' %
+                               (hostname, ex))
+    httpd = BundleServer(sorted(set(addresses.values())))
+    modules_urls = {}
+    for codec in set([codecs[i] for i in hosts if i not in cached_hosts]):
+        path = modules.path(TRANSFER_CODECS[codec])
+        modules_urls[codec] = (httpd.add(path), file_hash(path))
+
+    modules_size = modulesSize()
+    manifests_size = (path_size(basedefs.PUPPET_MANIFEST_DIR) +
+                      path_size(LOG_ANALYZER))
+
+    fanout = int(config.get('RELAY_FANOUT') or 0)
+    if fanout > 0:
+        waves = relay_tree(sorted(hosts), fanout)
+    else:
+        waves = [[(i, None) for i in hosts]]
+    parents = set([parent for wave in waves for host, parent in wave])
+    # (URL, hash, codec) of modules bundle served by relay host
+    relays = {}
+    failures = {}
+
+    def fetch(hostname, parent):
+        host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
+        # modules are fetched to module cache on the host
+        modules_dir = moduleStaging(host_dir, modules.digest)
+        cached = hostname in cached_hosts
+        relay_dir = None
+        if hostname in parents and not cached:
+            relay_dir = os.path.join(host_dir, RELAY_DIR)
+        codec = codecs[hostname]
+        size = manifests_size
+        start = time.time()
+        try:
+            relay = not cached and relays.get(parent)
+            if relay:
+                url, digest, codec = relay
+                try:
+                    _fetchBundles(config, hostname,
+                                  [(url, digest, modules_dir, relay_dir)])
+                except (ScriptRuntimeError, NetworkError), ex:
+                    logging.warning('Host %s failed to fetch Puppet modules '
+                                    'from relay %s, fetching them directly: '
+                                    '%s' % (hostname, parent, ex))
+                    relay = None
+                    codec = codecs[hostname]
+            if not relay and not cached:
+                url, digest = modules_urls[codec]
+                _fetchBundles(config, hostname,
+                              [(httpd.url(addresses[hostname], url), digest,
+                                modules_dir, relay_dir)])
+            server = utils.ScriptRunner()
+            _pushManifests(server, hostname, host_dir,
+                           TRANSFER_CODECS[codecs[hostname]])
+            server.execute()
+            _linkCachedModules(hostname, host_dir, modules.digest,
+                               not cached and modules_dir or None)
+            if not cached:
+                size += modules_size
+            transfers[hostname] = (codec, size, time.time() - start)
+            _pushResources(config, hostname)
+        except (ScriptRuntimeError, NetworkError), ex:
+            failures[hostname] = ex
+            return
+        if relay_dir:
+            try:
+                port = _startRelay(hostname, relay_dir)
+            except (ScriptRuntimeError, NetworkError, ValueError), ex:
+                logging.warning('Unable to start relay on host %s: %s' %
+                                (hostname, ex))
+                return
+            url, digest = modules_urls[codec]
+            relays[hostname] = ('http://%s:%d/%s' %
+                                (hostname, port, os.path.basename(url)),
+                                digest, codec)
+
+    try:
+        httpd.start()
+        for wave in waves:
+            threads = []
+            for hostname, parent in wave:
+                thread = threading.Thread(target=fetch,
+                                          args=(hostname, parent))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+    finally:
+        httpd.stop()
+        for hostname in parents - set([None]):
+            _stopRelay(hostname, os.path.join(
+                config['HOST_DETAILS'][hostname]['tmpdir'], RELAY_DIR))
+    if failures:
+        for hostname, ex in sorted(failures.items()):
+            logging.error('Host %s failed to fetch Puppet modules and '
+                          'manifests: %s' % (hostname, ex))
+        raise ScriptRuntimeError('Failed to fetch Puppet modules and '
+                                 'manifests on hosts: %s' %
+                                 ', '.join(sorted(failures)))
+
+
+class LogCollector(object):
+    """
+    Retrieves logs of successful Puppet runs from hosts in background
+    threads. Logs of each host are transferred compressed in single SSH
+    session, so the transfer overlaps with following Puppet runs.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.threads = []
+
+    def add(self, hostname, finished_logfile):
+        self.pending.setdefault(hostname, []).append(finished_logfile)
+
+    def start(self):
+        for hostname, logfiles in self.pending.items():
+            thread = threading.Thread(target=self._collect,
+                                      args=(hostname, logfiles))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.pending = {}
+
+    def wait(self):
+        self.start()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _collect(self, hostname, logfiles):
+        remote_dir = os.path.dirname(logfiles[0])
+        names = ' '.join([os.path.basename(i) for i in logfiles])
+        local_server = utils.ScriptRunner()
+        local_server.append("ssh %s root@%s tar -C %s -czf - %s | "
+                            "tar -C %s --transform 's/\\.finished$/.log/' "
+                            "-xzf -" % (SSH_OPTS, hostname, remote_dir, names,
+                                        basedefs.PUPPET_MANIFEST_DIR))
+        try:
+            local_server.execute(log=False)
+        except (ScriptRuntimeError, NetworkError), ex:
+            logging.warning('Unable to retrieve Puppet logs from %s: %s' %
+                            (hostname, ex))
+
+
+logcollector = LogCollector()
+
+
+def fetchlog(hostname, finished_logfile, log):
+    local_server = utils.ScriptRunner()
+    local_server.append('scp %s root@%s:%s %s' %
+                        (SSH_OPTS, hostname, finished_logfile, log))
+    local_server.execute(log=False)
+
+
 def waitforpuppet(currently_running):
     global controller
     log_len = 0
@@ -133,13 +661,16 @@ def waitforpuppet(currently_running):
                 sys.stdout.write(("\rTesting if puppet apply is finished: %s" % log_file).ljust(40 + log_len))
                 sys.stdout.write("[ %s ]" % twirl[0])
                 sys.stdout.flush()
+            log = os.path.join(basedefs.PUPPET_MANIFEST_DIR,
+                               os.path.basename(finished_logfile).replace(".finished", ".log"))
+            summary = os.path.join(basedefs.PUPPET_MANIFEST_DIR,
+                                   '%s.summary' % log_file)
             try:
-                # Once a remote puppet run has finished, we retrieve the log
-                # file and check it for errors
+                # Once a remote puppet run has finished and its log file
+                # has been analyzed, we retrieve the summary of the log
+                remote_summary = '%s.summary' % os.path.splitext(finished_logfile)[0]
                 local_server = utils.ScriptRunner()
-                log = os.path.join(basedefs.PUPPET_MANIFEST_DIR,
-                                   os.path.basename(finished_logfile).replace(".finished", ".log"))
-                local_server.append('scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null root@%s:%s %s' % (hostname, finished_logfile, log))
+                local_server.append('scp %s root@%s:%s %s' % (SSH_OPTS, hostname, remote_summary, summary))
                 # To not pollute logs we turn of logging of command execution
                 local_server.execute(log=False)
 
@@ -156,13 +687,44 @@ def waitforpuppet(currently_running):
                 time.sleep(3)
                 continue
 
+            result = load_summary(summary, log)
+            if result is None or result.errors:
+                # full log is required for analysis when the host was not
+                # able to summarize it and for error trace
+                fetchlog(hostname, finished_logfile, log)
+                if result is None:
+                    result = analyze_logfile(log)
+            else:
+                logcollector.add(hostname, finished_logfile)
+
+            statuses[result.manifest] = result.errors and 'failed' or 'ok'
+            merged = combined.get(result.manifest)
+            if merged is not None:
+                fragment_errors = merged.split_errors(
+                    result.errors, finished=result.runtime is not None)
+                for fragment, errors in fragment_errors.iteritems():
+                    statuses[fragment] = errors and 'failed' or 'ok'
+                if any(fragment_errors.values()):
+                    statuses[result.manifest] = 'failed'
+
             # check log file for relevant notices
-            controller.MESSAGES.extend(scan_logfile(log))
+            controller.MESSAGES.extend(result.notices)
+
+            record_hits(rule_stats, result.hits)
+
+            # remember duration for estimations of following runs
+            if result.runtime is not None:
+                record_timing(timings,
+                              manifest_key(hostname, result.manifest),
+                              result.runtime)
 
             # check the log file for errors
             sys.stdout.write('\r')
+            if merged is not None:
+                validateFragments(result, merged, fragment_errors)
+                continue
             try:
-                validate_logfile(log)
+                result.validate()
                 state = utils.state_message('%s:' % log_file, 'DONE', 'green')
                 sys.stdout.write('%s\n' % state)
                 sys.stdout.flush()
@@ -172,10 +734,273 @@ def waitforpuppet(currently_running):
                 sys.stdout.flush()
                 raise
 
+    # logs of finished runs are retrieved during following stage
+    logcollector.start()
+
+
+def validateFragments(result, merged, fragment_errors):
+    """
+    Reports result of coalesced Puppet run for each merged manifest and
+    raises PuppetError naming the first manifest which failed.
+    """
+    failed = None
+    for fragment in merged.fragments:
+        errors = fragment_errors[fragment]
+        if errors:
+            state = utils.state_message('%s:' % fragment, 'ERROR', 'red')
+            failed = failed or (fragment, errors[0])
+        else:
+            state = utils.state_message('%s:' % fragment, 'DONE', 'green')
+        sys.stdout.write('%s\n' % state)
+    sys.stdout.flush()
+    if failed:
+        raise PuppetError('Error appeared during Puppet run: %s\n%s\n'
+                          'You will find full trace in log %s' %
+                          (failed[0], failed[1], result.logpath))
+
+
+def parameterValues(config):
+    """
+    Returns dictionary of processed values of all parameters.
+    """
+    values = {}
+    for group in controller.getAllGroups():
+        for param in group.parameters.itervalues():
+            if param.CONF_NAME in config:
+                values[param.CONF_NAME] = config[param.CONF_NAME]
+    return values
+
+
+def manifestHost(hosts, manifest):
+    """
+    Returns host of given manifest or None.
+    """
+    for hostname in hosts:
+        if manifest.startswith('%s_' % hostname):
+            return hostname
+    return None
+
+
+def hostIdentities(config):
+    """
+    Returns dictionary of identities of hosts (see prescript discover)
+    by manifest name, so results of a reinstalled host with the same
+    address are not reused.
+    """
+    hosts = filtered_hosts(config)
+    details = config.get('HOST_DETAILS', {})
+    identities = {}
+    for manifest in manifest_info:
+        hostname = manifestHost(hosts, manifest)
+        identities[manifest] = details.get(hostname, {}).get('machine_id')
+    return identities
+
+
+def selectManifests(config, snapshot):
+    """
+    Decides which manifests have to be applied. Only manifests which use
+    parameters changed since the last run, whose content changed, which
+    were applied by other Puppet modules or to other host or which were not
+    applied successfully yet are selected, unless FORCE_FULL is set.
+    """
+    manifest_info.clear()
+    selected.clear()
+    for manifest, marker in manifestfiles.getFiles():
+        path = os.path.join(basedefs.PUPPET_MANIFEST_DIR, manifest)
+        manifest_info[manifest] = (file_hash(path),
+                                   manifestfiles.getKeys(manifest))
+    if config.get("FORCE_FULL"):
+        selected.update([(i, 'forced') for i in manifest_info])
+    else:
+        selected.update(affected_manifests(snapshot, parameterValues(config),
+                                           manifest_info, modulesDigest(),
+                                           hostIdentities(config)))
+    for manifest, reason in sorted(selected.items()):
+        logging.debug('Manifest %s will be applied: %s' % (manifest, reason))
+
+
+def createPlan(config):
+    """
+    Returns DeploymentPlan of manifests selected for this run.
+    """
+    hosts = filtered_hosts(config)
+    files = [i for i in manifestfiles.getFiles() if i[0] in selected]
+    plan = DeploymentPlan(hosts, files, load_timings())
+    modules_size = sum([path_size(os.path.join(MODULE_DIR, i))
+                        for i in PUPPET_MODULES])
+    manifests_size = path_size(basedefs.PUPPET_MANIFEST_DIR)
+    for hostname in hosts:
+        plan.add_transfer(hostname, modules_size + manifests_size)
+        for path, localname in controller.resources.get(hostname, []):
+            plan.add_transfer(hostname, path_size(path), resource=True)
+    return plan
+
 
 def applyPuppetManifest(config):
+    # results are recorded separately for each deployment (answer file)
+    snapshot = load_snapshot(deployment=config.get('DEPLOYMENT'))
+    selectManifests(config, snapshot)
+    if config.get("PLAN"):
+        plan = createPlan(config)
+        planfile = os.path.join(basedefs.VAR_DIR, 'plan.txt')
+        with open(planfile, 'w') as fp:
+            fp.write(plan.render())
+        print "\n%s\n" % plan.render()
+        controller.MESSAGES.append(output_messages.INFO_PLAN_PATH % planfile)
+        return
     if config.get("DRY_RUN"):
         return
+    timings.update(load_timings())
+    rule_stats.update(load_rule_stats())
+    try:
+        _applyPuppetManifest(config)
+    finally:
+        logcollector.wait()
+        save_timings(timings)
+        save_rule_stats(rule_stats)
+        update_snapshot(snapshot, parameterValues(config), manifest_info,
+                        statuses, modulesDigest(), hostIdentities(config))
+        save_snapshot(snapshot, deployment=config.get('DEPLOYMENT'))
+        for rule_id, hits, runs in frequent_rules(rule_stats):
+            logging.debug('Ignore rule %s matched %d lines in %d Puppet '
+                          'runs so far' % (rule_id, hits, runs))
+        try:
+            archivePuppetRun(config)
+        except (IOError, OSError), ex:
+            logging.warning('Unable to archive Puppet manifests and logs: '
+                            '%s' % ex)
+
+
+def archivePuppetRun(config):
+    """
+    Moves manifests and logs of successful runs to compressed archive,
+    files of failed runs are kept in place for debugging. Archives and
+    run directories older than retention limit are pruned.
+    """
+    archive = RunArchive(os.path.basename(basedefs.VAR_DIR))
+    hosts = filtered_hosts(config)
+    manifests = [i[0] for i in manifestfiles.getFiles()] + sorted(combined)
+    for manifest in manifests:
+        hostname = manifestHost(hosts, manifest)
+        status = statuses.get(manifest, 'not run')
+        manifest_path = os.path.join(basedefs.PUPPET_MANIFEST_DIR, manifest)
+        log = '%s.log' % manifest_path
+        paths = [manifest_path, log, '%s.summary' % manifest_path]
+        if os.path.exists(manifest_path):
+            archive.add_manifest(hostname, manifest, manifest_path, status)
+        if os.path.exists(log):
+            archive.add_log(hostname, os.path.basename(log), log, status)
+        if status in ('ok', 'skipped'):
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+    archive.save()
+    prune_archives()
+    prune_rundirs(keep=[basedefs.VAR_DIR])
+    logging.debug('Puppet manifests and logs archived in %s' %
+                  archive.index_path)
+    controller.MESSAGES.append(output_messages.INFO_ARCHIVE_PATH %
+                               (archive.index_path, archive.name))
+
+
+def _startPuppet(config, hostname, manifest, loglevel, logcmd,
+                 facterlib=True, content=None):
+    """
+    Starts Puppet run of given manifest on given host in background and
+    returns path of log file created on the host when the run finishes.
+    Manifests created during the run (see coalesceStage) are sent to the
+    host as given content.
+    """
+    host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
+    print "Applying %s" % manifest
+    server = utils.ScriptRunner(hostname)
+
+    man_path = os.path.join(host_dir, basedefs.PUPPET_MANIFEST_RELATIVE,
+                            manifest)
+
+    running_logfile = "%s.running" % man_path
+    finished_logfile = "%s.finished" % man_path
+    summary_file = "%s.summary" % man_path
+    rules_file = os.path.join(host_dir,
+                              basedefs.PUPPET_MANIFEST_RELATIVE,
+                              RULES_FILE)
+    if content is not None:
+        server.append("cat > %s <<'%s'\n%s%s" % (man_path, MANIFEST_EOF,
+                                                 content, MANIFEST_EOF))
+        server.append("chmod 600 %s" % man_path)
+    # The apache puppet module doesn't work if we set FACTERLIB
+    # https://github.com/puppetlabs/puppetlabs-apache/pull/138
+    if facterlib:
+        server.append("export FACTERLIB=$FACTERLIB:%s/facts" % host_dir)
+    server.append("touch %s" % running_logfile)
+    server.append("chmod 600 %s" % running_logfile)
+    server.append("export PACKSTACK_VAR_DIR=%s" % host_dir)
+    # log is summarized on the host, summary is moved in place last,
+    # so its presence means that the run has finished
+    command = "( flock %s/ps.lock puppet apply %s --modulepath %s/modules %s > %s 2>&1 < /dev/null ; mv %s %s ; python %s/%s %s %s > %s.tmp 2> /dev/null ; mv %s.tmp %s ) > /dev/null 2>&1 < /dev/null &" % (host_dir, loglevel, host_dir, man_path, running_logfile, running_logfile, finished_logfile, host_dir, os.path.basename(LOG_ANALYZER), finished_logfile, rules_file, summary_file, summary_file, summary_file)
+    server.append(command)
+    server.execute(log=logcmd)
+    return finished_logfile
+
+
+def usesFacterlib(manifest):
+    return not (manifest.endswith('_horizon.pp') or
+                manifest.endswith('_nagios.pp'))
+
+
+def coalesceStage(hostname, manifests):
+    """
+    Returns list of (manifest, CombinedManifest or None) tuples which
+    should be applied on given host instead of given manifests of single
+    stage. Manifests are merged unless they declare the same resource or
+    differ in FACTERLIB usage. Order of manifests within stage doesn't
+    matter as their runs are serialized only by lock on the host.
+    """
+    units = []
+    for facterlib in (True, False):
+        fragments = [(i, manifestfiles.data[i]) for i in manifests
+                     if usesFacterlib(i) == facterlib]
+        for group in coalesce_groups(fragments):
+            if len(group) == 1:
+                units.append((group[0], None))
+                continue
+            name = '%s_coalesced%d.pp' % (hostname, len(combined) + 1)
+            manifest = CombinedManifest(name, manifestfiles.global_data)
+            for fragment in group:
+                manifest.add(fragment, manifestfiles.data[fragment])
+            path = os.path.join(basedefs.PUPPET_MANIFEST_DIR, name)
+            with open(path, 'w') as fp:
+                fp.write(manifest.content)
+            combined[name] = manifest
+            logging.debug('Manifests %s are coalesced to %s' %
+                          (', '.join(group), name))
+            units.append((name, manifest))
+    order = dict([(j, i) for i, j in enumerate(manifests)])
+    units.sort(key=lambda x: order[x[1] and x[1].fragments[0] or x[0]])
+    return units
+
+
+def _applyStage(config, manifests, currently_running, loglevel, logcmd):
+    for hostname in filtered_hosts(config):
+        host_manifests = [i for i in manifests
+                          if i.startswith('%s_' % hostname)]
+        if config.get('COALESCE_MANIFESTS'):
+            units = coalesceStage(hostname, host_manifests)
+        else:
+            units = [(i, None) for i in host_manifests]
+        for manifest, merged in units:
+            if merged is None:
+                finished_logfile = _startPuppet(config, hostname, manifest,
+                                                loglevel, logcmd,
+                                                usesFacterlib(manifest))
+            else:
+                finished_logfile = _startPuppet(
+                    config, hostname, manifest, loglevel, logcmd,
+                    usesFacterlib(merged.fragments[0]), merged.content)
+            currently_running.append((hostname, finished_logfile))
+
+
+def _applyPuppetManifest(config):
     currently_running = []
     lastmarker = None
     loglevel = ''
@@ -183,44 +1008,35 @@ def applyPuppetManifest(config):
     if logging.root.level <= logging.DEBUG:
         loglevel = '--debug'
         logcmd = True
+    skipped = 0
+    stage = []
     for manifest, marker in manifestfiles.getFiles():
+        if manifest not in selected:
+            print "Skipping %s, no changes since the last run" % manifest
+            statuses[manifest] = 'skipped'
+            skipped += 1
+            continue
+
         # if the marker has changed then we don't want to proceed until
         # all of the previous puppet runs have finished
         if lastmarker != None and lastmarker != marker:
+            _applyStage(config, stage, currently_running, loglevel, logcmd)
             waitforpuppet(currently_running)
+            stage = []
         lastmarker = marker
+        stage.append(manifest)
 
-        for hostname in filtered_hosts(config):
-            if "%s_" % hostname not in manifest:
-                continue
-
-            host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
-            print "Applying %s" % manifest
-            server = utils.ScriptRunner(hostname)
-
-            man_path = os.path.join(config['HOST_DETAILS'][hostname]['tmpdir'],
-                                    basedefs.PUPPET_MANIFEST_RELATIVE,
-                                    manifest)
-
-            running_logfile = "%s.running" % man_path
-            finished_logfile = "%s.finished" % man_path
-            currently_running.append((hostname, finished_logfile))
-            # The apache puppet module doesn't work if we set FACTERLIB
-            # https://github.com/puppetlabs/puppetlabs-apache/pull/138
-            if not (manifest.endswith('_horizon.pp') or manifest.endswith('_nagios.pp')):
-                server.append("export FACTERLIB=$FACTERLIB:%s/facts" % host_dir)
-            server.append("touch %s" % running_logfile)
-            server.append("chmod 600 %s" % running_logfile)
-            server.append("export PACKSTACK_VAR_DIR=%s" % host_dir)
-            command = "( flock %s/ps.lock puppet apply %s --modulepath %s/modules %s > %s 2>&1 < /dev/null ; mv %s %s ) > /dev/null 2>&1 < /dev/null &" % (host_dir, loglevel, host_dir, man_path, running_logfile, running_logfile, finished_logfile)
-            server.append(command)
-            server.execute(log=logcmd)
-
+    _applyStage(config, stage, currently_running, loglevel, logcmd)
     # wait for outstanding puppet runs befor exiting
     waitforpuppet(currently_running)
+    if skipped:
+        controller.MESSAGES.append(output_messages.INFO_SKIPPED_MANIFESTS %
+                                   skipped)
 
 
 def finalize(config):
+    if config.get("PLAN"):
+        return
     for hostname in filtered_hosts(config):
         server = utils.ScriptRunner(hostname)
         server.append("installed=$(rpm -q kernel --last | head -n1 | "
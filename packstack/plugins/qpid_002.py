@@ -211,7 +211,8 @@ def createmanifest(config):
         config['CONFIG_QPID_ENABLE_SSL'] = 'true'
         config['CONFIG_QPID_PROTOCOL'] = 'ssl'
         config['CONFIG_QPID_CLIENTS_PORT'] = "5671"
-        if config['CONFIG_QPID_SSL_SELF_SIGNED'] == 'y':
+        if (config['CONFIG_QPID_SSL_SELF_SIGNED'] == 'y' and
+                not config.get("PLAN")):
             server.append( "openssl req -batch -new -x509 -nodes -keyout %s -out %s -days 1095"
                 % (config['CONFIG_QPID_SSL_KEY_FILE'], config['CONFIG_QPID_SSL_CERT_FILE']) )
             server.execute()
@@ -473,6 +473,8 @@ def initSequences(controller):
 
 
 def serverprep(config):
+    if config.get("PLAN"):
+        return
     rh_username = None
     sat_url = None
     if is_rhel():
@@ -14,6 +14,7 @@ from packstack.installer import utils
 from packstack.installer.utils import split_hosts
 
 from packstack.modules.ospluginutils import getManifestTemplate, appendManifestFile, manifestfiles
+from packstack.modules.puppet import add_rule
 
 # Controller object will be initialized from main flow
 controller = None
@@ -28,6 +29,10 @@ def initConfig(controllerObject):
     global controller
     controller = controllerObject
     logging.debug("Adding OpenStack Swift configuration")
+    add_rule('swift-plugin-s3', 'ignore', 'yum.*?install swift-plugin-s3',
+             description='Swift Puppet module tries to install '
+                         'swift-plugin-s3, there is no such package on RHEL, '
+                         'fixed in the upstream puppet module')
     paramsList = [
                   {"CMD_OPTION"      : "os-swift-proxy",
                    "USAGE"           : "The IP address on which to install the Swift proxy service (currently only single proxy is supported)",
@@ -268,7 +273,7 @@ def createstoragemanifest(config):
         host = device['host']
         devicename = device['device_name']
         device = device['device']
-        if device:
+        if device and not config.get("PLAN"):
             check_device(host, device)
 
         manifestfile = "%s_swift.pp"%host
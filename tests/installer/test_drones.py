@@ -16,8 +16,10 @@
 # under the License.
 
 import os
+import time
 import shutil
 import tempfile
+from cStringIO import StringIO
 import subprocess
 from unittest import TestCase
 
@@ -96,6 +98,71 @@ class SshTarballTransferMixinTestCase(PackstackTestCaseMixin, TestCase):
         shutil.rmtree(os.path.join(self.tempdir, 'resources'))
         shutil.rmtree(os.path.join(self.tempdir, 'recipes'))
 
+    def test_streamed_transfer(self):
+        """
+        Tests streaming of resources and recipes with all codecs
+        """
+        self.mixin._remote_command = lambda script: ['bash', '-c', script]
+        remote = self.mixin.resource_dir
+        for codec in ('none', 'fast', 'best'):
+            self.mixin.transfer_codec = codec
+            self.mixin._copy_resources()
+            self.mixin._copy_recipes()
+            for path, content in \
+                    [('resources/res1.txt', 'resource one'),
+                     ('resources/resdir/res2.txt', 'resource two'),
+                     ('recipes/rec1.pp', 'recipe one'),
+                     ('recipes/rec2.pp', 'recipe two')]:
+                with open(os.path.join(remote, path)) as f:
+                    self.assertEqual(f.read(), content)
+            shutil.rmtree(os.path.join(remote, 'resources'))
+            shutil.rmtree(os.path.join(remote, '.bundles'))
+        self.mixin.transfer_codec = 'unknown'
+        self.assertRaises(ValueError, self.mixin._copy_resources)
+
+    def test_bundle_cache(self):
+        """
+        Tests that resource bundle is built once and is not transferred
+        to node which already has it
+        """
+        self.mixin._remote_command = lambda script: ['bash', '-c', script]
+        cache = self.mixin.bundle_cache = BundleCache(
+            os.path.join(self.tempdir, 'bundles'))
+        other = SshTarballTransferMixin()
+        other.node = self.mixin.node
+        other.resource_dir = os.path.join(self.tempdir, 'other')
+        other._resources = self.mixin._resources
+        other._remote_command = self.mixin._remote_command
+        other.bundle_cache = cache
+
+        self.mixin._copy_resources()
+        other._copy_resources()
+        self.assertEqual(len(os.listdir(cache.directory)), 1)
+        for remote in (self.mixin.resource_dir, other.resource_dir):
+            path = os.path.join(remote, 'resources', 'res1.txt')
+            self.assertTrue(os.path.exists(path))
+
+        # node with the bundle is skipped
+        shutil.rmtree(os.path.join(other.resource_dir, 'resources'))
+        other._copy_resources()
+        self.assertFalse(os.path.exists(os.path.join(other.resource_dir,
+                                                     'resources')))
+        # changed resource makes bundle of different hash
+        digest = cache.get(other._resource_members()).digest
+        with open(self.mixin._resources[0][0], 'w') as f:
+            f.write('changed')
+        changed = BundleCache(os.path.join(self.tempdir, 'changed'))
+        self.assertNotEqual(changed.get(other._resource_members()).digest,
+                            digest)
+
+        # only the last extracted bundle is marked on node
+        other.bundle_cache = changed
+        other._copy_resources()
+        markers = os.path.join(other.resource_dir, '.bundles')
+        self.assertListEqual(os.listdir(markers),
+                             [changed.get(other._resource_members()).digest])
+        self.assertFalse(other._has_bundle(digest))
+
     '''
     # uncomment this test only on local machines
     def test_transfer(self):
@@ -212,3 +279,121 @@ class DroneTestCase(PackstackTestCaseMixin, TestCase):
         self.assertListEqual(self.observer.log[:6], first)
         self.assertListEqual(self.observer.log[-3:], last)
         self.assertEqual(len(self.observer.log), 21)
+
+
+class SlowDrone(FakeDrone):
+    """
+    Drone which finishes one running recipe in every third status query.
+    """
+    def __init__(self, *args, **kwargs):
+        super(SlowDrone, self).__init__(*args, **kwargs)
+        self.queries = []
+
+    def _finished_recipes(self, recipes):
+        self.queries.append(sorted(recipes))
+        if len(self.queries) % 3:
+            return set()
+        return set(sorted(recipes)[:1])
+
+
+class DroneWaitTestCase(PackstackTestCaseMixin, TestCase):
+    def setUp(self):
+        super(DroneWaitTestCase, self).setUp()
+        self.sleeps = []
+        self._sleep = time.sleep
+        time.sleep = self.sleeps.append
+
+    def tearDown(self):
+        super(DroneWaitTestCase, self).tearDown()
+        time.sleep = self._sleep
+
+    def test_wait(self):
+        """
+        Tests that Drone._wait queries all running recipes at once and
+        backs off while nothing finishes.
+        """
+        drone = SlowDrone('127.0.0.1')
+        drone.wait_max_delay = 3
+        for i in ('a', 'b'):
+            drone.add_recipe('/some/recipe/%s.rec' % i, marker='test')
+        drone.apply()
+        rdir = drone.recipe_dir
+        both = [os.path.join(rdir, i) for i in ('a.rec', 'b.rec')]
+        self.assertListEqual(drone.queries, [both] * 3 + [both[1:]] * 3)
+        self.assertListEqual(self.sleeps, [1, 2, 1, 2, 3])
+
+    def test_packstack_finished(self):
+        """
+        Tests that PackstackDrone fetches logs of finished recipes.
+        """
+        buf = StringIO()
+        archive = tarfile.open(fileobj=buf, mode='w')
+        info = tarfile.TarInfo('a.pp.finished')
+        info.size = len('log of a')
+        archive.addfile(info, StringIO('log of a'))
+        archive.close()
+        self.fake_popen.stdout = buf.getvalue()
+
+        drone = PackstackDrone('127.0.0.1', local_tmpdir=self.tempdir)
+        recipes = [os.path.join(drone.recipe_dir, i)
+                   for i in ('a.pp', 'b.pp')]
+        self.assertEqual(drone._finished_recipes(recipes), set(recipes[:1]))
+        self.assertIn('a.pp.finished b.pp.finished', self.fake_popen.data)
+        with open(drone.log_path(recipes[0])) as log:
+            self.assertEqual(log.read(), 'log of a')
+
+
+class FleetDrone(FakeDrone):
+    def __init__(self, node, events, *args, **kwargs):
+        super(FleetDrone, self).__init__(node, *args, **kwargs)
+        self.events = events
+
+    def init_node(self):
+        time.sleep(0.2)
+
+    def _apply(self, recipe):
+        self.events.append(os.path.basename(recipe))
+
+
+class DroneFleetTestCase(PackstackTestCaseMixin, TestCase):
+    def setUp(self):
+        super(DroneFleetTestCase, self).setUp()
+        self.events = []
+        self.observer = FakeDroneObserver()
+        self.fleet = DroneFleet()
+        first = FleetDrone('1.1.1.1', self.events)
+        first.add_recipe('/some/recipe/prepare.rec')
+        first.add_recipe('/some/recipe/shared1.rec', marker='shared')
+        first.add_recipe('/some/recipe/last1.rec')
+        second = FleetDrone('2.2.2.2', self.events)
+        second.add_recipe('/some/recipe/shared2.rec', marker='shared')
+        second.add_recipe('/some/recipe/last2.rec')
+        self.fleet.add_drone(first)
+        self.fleet.add_drone(second)
+
+    def test_fleet_apply(self):
+        """
+        Tests DroneFleet's fleet wide recipe application order.
+        """
+        self.fleet.set_observer(self.observer)
+        self.fleet.apply()
+        index = self.events.index
+        self.assertEqual(len(self.events), 5)
+        # shared marker waits for recipes preceding it on any node
+        self.assertLess(index('prepare.rec'), index('shared2.rec'))
+        # recipes following shared marker wait for it on all nodes
+        for last in ('last1.rec', 'last2.rec'):
+            for shared in ('shared1.rec', 'shared2.rec'):
+                self.assertLess(index(shared), index(last))
+        self.assertEqual(len(self.observer.log), 15)
+
+    def test_fleet_concurrency(self):
+        """
+        Tests that DroneFleet initializes nodes concurrently.
+        """
+        for i in range(3, 11):
+            self.fleet.add_drone(FleetDrone('%d.%d.%d.%d' % ((i,) * 4),
+                                            self.events))
+        start = time.time()
+        self.fleet.init_nodes()
+        self.assertLess(time.time() - start, 1)
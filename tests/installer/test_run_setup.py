@@ -21,7 +21,7 @@ import subprocess
 import sys
 from unittest import TestCase
 
-from packstack.modules import ospluginutils, puppet
+from packstack.modules import puppet
 from packstack.installer import run_setup, basedefs
 
 from ..test_base import PackstackTestCaseMixin, FakePopen
@@ -60,11 +60,10 @@ class CommandLineTestCase(PackstackTestCaseMixin, TestCase):
                     '--install-hosts=127.0.0.1', '--os-swift-install=y',
                     '--nagios-install=y', '--use-epel=y']
 
-        # There is no puppet logfile to validate, so replace
-        # ospluginutils.validate_puppet_logfile with a mock function
-        orig_validate_logfile = puppet.validate_logfile
-        puppet.validate_logfile = lambda a: None
-        puppet.scan_logfile = lambda a: []
+        # There is no puppet logfile to analyze, so replace
+        # puppet.analyze_logfile with a mock function
+        orig_analyze_logfile = puppet.analyze_logfile
+        puppet.analyze_logfile = lambda a: puppet.PuppetLogResult(a)
 
         # If there is a error in a plugin sys.exit() gets called, this masks
         # the actual error that should be reported, so we replace it to
@@ -78,7 +77,7 @@ class CommandLineTestCase(PackstackTestCaseMixin, TestCase):
             run_setup.main()
         finally:
             sys.argv = orig_argv
-            ospluginutils.validate_puppet_logfile = orig_validate_logfile
+            puppet.analyze_logfile = orig_analyze_logfile
             sys.exit = orig_sys_exit
             try:
                 shutil.rmtree(basedefs.VAR_DIR)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Test cases for packstack.installer.setup_controller module.
+"""
+
+from unittest import TestCase
+
+from ..test_base import PackstackTestCaseMixin
+from packstack.installer.setup_controller import Controller
+
+
+# registries of the singleton which are replaced during tests
+REGISTRIES = ('GROUPS', 'SEQUENCES', 'PLUGINS', 'GROUPS_BY_NAME',
+              'SEQUENCES_BY_NAME', 'PLUGINS_BY_NAME', 'PARAMS_BY_NAME',
+              'PARAMS_BY_OPTION')
+
+
+class ControllerTestCase(PackstackTestCaseMixin, TestCase):
+    def setUp(self):
+        super(ControllerTestCase, self).setUp()
+        self._registries = {}
+        for name in REGISTRIES:
+            attr = '_Controller__%s' % name
+            value = getattr(Controller, attr)
+            self._registries[attr] = value
+            setattr(Controller, attr, type(value)())
+        self.controller = Controller()
+
+    def tearDown(self):
+        super(ControllerTestCase, self).tearDown()
+        for attr, value in self._registries.iteritems():
+            setattr(Controller, attr, value)
+
+    def _group(self, name, *params):
+        return ({'GROUP_NAME': name},
+                [{'CONF_NAME': i, 'CMD_OPTION': i.lower().replace('_', '-')}
+                 for i in params])
+
+    def test_groups_and_params(self):
+        """
+        Test packstack.installer.setup_controller.Controller group and
+        parameter lookups.
+        """
+        self.controller.addGroup(*self._group('NOVA', 'CONFIG_NOVA_HOST'))
+        self.controller.addGroup(*self._group('GLANCE', 'CONFIG_GLANCE_HOST'))
+        group, params = self._group('MYSQL', 'CONFIG_MYSQL_HOST',
+                                    'CONFIG_NOVA_HOST')
+        self.controller.insertGroupBeforeGroup('NOVA', group, params)
+
+        names = [i.GROUP_NAME for i in self.controller.getAllGroups()]
+        self.assertListEqual(names, ['MYSQL', 'NOVA', 'GLANCE'])
+        self.assertEqual(self.controller.getGroupByName('GLANCE').GROUP_NAME,
+                         'GLANCE')
+        self.assertIsNone(self.controller.getGroupByName('SWIFT'))
+
+        # parameter of the first group containing it is returned
+        mysql = self.controller.getGroupByName('MYSQL')
+        param = self.controller.getParamByName('CONFIG_NOVA_HOST')
+        self.assertIs(param, mysql.parameters['CONFIG_NOVA_HOST'])
+        param = self.controller.getParamByOption('config-glance-host')
+        self.assertEqual(param.CONF_NAME, 'CONFIG_GLANCE_HOST')
+        self.assertIsNone(self.controller.getParamByName('CONFIG_NONE'))
+        self.assertIsNone(self.controller.getParamByOption('none'))
+        self.assertEqual(self.controller.getParamKeyValue(
+            'CONFIG_MYSQL_HOST', 'CMD_OPTION'), 'config-mysql-host')
+
+    def test_sequences_and_plugins(self):
+        """
+        Test packstack.installer.setup_controller.Controller sequence and
+        plugin lookups.
+        """
+        steps = [{'title': 'Step', 'functions': [lambda config: None]}]
+        self.controller.addSequence('second', [], [], steps)
+        self.controller.insertSequence('first', [], [], steps)
+        self.controller.insertSequenceBeforeSequence('second', 'middle', [],
+                                                     [], steps)
+        names = [i.name for i in self.controller.getAllSequences()]
+        self.assertListEqual(names, ['first', 'middle', 'second'])
+        self.assertEqual(self.controller.getSequenceByDesc('middle').name,
+                         'middle')
+        self.assertIsNone(self.controller.getSequenceByDesc('none'))
+
+        plugin = type(self)
+        self.controller.addPlugin(plugin)
+        self.assertIs(self.controller.getPluginByName(plugin.__name__),
+                      plugin)
+        self.assertIsNone(self.controller.getPluginByName('none'))
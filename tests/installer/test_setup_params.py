@@ -58,6 +58,19 @@ class ParameterTestCase(PackstackTestCaseMixin, TestCase):
         """
         param = Parameter()
         self.assertIsNone(param.PROCESSORS)
+        self.assertRaises(KeyError, Parameter, {'UNKNOWN': 1})
+        self.assertRaises(AttributeError, setattr, param, 'UNKNOWN', 1)
+
+    def test_copy(self):
+        """
+        Test packstack.installer.core.parameters.Parameter copy method
+        """
+        param = Parameter(self.data)
+        copied = param.copy(CONF_NAME='CONFIG_MYSQL_HOST_CONFIRMED')
+        self.assertEqual(copied.CONF_NAME, 'CONFIG_MYSQL_HOST_CONFIRMED')
+        self.assertEqual(param.CONF_NAME, 'CONFIG_MYSQL_HOST')
+        self.assertEqual(copied.PROMPT, param.PROMPT)
+        self.assertRaises(KeyError, param.copy, UNKNOWN=1)
 
 
 class GroupTestCase(PackstackTestCaseMixin, TestCase):
@@ -19,13 +19,19 @@
 Test cases for packstack.installer.utils module.
 """
 
+import cProfile
+import logging
+import os
 import shutil
 import tempfile
+import time
 from unittest import TestCase
 
 from ..test_base import PackstackTestCaseMixin
 from packstack.installer.utils import *
+from packstack.installer.utils import shell
 from packstack.installer.utils.strings import STR_MASK
+from packstack.installer.core.sequences import Sequence
 from packstack.installer.exceptions import ExecuteRuntimeError
 
 
@@ -50,6 +56,18 @@ class ParameterTestCase(PackstackTestCaseMixin, TestCase):
         self.assertListEqual(sdict.keys(), ['1', '2', '3', '4', '5'])
         self.assertListEqual(sdict.values(), [1, 2, 3, 4, 5])
 
+        sdict.insert(0, '0', 0)
+        sdict.insert(2, '4', 4)
+        self.assertListEqual(sdict.keys(), ['0', '1', '4', '2', '3', '5'])
+        self.assertEqual(sdict.value_for_index(2), 4)
+        self.assertEqual(sdict.value_for_index(-1), 5)
+        del sdict['1']
+        self.assertEqual(sdict.pop('2'), 2)
+        self.assertEqual(sdict.popitem(), ('5', 5))
+        sdict.move_to_end('0')
+        self.assertListEqual(sdict.items(), [('4', 4), ('3', 3), ('0', 0)])
+        self.assertListEqual(sdict.copy().keys(), ['4', '3', '0'])
+
     def test_retry(self):
         """Test packstack.installer.utils.decorators.retry"""
 
@@ -89,6 +107,22 @@ class ParameterTestCase(PackstackTestCaseMixin, TestCase):
                          'stderr: ' % STR_MASK)
             self.assertEqual(str(ex), should_be)
 
+        orig_masker = get_masker()
+        set_masker(Masker(['password']))
+        try:
+            execute('echo "mask the password" && exit 1', use_shell=True)
+            raise AssertionError('Masked execution failed.')
+        except ExecuteRuntimeError, ex:
+            self.assertEqual(str(ex), should_be)
+        finally:
+            set_masker(orig_masker)
+
+        # maskers for additional mask lists are reused
+        masker = shell._get_masker(['secret'])
+        self.assertTrue(shell._get_masker(['secret']) is masker)
+        set_masker(orig_masker)
+        self.assertFalse(shell._get_masker(['secret']) is masker)
+
         script = ScriptRunner()
         script.append('echo "this is test"')
         rc, out = script.execute()
@@ -105,6 +139,12 @@ class ParameterTestCase(PackstackTestCaseMixin, TestCase):
                              replace_list=[("'", "'\\''")])
         self.assertEqual(masked, 'test %s' % STR_MASK)
 
+        masker = Masker(['pass', 'password', ''])
+        self.assertEqual(masker.mask('password and pass'),
+                         '%s and %s' % (STR_MASK, STR_MASK))
+        self.assertEqual(masker.mask('nothing'), 'nothing')
+        self.assertEqual(Masker().mask('nothing'), 'nothing')
+
     def test_shortcuts(self):
         """Test packstack.installer.utils.shortcuts functions"""
         conf = {"A_HOST": "1.1.1.1", "B_HOSTS": "2.2.2.2,1.1.1.1",
@@ -112,3 +152,56 @@ class ParameterTestCase(PackstackTestCaseMixin, TestCase):
         hostlist = list(hosts(conf))
         hostlist.sort()
         self.assertEquals(['1.1.1.1', '2.2.2.2', '3.3.3.3'], hostlist)
+
+    def test_profiling(self):
+        """Test packstack.installer.utils.profiling.ProfileReport"""
+        def step(config):
+            time.sleep(0.05)
+
+        seq = Sequence('test', [{'name': 'step', 'function': step}])
+        profiler = cProfile.Profile()
+        profiler.runcall(step, {})
+        report = ProfileReport(profiler, [seq])
+
+        name, duration = report.by_sequence()[0]
+        self.assertEqual(name, 'test')
+        assert duration >= 0.05
+        name, duration = report.by_plugin()[0]
+        self.assertEqual(name, __name__)
+        activities = dict(report.by_activity())
+        assert activities['waiting for commands'] >= 0.05
+        self.assertIn('Time by activity:', report.render())
+
+    def test_logqueue(self):
+        """Test packstack.installer.utils.logqueue.QueueHandler"""
+        class CountingMessage(MaskedMessage):
+            rendered = 0
+
+            def __str__(self):
+                CountingMessage.rendered += 1
+                return super(CountingMessage, self).__str__()
+
+        logpath = os.path.join(self.tempdir, 'test.log')
+        target = logging.FileHandler(logpath, encoding='utf-8', delay=True)
+        target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        handler = QueueHandler(target)
+        logger = logging.getLogger('packstack.test.logqueue')
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            logger.debug(CountingMessage('%(out)s', {'out': 'dropped'}))
+            logger.info(CountingMessage('%(out)s', {'out': 'secret out'},
+                                        Masker(['secret'])))
+            logger.info('plain %s', 'message')
+            logger.info(u'unicode \u017elu\u0165ou\u010dk\xfd')
+            handler.flush()
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertEqual(CountingMessage.rendered, 1)
+        with open(logpath) as logfile:
+            self.assertEqual(logfile.read().decode('utf-8'),
+                             u'INFO %s out\nINFO plain message\n'
+                             u'INFO unicode \u017elu\u0165ou\u010dk\xfd\n'
+                             % STR_MASK)
@@ -18,7 +18,9 @@
 import os
 import shutil
 import tempfile
+import time
 from unittest import TestCase
+from packstack.installer import validators
 from packstack.installer.validators import *
 
 from ..test_base import PackstackTestCaseMixin
@@ -96,3 +98,51 @@ class ValidatorsTestCase(PackstackTestCaseMixin, TestCase):
         """Test packstack.installer.validators.validate_float"""
         validate_float('5.3')
         self.assertRaises(ParamValidationError, validate_float, 'test')
+
+    def test_validation_batch(self):
+        """Test packstack.installer.validators.ValidationBatch"""
+        calls = []
+
+        def validate_counted(param, options=None):
+            calls.append(param)
+            if param == 'bad':
+                raise ParamValidationError('Bad value: %s' % param)
+
+        def validate_slow(param, options=None):
+            time.sleep(0.2)
+            if param == 'down':
+                raise ParamValidationError('Host is down: %s' % param)
+
+        batch = ValidationBatch()
+        # hosts of multi validators are checked separately
+        batch.add('CONFIG_COMPUTE_HOSTS', [validate_multi_ssh],
+                  '10.0.0.1, 10.0.0.2')
+        batch.add('CONFIG_MYSQL_HOST', [validate_ssh], '10.0.0.1')
+        self.assertEqual(len(batch.order), 2)
+        self.assertListEqual(batch.checks[(validate_ssh, '10.0.0.1', ())],
+                             ['CONFIG_COMPUTE_HOSTS', 'CONFIG_MYSQL_HOST'])
+
+        batch = ValidationBatch()
+        batch.add('A', [validate_counted], 'good')
+        batch.add('B', [validate_counted], 'good')
+        batch.add('C', [validate_counted, validate_integer], 'bad')
+        for i in range(8):
+            batch.add('HOST%d' % i, [validate_slow], 'host%d' % i)
+        batch.add('DOWN', [validate_slow], 'down')
+
+        orig_network = validators.NETWORK_VALIDATORS
+        validators.NETWORK_VALIDATORS = (validate_slow,)
+        try:
+            start = time.time()
+            failures = batch.run()
+            elapsed = time.time() - start
+        finally:
+            validators.NETWORK_VALIDATORS = orig_network
+
+        # identical checks are run once, network checks concurrently
+        self.assertListEqual(sorted(calls), ['bad', 'good'])
+        self.assertTrue(elapsed < 1.0)
+        self.assertEqual(len(failures), 3)
+        self.assertEqual(failures[0], (['C'], 'Bad value: bad'))
+        self.assertEqual(failures[1][0], ['C'])
+        self.assertEqual(failures[2], (['DOWN'], 'Host is down: down'))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import time
+
+from unittest import TestCase
+from ..test_base import PackstackTestCaseMixin
+
+from packstack.modules import archive as archive_module
+from packstack.modules.archive import (RunArchive, list_runs, prune_archives,
+                                       prune_rundirs)
+
+
+class ArchiveTestCase(PackstackTestCaseMixin, TestCase):
+
+    def _write(self, name, content):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def test_run_archive(self):
+        """Test packstack.modules.archive.RunArchive"""
+        directory = os.path.join(self.tempdir, 'archive')
+        manifest = self._write('10.0.0.1_nova.pp', 'class { "nova": }\n')
+        first = self._write('first.log', 'Notice: first run\n' * 100)
+        second = self._write('second.log', 'Notice: second run\n')
+
+        for run, log in (('run1', first), ('run2', second)):
+            archive = RunArchive(run, directory)
+            archive.add_manifest('10.0.0.1', '10.0.0.1_nova.pp', manifest,
+                                 'ok')
+            archive.add_log('10.0.0.1', '10.0.0.1_nova.pp.log', log, 'ok')
+            archive.add_log('10.0.0.1', 'other.log', second, 'failed')
+            archive.save()
+
+        self.assertListEqual(list_runs(directory), ['run1', 'run2'])
+        # identical manifests are stored once
+        objects = os.listdir(os.path.join(directory, 'objects'))
+        self.assertEqual(len(objects), 1)
+
+        archive = RunArchive('run1', directory)
+        self.assertEqual(len(archive.entries(kind='log')), 2)
+        self.assertEqual(archive.read('10.0.0.1_nova.pp'),
+                         'class { "nova": }\n')
+        self.assertEqual(archive.read('10.0.0.1_nova.pp.log'),
+                         'Notice: first run\n' * 100)
+        self.assertEqual(archive.read('other.log'), 'Notice: second run\n')
+        self.assertEqual(archive.entries(kind='log')[1]['status'], 'failed')
+        self.assertRaises(KeyError, archive.read, 'missing.log')
+
+        # old archives are pruned together with unreferenced manifests
+        old = time.time() - 40 * 24 * 3600
+        for run in ('run1', 'run2'):
+            os.utime(RunArchive(run, directory).index_path, (old, old))
+        prune_archives(30, directory)
+        self.assertListEqual(list_runs(directory), [])
+        self.assertListEqual(os.listdir(os.path.join(directory, 'objects')),
+                             [])
+
+    def test_streamed_members(self):
+        """Test files larger than chunk are archived by parts"""
+        directory = os.path.join(self.tempdir, 'archive')
+        content = ''.join(['line %d\n' % i for i in range(1000)])
+        manifest = self._write('10.0.0.1_nova.pp', content)
+        log = self._write('nova.log', content)
+        orig_chunk_size = archive_module.CHUNK_SIZE
+        archive_module.CHUNK_SIZE = 7
+        try:
+            archive = RunArchive('run1', directory)
+            archive.add_log('10.0.0.1', 'first.log', log, 'ok')
+            archive.add_manifest('10.0.0.1', '10.0.0.1_nova.pp', manifest,
+                                 'ok')
+            archive.add_log('10.0.0.1', 'second.log', log, 'ok')
+        finally:
+            archive_module.CHUNK_SIZE = orig_chunk_size
+        self.assertEqual(archive.entries(kind='manifest')[0]['size'],
+                         len(content))
+        for name in ('first.log', '10.0.0.1_nova.pp', 'second.log'):
+            self.assertEqual(archive.read(name), content)
+        first, second = archive.entries(kind='log')
+        self.assertEqual(second['offset'], first['offset'] + first['length'])
+
+    def test_prune_rundirs(self):
+        """Test packstack.modules.archive.prune_rundirs"""
+        old = time.time() - 40 * 24 * 3600
+        names = ('20130101-101010-abcdef', '20130101-111111-ghijkl',
+                 '20991231-101010-mnopqr', 'archive')
+        for name in names:
+            path = os.path.join(self.tempdir, name)
+            os.mkdir(path)
+            if name != names[2]:
+                os.utime(path, (old, old))
+        keep = os.path.join(self.tempdir, names[1])
+        prune_rundirs(30, self.tempdir, keep=[keep])
+        self.assertItemsEqual(os.listdir(self.tempdir), names[1:])
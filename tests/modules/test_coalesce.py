@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import TestCase
+from ..test_base import PackstackTestCaseMixin
+
+from packstack.modules.coalesce import (CombinedManifest, coalesce_groups,
+                                        declarations)
+
+
+NOVA = """class { 'nova::api':
+  enabled => true,
+}
+firewall { '001 nova api':
+  dport => ['8774'],
+}
+"""
+GLANCE = """include glance::api
+
+file { '/etc/glance/policy.json':
+  ensure => present,
+}
+firewall { '001 glance':
+  dport => ['9292'],
+}
+"""
+FIREWALL = """firewall { '001 nova api':
+  dport => ['8775'],
+}
+"""
+
+
+class CoalesceTestCase(PackstackTestCaseMixin, TestCase):
+
+    def test_groups(self):
+        """Test packstack.modules.coalesce.coalesce_groups"""
+        self.assertEqual(declarations(FIREWALL),
+                         set([('firewall', '001 nova api')]))
+        groups = coalesce_groups([('a_nova.pp', NOVA),
+                                  ('a_glance.pp', GLANCE),
+                                  ('a_firewall.pp', FIREWALL)])
+        self.assertEqual(groups, [['a_nova.pp', 'a_glance.pp'],
+                                  ['a_firewall.pp']])
+
+    def test_attribution(self):
+        """Test packstack.modules.coalesce.CombinedManifest"""
+        manifest = CombinedManifest('a_coalesced1.pp', '$global = 1\n\n')
+        manifest.add('a_nova.pp', NOVA)
+        manifest.add('a_glance.pp', GLANCE)
+        self.assertEqual(manifest.content.splitlines()[2],
+                         "class { 'nova::api':")
+        self.assertEqual(manifest.fragment_at(3), 'a_nova.pp')
+        self.assertEqual(manifest.fragment_at(9), 'a_glance.pp')
+        self.assertEqual(manifest.fragment_at(1), None)
+
+        errors = [
+            # compilation failed, nothing was applied
+            'Error: Could not parse for environment production: Syntax '
+            'error at /tmp/x/manifests/a_coalesced1.pp:10 on node a',
+            # by resource
+            "Error: /Stage[main]//File[/etc/glance/policy.json]: Could not "
+            "evaluate",
+            "Error: /Stage[main]/Nova::Api/Firewall[001 nova api]/ensure: "
+            "change failed",
+            # by class included by fragment
+            'Error: /Stage[main]/Glance::Api::Config/Exec[x]: Failed',
+            # unknown origin
+            'Error: Could not retrieve facts',
+        ]
+        result = manifest.split_errors(errors)
+        self.assertEqual(result['a_nova.pp'], [errors[0], errors[2],
+                                               errors[4]])
+        self.assertEqual(result['a_glance.pp'],
+                         [errors[0], errors[1], errors[3], errors[4]])
+
+    def test_compile_failure(self):
+        """Test that failed catalog compilation fails all fragments"""
+        manifest = CombinedManifest('a_coalesced1.pp')
+        manifest.add('a_nova.pp', NOVA)
+        manifest.add('a_glance.pp', GLANCE)
+        error = ('Error: Duplicate declaration: Firewall[001 glance] is '
+                 'already declared in file /tmp/a_coalesced1.pp:2; cannot '
+                 'redeclare at /tmp/a_coalesced1.pp:7 on node a')
+        result = manifest.split_errors([error], finished=False)
+        self.assertEqual(result, {'a_nova.pp': [error],
+                                  'a_glance.pp': [error]})
+        # run which did not finish fails even without recognized error
+        result = manifest.split_errors([], finished=False)
+        self.assertTrue(result['a_nova.pp'] and result['a_glance.pp'])
+        # resource errors of finished run belong to single fragment
+        error = "Error: /Stage[main]//File[/etc/glance/policy.json]: failed"
+        result = manifest.split_errors([error])
+        self.assertEqual(result, {'a_nova.pp': [], 'a_glance.pp': [error]})
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import os
+
+from unittest import TestCase
+from ..test_base import PackstackTestCaseMixin
+
+from packstack.modules import confcache
+from packstack.modules.confcache import cache_key, load_conf, save_conf
+
+
+class ConfCacheTestCase(PackstackTestCaseMixin, TestCase):
+
+    def test_conf_cache(self):
+        """Test packstack.modules.confcache"""
+        answerfile = os.path.join(self.tempdir, 'answers.txt')
+        with open(answerfile, 'w') as fp:
+            fp.write('[general]\nCONFIG_NOVA_HOST=1.1.1.1\n')
+        path = os.path.join(self.tempdir, 'conf_cache.json')
+        key = cache_key(answerfile, [confcache])
+        self.assertEqual(load_conf(key, path), None)
+
+        save_conf(key, {'CONFIG_NOVA_HOST': '1.1.1.1'}, path)
+        conf = load_conf(key, path)
+        self.assertEqual(conf, {'CONFIG_NOVA_HOST': '1.1.1.1'})
+        self.assertTrue(isinstance(conf['CONFIG_NOVA_HOST'], str))
+
+        # values referring to removed files are not valid anymore
+        keyfile = os.path.join(self.tempdir, 'id_rsa.pub')
+        with open(keyfile, 'w') as fp:
+            fp.write('ssh-rsa AAAA')
+        save_conf(key, {'CONFIG_SSH_KEY': keyfile}, path)
+        self.assertEqual(load_conf(key, path), {'CONFIG_SSH_KEY': keyfile})
+        os.remove(keyfile)
+        self.assertEqual(load_conf(key, path), None)
+
+        # changed answer file does not use cached values
+        with open(answerfile, 'a') as fp:
+            fp.write('CONFIG_RATIO=1.5\n')
+        changed = cache_key(answerfile, [confcache])
+        self.assertNotEqual(key, changed)
+        self.assertEqual(load_conf(changed, path), None)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import os
+import urllib2
+
+from unittest import TestCase
+from ..test_base import PackstackTestCaseMixin
+
+from packstack.modules.distribution import (BundleServer, local_address,
+                                            relay_tree, choose_codec,
+                                            compression_profile,
+                                            archive_sample)
+
+
+class DistributionTestCase(PackstackTestCaseMixin, TestCase):
+
+    def test_bundle_server(self):
+        """Test packstack.modules.distribution.BundleServer"""
+        self.assertEqual(local_address('127.0.0.1'), '127.0.0.1')
+        bundle = os.path.join(self.tempdir, 'modules.tar.gz')
+        with open(bundle, 'wb') as fp:
+            fp.write('bundle content')
+        server = BundleServer(['127.0.0.1'])
+        url_path = server.add(bundle)
+        self.assertTrue(url_path.endswith('/modules.tar.gz'))
+        server.start()
+        try:
+            fp = urllib2.urlopen(server.url('127.0.0.1', url_path))
+            self.assertEqual(fp.read(), 'bundle content')
+            # only published bundles are served
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                              server.url('127.0.0.1', '/modules.tar.gz'))
+        finally:
+            server.stop()
+
+    def test_relay_tree(self):
+        """Test packstack.modules.distribution.relay_tree"""
+        hosts = ['h%d' % i for i in range(8)]
+        self.assertEqual(relay_tree(hosts, 2), [
+            [('h0', None), ('h1', None)],
+            [('h2', 'h0'), ('h3', 'h0'), ('h4', 'h1'), ('h5', 'h1')],
+            [('h6', 'h2'), ('h7', 'h2')],
+        ])
+        self.assertEqual(relay_tree(hosts[:3], 5),
+                         [[('h0', None), ('h1', None), ('h2', None)]])
+
+    def test_choose_codec(self):
+        """Test packstack.modules.distribution.choose_codec"""
+        path = os.path.join(self.tempdir, 'init.pp')
+        with open(path, 'wb') as fp:
+            fp.write('class nova { }\n' * 10000)
+        members = [(path, 'nova/manifests/init.pp')]
+        sample = archive_sample(members, sample_size=4096)
+        self.assertEqual(len(sample), 4096)
+        self.assertIn('nova/manifests/init.pp', sample)
+        profile = compression_profile(members)
+        self.assertEqual(sorted(profile), ['best', 'fast', 'none'])
+        self.assertEqual(profile['none'], (1.0, None))
+        self.assertTrue(profile['best'][0] < 0.1)
+
+        # (ratio, bytes per second)
+        profile = {'none': (1.0, None), 'fast': (0.3, 100e6),
+                   'best': (0.2, 10e6)}
+        self.assertEqual(choose_codec(profile, 1e6), 'best')
+        self.assertEqual(choose_codec(profile, 10e6), 'fast')
+        self.assertEqual(choose_codec(profile, 1e9), 'none')
+        self.assertEqual(choose_codec(profile, None), 'fast')
@@ -19,7 +19,9 @@ import os
 from unittest import TestCase
 
 from ..test_base import PackstackTestCaseMixin
-from packstack.modules.ospluginutils import gethostlist
+from packstack.modules.ospluginutils import (gethostlist, template_keys,
+                                             ManifestFiles, TemplateIndex,
+                                             assigned_conf_keys)
 
 
 class OSPluginUtilsTestCase(PackstackTestCaseMixin, TestCase):
@@ -29,3 +31,74 @@ class OSPluginUtilsTestCase(PackstackTestCaseMixin, TestCase):
         hosts = gethostlist(conf)
         hosts.sort()
         self.assertEquals(['1.1.1.1', '2.2.2.2', '3.3.3.3'], hosts)
+
+    def test_template_keys(self):
+        template = ("class { 'nova': ratio => '%(CONFIG_RATIO)s',\n"
+                    "host => '%(CONFIG_NOVA_HOST)s',\n"
+                    "x => '%(CONFIG_RATIO)s' }")
+        self.assertEquals(template_keys(template),
+                          set(['CONFIG_RATIO', 'CONFIG_NOVA_HOST']))
+        self.assertEquals(template_keys("id => '%%(tenant_id)s'"), set())
+
+    def test_manifest_keys(self):
+        manifests = ManifestFiles()
+        manifests.global_keys = set(['TIMEOUT'])
+        manifests.useKeys(['A', 'B'])
+        manifests.useKeys(['C'])
+        manifests.addFile('host_nova.pp', 'nova', 'data')
+        manifests.addFile('host_nova.pp', 'nova', 'more data')
+        manifests.addFile('host_mysql.pp', 'mysql', 'data')
+        self.assertEquals(manifests.getKeys('host_nova.pp'),
+                          set(['A', 'B', 'C', 'TIMEOUT']))
+        self.assertEquals(manifests.getKeys('host_mysql.pp'),
+                          set(['TIMEOUT']))
+
+    def test_template_index(self):
+        with open(os.path.join(self.tempdir, 'nova.pp'), 'w') as fp:
+            fp.write("host => '%(NOVA_HOST)s', pw => '%(PW)s'")
+        with open(os.path.join(self.tempdir, 'glance.pp'), 'w') as fp:
+            fp.write("pw => '%(PW)s', id => '%%(tenant_id)s'")
+        index = TemplateIndex(self.tempdir)
+        self.assertEquals(index.getKeys('nova.pp'),
+                          set(['NOVA_HOST', 'PW']))
+        self.assertEquals(index.getUsers('PW'),
+                          set(['nova.pp', 'glance.pp']))
+        self.assertEquals(index.missingKeys(set(['PW'])),
+                          {'NOVA_HOST': set(['nova.pp'])})
+        # templates using inactive keys are not checked
+        self.assertEquals(index.missingKeys(set(), set(['NOVA_HOST'])),
+                          {'PW': set(['glance.pp'])})
+
+        conf = {'NOVA_HOST': '1.1.1.1', 'PW': 'secret'}
+        self.assertEquals(index.render('nova.pp', conf),
+                          "host => '1.1.1.1', pw => 'secret'")
+        self.assertEquals(index.render('glance.pp', conf),
+                          "pw => 'secret', id => '%(tenant_id)s'")
+        self.assertEquals(len(index.rendered), 2)
+        index.render('nova.pp', dict(conf, UNUSED='x'))
+        self.assertEquals(len(index.rendered), 2)
+        conf['PW'] = 'changed'
+        self.assertEquals(index.render('nova.pp', conf),
+                          "host => '1.1.1.1', pw => 'changed'")
+        self.assertRaises(KeyError, index.render, 'nova.pp', {'PW': 'x'})
+
+    def test_assigned_conf_keys(self):
+        source = """
+def create_manifest(config):
+    config['CONFIG_A'] = 'a'
+    controller.CONF["CONFIG_B"] = 'b'
+    host_var = 'CONFIG_C'
+    config[host_var] = 'c'
+    for key, value in [('CONFIG_D', 1), ('CONFIG_E', 2)]:
+        config[key] = config.get(key, value)
+    config['CONFIG_F'], config['CONFIG_G'] = 'f', 'g'
+    other['CONFIG_H'] = 'h'
+    if config['CONFIG_I'] == 'y':
+        print 'CONFIG_J'
+
+def other(config):
+    config[host_var] = 'x'
+"""
+        self.assertEquals(assigned_conf_keys(source),
+                          set(['CONFIG_A', 'CONFIG_B', 'CONFIG_C', 'CONFIG_D',
+                               'CONFIG_E', 'CONFIG_F', 'CONFIG_G']))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+from unittest import TestCase
+
+from ..test_base import PackstackTestCaseMixin
+from packstack.modules.plan import *
+
+
+class PlanTestCase(PackstackTestCaseMixin, TestCase):
+    def setUp(self):
+        super(PlanTestCase, self).setUp()
+        self.files = [('1.1.1.1_prescript.pp', ''),
+                      ('2.2.2.2_prescript.pp', ''),
+                      ('1.1.1.1_mysql.pp', 'mysql'),
+                      ('1.1.1.1_nova.pp', 'nova'),
+                      ('1.1.1.1_neutron.pp', 'nova'),
+                      ('2.2.2.2_nova.pp', 'nova')]
+        self.timings = {'prescript.pp': [10, 20], 'mysql.pp': [30],
+                        'nova.pp': [40], 'neutron.pp': [50]}
+
+    def test_group_stages(self):
+        """Test packstack.modules.plan.group_stages"""
+        stages = group_stages(self.files)
+        self.assertEqual(len(stages), 3)
+        self.assertListEqual([i[0] for i in stages], ['', 'mysql', 'nova'])
+        self.assertListEqual(stages[2][1], ['1.1.1.1_nova.pp',
+                                            '1.1.1.1_neutron.pp',
+                                            '2.2.2.2_nova.pp'])
+
+    def test_timings(self):
+        """Test packstack.modules.plan timing history"""
+        path = os.path.join(self.tempdir, 'timings.json')
+        timings = load_timings(path)
+        self.assertEqual(timings, {})
+        for i in range(TIMINGS_KEEP + 2):
+            record_timing(timings, 'nova.pp', i)
+        save_timings(timings, path)
+        timings = load_timings(path)
+        self.assertEqual(len(timings['nova.pp']), TIMINGS_KEEP)
+        self.assertEqual(estimate_duration(timings, 'nova.pp'), 4)
+        self.assertIsNone(estimate_duration(timings, 'mysql.pp'))
+        self.assertEqual(manifest_key('1.1.1.1', '1.1.1.1_nova.pp'),
+                         'nova.pp')
+
+    def test_plan(self):
+        """Test packstack.modules.plan.DeploymentPlan"""
+        plan = DeploymentPlan(['1.1.1.1', '2.2.2.2'], self.files,
+                              self.timings)
+        plan.add_transfer('1.1.1.1', 2048)
+        plan.add_transfer('1.1.1.1', 1024, resource=True)
+        # manifests on the same host are serialized by flock
+        self.assertEqual(plan.duration(), (15 + 30 + 90, 0))
+        self.assertEqual(plan.manifest_count('1.1.1.1'), 4)
+        self.assertEqual(plan.ssh_sessions('1.1.1.1'), 4 + 1 + 2 * 4)
+        self.assertEqual(plan.ssh_sessions('2.2.2.2'), 4 + 2 * 2)
+
+        rendered = plan.render()
+        self.assertIn('Stage 3 (marker: nova, estimated duration: 0:01:30)',
+                      rendered)
+        self.assertIn('1.1.1.1: 4 manifests, 3.0 KB to transfer', rendered)
+        self.assertIn('Estimated duration: 0:02:15', rendered)
+
+        plan = DeploymentPlan(['1.1.1.1', '2.2.2.2'], self.files, {})
+        self.assertEqual(plan.duration(), (0, 6))
+
+        # host name contained in name of other host's manifest
+        plan = DeploymentPlan(['1.1.1.1', '11.1.1.1'],
+                              [('1.1.1.1_nova.pp', ''),
+                               ('11.1.1.1_nova.pp', '')], {})
+        self.assertEqual(plan.manifest_count('1.1.1.1'), 1)
@@ -16,12 +16,19 @@
 # under the License.
 
 import os
+import sys
 
 from unittest import TestCase
 from ..test_base import PackstackTestCaseMixin
 
 from packstack.installer.exceptions import PuppetError
-from packstack.modules.puppet import validate_logfile, scan_logfile
+from packstack.modules.puppet import (analyze_logfile, validate_logfile,
+                                      scan_logfile, scan_runtime, prefilter,
+                                      iter_interesting_lines, load_summary,
+                                      RuleSet, load_rules, record_hits,
+                                      frequent_rules, analyze,
+                                      PuppetLogResult)
+from packstack.modules import puppetlog
 
 
 class PuppetTestCase(PackstackTestCaseMixin, TestCase):
@@ -60,3 +67,162 @@ class PuppetTestCase(PackstackTestCaseMixin, TestCase):
             sr_msg = ("Package openvswitch has not been found in enabled Yum "
                       "repos")
             assert sr_msg in ex_msg
+
+    def test_scan_runtime(self):
+        """Test packstack.modules.scan_runtime"""
+        filename = os.path.join(self.tempdir, "puppet.log")
+        with open(filename, "w") as fp:
+            fp.write("Notice: Finished catalog run in 45.32 seconds\n")
+        self.assertEqual(scan_runtime(filename), 45.32)
+        with open(filename, "w") as fp:
+            fp.write("Everything went ok")
+        self.assertIsNone(scan_runtime(filename))
+
+    def test_analyze_logfile(self):
+        """Test packstack.modules.analyze_logfile"""
+        filename = os.path.join(self.tempdir, "10.0.0.1_nova.pp.log")
+        with open(filename, "w") as fp:
+            fp.write(
+                "Warning: Config file /etc/puppet/hiera.yaml not found\n"
+                "Notice: /Stage[main]/Nova/Package[nova-common]/ensure: "
+                "created\n"
+                "Notice: /Stage[main]/Nova/Package[nova-api]/ensure: "
+                "created\n"
+                "Notice: /Stage[main]/Nova::Api/Service[nova-api]/ensure: "
+                "ensure changed 'stopped' to 'running'\n"
+                "notice: /Stage[main]//Notify[packstack_info]/message: "
+                "defined 'message' as 'Compute is ready'\n"
+                "err: Could not prefetch database_grant provider 'mysql': "
+                "Could not open required defaults file: /root/.my.cnf\n"
+                "Notice: Finished catalog run in 5.50 seconds\n")
+        result = analyze_logfile(filename)
+        self.assertEqual(result.manifest, "10.0.0.1_nova.pp")
+        self.assertEqual(result.resources, {"Package": 2, "Service": 1})
+        self.assertListEqual(result.notices, ["Compute is ready"])
+        self.assertListEqual(result.warnings, [
+            "Config file /etc/puppet/hiera.yaml not found"])
+        self.assertEqual(len(result.ignored), 1)
+        self.assertListEqual(result.errors, [])
+        self.assertEqual(result.runtime, 5.5)
+        result.validate()
+
+        with open(filename, "a") as fp:
+            fp.write("err: /Stage[main]/Vswitch::Ovs/Package[openvswitch]/"
+                     "ensure: change from absent to present failed: "
+                     "Execution of '/usr/bin/yum -d 0 -e 0 -y install "
+                     "openvswitch' returned 1: Error: Nothing to do\n")
+        result = analyze_logfile(filename)
+        self.assertListEqual(result.errors, [
+            "Package openvswitch has not been found in enabled Yum repos."])
+        self.assertRaises(PuppetError, result.validate)
+
+    def test_prefilter(self):
+        """Test packstack.modules.prefilter"""
+        self.assertEqual(prefilter(r'^Invalid tag|.+\(LoadError\)|'
+                                   r'[Nn]otice: |/bin/puppet:\d+: .+|'
+                                   r'\d+ errors|abc?'),
+                         r'Invalid\ tag|\(LoadError\)|otice\:\ |'
+                         r'\/bin\/puppet\:|\d+ errors|ab')
+
+    def test_iter_interesting_lines(self):
+        """Test packstack.modules.iter_interesting_lines"""
+        filename = os.path.join(self.tempdir, "puppet.log")
+        lines = ["debug: nothing interesting\n",
+                 "Notice: /Stage[main]/Nova/Package[nova]/ensure: created\n",
+                 "debug: err: and Error: on the same line\n",
+                 "info: still nothing\n",
+                 "Warning: last line without newline"]
+        with open(filename, "w") as fp:
+            fp.write(''.join(lines))
+        expected = [lines[1], lines[2], lines[4]]
+        # chunks smaller than lines have to work too
+        for chunk_size in (1, 7, 30, 1024):
+            found = list(iter_interesting_lines(filename, chunk_size))
+            self.assertListEqual(found, expected)
+        with open(filename, "w") as fp:
+            fp.write('')
+        self.assertListEqual(list(iter_interesting_lines(filename)), [])
+
+    def test_iter_interesting_lines_anchored(self):
+        """Test anchored rules without literal match every line"""
+        ruleset = RuleSet()
+        ruleset.add('anchored', 'error', r'^\w+ failed$')
+        filename = os.path.join(self.tempdir, "puppet.log")
+        lines = ["debug: nothing interesting\n",
+                 "Service failed\n",
+                 "info: still nothing\n",
+                 "Mount failed\n"]
+        with open(filename, "w") as fp:
+            fp.write(''.join(lines))
+        expected = [lines[1], lines[3]]
+        for chunk_size in (1, 30, 1024):
+            found = list(iter_interesting_lines(filename, chunk_size,
+                                                ruleset=ruleset))
+            self.assertListEqual(found, expected)
+
+    def test_load_summary(self):
+        """Test packstack.modules.load_summary"""
+        logpath = os.path.join(self.tempdir, "10.0.0.1_nova.pp.finished")
+        summary = os.path.join(self.tempdir, "10.0.0.1_nova.pp.summary")
+        with open(logpath, "w") as fp:
+            fp.write("notice: /Stage[main]//Notify[packstack_info]/message: "
+                     "defined 'message' as 'Compute is ready'\n"
+                     "Error: Could not start Service[nova-api]\n"
+                     "Notice: Finished catalog run in 5.50 seconds\n")
+        # analyzer is executed as a script on hosts, so real Popen is used
+        script = "%s.py" % os.path.splitext(puppetlog.__file__)[0]
+        with open(summary, "w") as fp:
+            self._Popen([sys.executable, script, logpath], stdout=fp,
+                        close_fds=True).wait()
+        result = load_summary(summary, "nova.log")
+        self.assertEqual(result.manifest, "10.0.0.1_nova.pp")
+        self.assertEqual(result.logpath, "nova.log")
+        self.assertListEqual(result.notices, ["Compute is ready"])
+        self.assertEqual(result.runtime, 5.5)
+        self.assertEqual(len(result.errors), 1)
+        self.assertRaises(PuppetError, result.validate)
+        # summary of failed analysis
+        with open(summary, "w") as fp:
+            fp.write("")
+        self.assertIsNone(load_summary(summary, "nova.log"))
+        self.assertIsNone(load_summary(logpath + ".missing", "nova.log"))
+
+    def test_rules(self):
+        """Test packstack.modules.RuleSet"""
+        ruleset = load_rules()
+        ruleset.add('test-ignore', 'ignore', r'^err: (?P<x>\w+) is fine')
+        ruleset.add('test-surrogate', 'surrogate', r'Service\[(?P<arg1>.*)\]',
+                    message='Service %(arg1)s failed')
+        self.assertRaises(ValueError, ruleset.add, 'x', 'unknown', 'x')
+        self.assertRaises(ValueError, ruleset.add, 'x', 'surrogate', 'x')
+        self.assertEqual(ruleset.first('error', 'Error: oops'), 'error')
+        self.assertEqual(ruleset.first('ignore', 'err: nova is fine'),
+                         'test-ignore')
+        self.assertIsNone(ruleset.first('ignore', 'err: nova is broken'))
+
+        filename = os.path.join(self.tempdir, "puppet.log")
+        with open(filename, "w") as fp:
+            fp.write("err: nova is fine\n"
+                     "err: glance is fine\n"
+                     "Error: Could not start Service[nova-api]\n")
+        result = analyze(PuppetLogResult(filename), ruleset)
+        self.assertEqual(len(result.ignored), 2)
+        self.assertListEqual(result.errors, ["Service nova-api failed"])
+        self.assertEqual(result.hits, {'err': 2, 'error': 1,
+                                       'test-ignore': 2,
+                                       'test-surrogate': 1})
+
+        # rules are transferred to hosts in JSON file
+        rulespath = os.path.join(self.tempdir, "rules.json")
+        ruleset.save(rulespath)
+        self.assertListEqual(load_rules(rulespath).rules, ruleset.rules)
+        # missing rules file must not silently disable error detection
+        self.assertRaises(IOError, load_rules,
+                          os.path.join(self.tempdir, "missing.json"))
+
+        stats = {}
+        record_hits(stats, result.hits)
+        record_hits(stats, {'test-ignore': 1})
+        self.assertEqual(stats['test-ignore'], {'hits': 3, 'runs': 2})
+        self.assertListEqual(frequent_rules(stats, ruleset=ruleset),
+                             [('test-ignore', 3, 2)])
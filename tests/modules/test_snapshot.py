@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+from unittest import TestCase
+from ..test_base import PackstackTestCaseMixin
+
+from packstack.modules.snapshot import (load_snapshot, save_snapshot,
+                                        diff_conf, affected_manifests,
+                                        update_snapshot)
+
+
+class SnapshotTestCase(PackstackTestCaseMixin, TestCase):
+
+    def test_diff_conf(self):
+        """Test packstack.modules.snapshot.diff_conf"""
+        old = {'A': 'y', 'B': '1.1.1.1', 'C': 'x'}
+        new = {'A': 'y', 'B': '1.1.1.1,2.2.2.2', 'D': 'z'}
+        self.assertEqual(diff_conf(old, new), set(['B', 'C', 'D']))
+        self.assertEqual(diff_conf(old, old), set())
+
+    def test_affected_manifests(self):
+        """Test packstack.modules.snapshot.affected_manifests"""
+        path = os.path.join(self.tempdir, 'snapshot.json')
+        snapshot = load_snapshot(path)
+        conf = {'CONFIG_NOVA_HOST': '1.1.1.1', 'CONFIG_RATIO': '1.5'}
+        manifests = {'1.1.1.1_nova.pp': ('a', ['CONFIG_RATIO']),
+                     '1.1.1.1_mysql.pp': ('b', ['CONFIG_NOVA_HOST'])}
+        # everything is applied by the first run
+        self.assertEqual(affected_manifests(snapshot, conf, manifests),
+                         {'1.1.1.1_nova.pp': 'not applied yet',
+                          '1.1.1.1_mysql.pp': 'not applied yet'})
+        update_snapshot(snapshot, conf, manifests,
+                        {'1.1.1.1_nova.pp': 'ok', '1.1.1.1_mysql.pp': 'ok'})
+        save_snapshot(snapshot, path)
+        snapshot = load_snapshot(path)
+        self.assertEqual(affected_manifests(snapshot, conf, manifests), {})
+
+        # changed key selects manifests using it, changed content
+        # selects manifest regardless of keys
+        conf = dict(conf, CONFIG_RATIO='2.0')
+        manifests['1.1.1.1_mysql.pp'] = ('c', ['CONFIG_NOVA_HOST'])
+        manifests['2.2.2.2_nova.pp'] = ('a', ['CONFIG_RATIO'])
+        self.assertEqual(affected_manifests(snapshot, conf, manifests),
+                         {'1.1.1.1_nova.pp': 'changed CONFIG_RATIO',
+                          '1.1.1.1_mysql.pp': 'content changed',
+                          '2.2.2.2_nova.pp': 'not applied yet'})
+
+        # configuration is not saved when any manifest failed
+        update_snapshot(snapshot, conf, manifests,
+                        {'1.1.1.1_nova.pp': 'ok', '1.1.1.1_mysql.pp': 'ok',
+                         '2.2.2.2_nova.pp': 'failed'})
+        self.assertEqual(snapshot['conf']['CONFIG_RATIO'], '1.5')
+        self.assertNotIn('2.2.2.2_nova.pp', snapshot['manifests'])
+        update_snapshot(snapshot, conf, manifests,
+                        {'1.1.1.1_nova.pp': 'skipped',
+                         '1.1.1.1_mysql.pp': 'skipped',
+                         '2.2.2.2_nova.pp': 'ok'})
+        self.assertEqual(snapshot['conf']['CONFIG_RATIO'], '2.0')
+        self.assertEqual(affected_manifests(snapshot, conf, manifests), {})
+
+    def test_modules_and_hosts(self):
+        """Test that changed modules and reinstalled hosts are applied"""
+        path = os.path.join(self.tempdir, 'snapshot.json')
+        snapshot = load_snapshot(path, 'answers.txt')
+        conf = {'CONFIG_RATIO': '1.5'}
+        manifests = {'1.1.1.1_nova.pp': ('a', ['CONFIG_RATIO']),
+                     '2.2.2.2_nova.pp': ('a', ['CONFIG_RATIO'])}
+        hosts = {'1.1.1.1_nova.pp': 'id1', '2.2.2.2_nova.pp': 'id2'}
+        update_snapshot(snapshot, conf, manifests,
+                        {'1.1.1.1_nova.pp': 'ok', '2.2.2.2_nova.pp': 'ok'},
+                        'modules1', hosts)
+        save_snapshot(snapshot, path, 'answers.txt')
+        snapshot = load_snapshot(path, 'answers.txt')
+        self.assertEqual(affected_manifests(snapshot, conf, manifests,
+                                            'modules1', hosts), {})
+
+        # upgraded Puppet modules
+        self.assertEqual(affected_manifests(snapshot, conf, manifests,
+                                            'modules2', hosts),
+                         {'1.1.1.1_nova.pp': 'Puppet modules changed',
+                          '2.2.2.2_nova.pp': 'Puppet modules changed'})
+        # host reinstalled with the same address
+        reinstalled = dict(hosts, **{'2.2.2.2_nova.pp': 'id3'})
+        self.assertEqual(affected_manifests(snapshot, conf, manifests,
+                                            'modules1', reinstalled),
+                         {'2.2.2.2_nova.pp': 'host changed'})
+
+        # other deployments don't share results
+        other = load_snapshot(path, 'other.txt')
+        self.assertEqual(affected_manifests(other, conf, manifests,
+                                            'modules1', hosts),
+                         {'1.1.1.1_nova.pp': 'not applied yet',
+                          '2.2.2.2_nova.pp': 'not applied yet'})
+        save_snapshot(other, path, 'other.txt')
+        snapshot = load_snapshot(path, 'answers.txt')
+        self.assertIn('1.1.1.1_nova.pp', snapshot['manifests'])
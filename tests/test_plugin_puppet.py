@@ -0,0 +1,45 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import TestCase
+
+from test_base import PackstackTestCaseMixin
+from packstack.plugins import puppet_950
+
+
+class PuppetPluginTestCase(PackstackTestCaseMixin, TestCase):
+    def setUp(self):
+        super(PuppetPluginTestCase, self).setUp()
+        puppet_950.module_cache_hits.clear()
+
+    def test_module_cache(self):
+        """Test reuse of Puppet modules cached on hosts"""
+        self.assertEqual(puppet_950.checkModuleCaches(['1.1.1.1'], 'abc'),
+                         set())
+        self.fake_popen.stdout = 'cached\n'
+        self.assertEqual(puppet_950.checkModuleCaches(['1.1.1.1'], 'abc'),
+                         set(['1.1.1.1']))
+        cache = '%s/abc' % puppet_950.MODULE_CACHE_DIR
+        self.assertTrue('test -d %s' % cache in self.fake_popen.data)
+
+        host_dir = '/var/tmp/packstack/run1'
+        staging = puppet_950.moduleStaging(host_dir, 'abc')
+        self.assertEqual(staging, '%s.tmp-run1' % cache)
+        self.fake_popen.data = ''
+        puppet_950._linkCachedModules('1.1.1.1', host_dir, 'abc', staging)
+        self.assertTrue('mv %s %s' % (staging, cache) in self.fake_popen.data)
+        self.assertTrue('cp -al %s/. %s/modules/' % (cache, host_dir)
+                        in self.fake_popen.data)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Microbenchmark of packstack.installer.utils.SortedDict against dictionary
+keeping key order in a list, which SortedDict used to do:
+
+    python tools/bench_sorteddict.py [<count of keys>]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from packstack.installer.utils import SortedDict
+
+
+class ListSortedDict(dict):
+    """
+    Dictionary keeping key order in a list.
+    """
+    def __init__(self):
+        super(ListSortedDict, self).__init__()
+        self.keyOrder = []
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.keyOrder.append(key)
+        super(ListSortedDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super(ListSortedDict, self).__delitem__(key)
+        self.keyOrder.remove(key)
+
+    def __iter__(self):
+        return iter(self.keyOrder)
+
+    def insert(self, index, key, value):
+        if key in self.keyOrder:
+            n = self.keyOrder.index(key)
+            del self.keyOrder[n]
+            if n < index:
+                index -= 1
+        self.keyOrder.insert(index, key)
+        super(ListSortedDict, self).__setitem__(key, value)
+
+
+def fill(cls, count):
+    data = cls()
+    for i in xrange(count):
+        data[i] = i
+    return data
+
+
+def delete_all(cls, count):
+    data = fill(cls, count)
+    for i in xrange(count):
+        del data[i]
+
+
+def delete_from_end(cls, count):
+    data = fill(cls, count)
+    for i in xrange(count - 1, -1, -1):
+        del data[i]
+
+
+def insert_first(cls, count):
+    data = cls()
+    for i in xrange(count):
+        data.insert(0, i, i)
+
+
+def iterate(cls, count):
+    data = fill(cls, count)
+    for key in data:
+        pass
+
+
+def main(argv):
+    count = len(argv) > 1 and int(argv[1]) or 10000
+    print '%-16s %12s %12s' % ('operation', 'list', 'linked')
+    for func in (fill, iterate, delete_all, delete_from_end, insert_first):
+        times = []
+        for cls in (ListSortedDict, SortedDict):
+            times.append(min(timeit.repeat(lambda: func(cls, count),
+                                           number=1, repeat=3)))
+        print '%-16s %11.4fs %11.4fs' % (func.__name__, times[0], times[1])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))